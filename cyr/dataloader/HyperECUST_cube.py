@@ -0,0 +1,159 @@
+"""
+Packed hyperspectral cube store for the HyperECUST Multi samples.
+
+The `ECUST_112x96` tree is converted once into
+    - {cube}.npy: uint8 array of shape (N, C, H, W), saved in `.npy` format
+                  so that it can be opened with `np.load(..., mmap_mode='r')`
+    - {cube}.txt: sidecar index, one line per sample
+                  `path \t label \t band,band,...`
+where `path` is the sample directory relative to the dataset root (starting
+with `DATAx/`), `label` is the subject id and the band list records the bands
+present in that sample. Channel `c` of the cube holds band `bands[c]`, the sorted
+union of all bands in the tree; missing bands are left as zeros.
+"""
+import os
+import glob
+import cv2
+import numpy as np
+
+
+def get_id(x): return int(x.split('/')[1])
+
+
+def get_band(x): return int(x.split('_')[-1].split('.')[0])
+
+
+def get_cube_paths(cube_path):
+    """ returns the paths of the array file and the sidecar index """
+    cube_path = os.path.expanduser(cube_path)
+    root = cube_path[:-4] if cube_path.endswith('.npy') else cube_path
+    return root + '.npy', root + '.txt'
+
+
+def get_multi_dirs(dataset_path):
+    """ find all the Multi sample directories, relative to `dataset_path` """
+    dataset_path = os.path.expanduser(dataset_path)
+    filenames = glob.glob(os.path.join(
+        dataset_path, 'DATA*/*/Multi/**/*.JPG'), recursive=True)
+    filenames = [x[x.find('DATA'):] for x in filenames]
+    return sorted(np.unique([os.path.dirname(x) for x in filenames]))
+
+
+def pack_cube(dataset_path, cube_path, facesize=None):
+    """ convert the Multi samples of a HyperECUST tree into a packed cube
+
+    Params:
+        dataset_path:   {str} root of the tree, e.g. '~/myDataset/ECUST_112x96'
+        cube_path:      {str} output path, `.npy` and `.txt` will be written
+        facesize:       {tuple/list[H, W]} resize the images if not None
+    """
+    dataset_path = os.path.expanduser(dataset_path)
+    npy_path, txt_path = get_cube_paths(cube_path)
+    filedirs = get_multi_dirs(dataset_path)
+    assert len(filedirs) != 0, 'could not find multi samples in {}!'.format(
+        dataset_path)
+    # collect the bands of each sample
+    samples = []
+    for filedir in filedirs:
+        filenames = glob.glob(os.path.join(dataset_path, filedir, '*.JPG'))
+        samples.append({get_band(x): x for x in filenames})
+    bands = sorted(set(b for s in samples for b in s.keys()))
+    channels = dict(zip(bands, range(len(bands))))
+    if facesize is None:
+        image = cv2.imread(list(samples[0].values())[0], cv2.IMREAD_GRAYSCALE)
+        facesize = image.shape[:2]
+    h, w = facesize
+    # write the cube
+    cube = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.uint8,
+                                     shape=(len(filedirs), len(bands), h, w))
+    f = open(txt_path, 'w')
+    for i, (filedir, sample) in enumerate(zip(filedirs, samples)):
+        for band, filename in sample.items():
+            image = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+            if image is None:
+                print(filename)
+                raise ValueError
+            if image.shape[:2] != (h, w):
+                image = cv2.resize(image, (w, h))
+            cube[i, channels[band]] = image
+        sample_bands = ','.join([str(b) for b in sorted(sample.keys())])
+        f.write('\t'.join([filedir, str(get_id(filedir)), sample_bands]) + '\n')
+        print('sample [{}/{}], {} bands, {}'.format(i + 1, len(filedirs),
+                                                   len(sample), filedir))
+    f.close()
+    cube.flush()
+    del cube
+    print('cube {} saved in {}'.format(
+        (len(filedirs), len(bands), h, w), npy_path))
+    return npy_path, txt_path
+
+
+class HyperECUSTCube(object):
+    """ read-only access to a packed cube
+
+    The array is memory-mapped lazily on first access, so that the object can be
+    handed to DataLoader workers without copying the cube into each of them.
+    """
+
+    def __init__(self, cube_path):
+        self.npy_path, self.txt_path = get_cube_paths(cube_path)
+        self.index = dict()
+        self.labels = []
+        self.sample_bands = []
+        with open(self.txt_path, 'r') as f:
+            lines = f.read().splitlines()
+        for i, line in enumerate(lines):
+            path, label, sample_bands = line.split('\t')
+            self.index[path] = i
+            self.labels.append(int(label))
+            self.sample_bands.append(
+                set([int(b) for b in sample_bands.split(',')]))
+        self.bands = sorted(set(b for s in self.sample_bands for b in s))
+        self.channels = dict(zip(self.bands, range(len(self.bands))))
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.load(self.npy_path, mmap_mode='r')
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, filedir):
+        return os.path.normpath(filedir) in self.index
+
+    def get_channels(self, bands):
+        """ returns the channel indexes of `bands` in the cube """
+        for band in bands:
+            assert band in self.channels, 'band {} is not in cube!'.format(band)
+        return np.array([self.channels[b] for b in sorted(bands)])
+
+    def get_image(self, filedir, bands):
+        """
+        Params:
+            filedir:    {str} sample directory, relative to the dataset root
+            bands:      {list[int]}
+        Returns:
+            image:      {ndarray(H, W, C)} uint8, bands sorted ascending
+        """
+        i = self.index[os.path.normpath(filedir)]
+        missing = set(bands) - self.sample_bands[i]
+        assert len(missing) == 0, 'could not get bands {} of {}!'.format(
+            sorted(missing), filedir)
+        image = self.data[i, self.get_channels(bands)]
+        return image.transpose(1, 2, 0)
+
+
+if __name__ == '__main__':
+    dataset_path = '~/myDataset/ECUST_112x96/'  # Your HyperECUST dataset path
+    cube_path = '~/myDataset/ECUST_112x96_multi.npy'
+    pack_cube(dataset_path, cube_path)
+    cube = HyperECUSTCube(cube_path)
+    print('cube shape {}, bands {}'.format(cube.data.shape, cube.bands))
@@ -15,7 +15,11 @@ from torchvision.transforms import ToTensor
 import matplotlib.pyplot as plt
 sys.path.append(os.path.dirname(__file__))
 from vis_utils import show_result
-from noise import addsalt_pepper
+from noise import addsalt_pepper, BatchNoise
+from HyperECUST_cube import HyperECUSTCube
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '../../datasets/HyperECUST'))
+from detect_index import getDicts as getDetectIndex
 
 
 def get_id(x): return int(x.split('/')[1])
@@ -34,14 +38,27 @@ def get_path_from_band_range(data_list, band_list):
     return rel
 
 
+def get_image_from_cube(cube, filedir, bands, facesize=None, equalization=False):
+    """ read the bands of a sample from a packed cube, see `HyperECUST_cube.py`
+    Returns:
+        images: {ndarray(H, W, C)}
+    """
+    images = cube.get_image(filedir, bands)
+    if not (equalization or facesize is not None):
+        return np.ascontiguousarray(images)
+    images_ = []
+    for i in range(images.shape[2]):
+        image = np.ascontiguousarray(images[:, :, i])
+        if equalization:
+            image = cv2.equalizeHist(image)
+        if facesize is not None:
+            image = cv2.resize(image, facesize[::-1])
+        images_.append(image)
+    return np.stack(images_, 2)
+
+
 def getDicts(dataset_path):
-    dicts = dict()
-    for vol in ["DATA%d" % _ for _ in range(1, 10)]:
-        txtfile = os.path.join(dataset_path, vol, "detect.txt")
-        if os.path.isfile(txtfile):
-            with open(txtfile, 'r') as f:
-                dicts[vol] = eval(f.read())
-    return dicts
+    return getDetectIndex(dataset_path, range(1, 10), strict=False)
 
 
 def convert_to_square(bbox):
@@ -97,11 +114,17 @@ def hisEqulColor(img):
 class HyperECUST_FV(Dataset):
     def __init__(self, dataset_path, pairs_path,
                  facesize=None, cropped_by_bbox=False,
-                 equalization=False, snr=1.0, mode='train'):
+                 equalization=False, snr=1.0, mode='train', unique_images=False, noise=None):
         """
         Params:
             facesize:   {tuple/list[H, W]}
             mode:       {str} 'train', 'valid'
+            unique_images: {bool} iterate over the unique images of the pairs
+                        instead of the pairs, see `self.imageList` and `self.pairs`
+            noise:      {BatchNoise} seeded noise of the raw images, before the
+                        crop, equalization and resize, instead of
+                        `addsalt_pepper(image, snr)`, e.g.
+                        `BatchNoise('salt_pepper', seed=0, SNR=snr)`
         """
         self.dataset_path = os.path.expanduser(dataset_path)
         self.pairs_path = os.path.expanduser(pairs_path)
@@ -110,6 +133,8 @@ class HyperECUST_FV(Dataset):
         self.equalization = equalization
         self.snr = snr
         self.mode = mode
+        self.unique_images = unique_images
+        self.noise = noise
         self.dicts = getDicts(self.dataset_path)
         self.parseList(self.pairs_path)
 
@@ -131,6 +156,11 @@ class HyperECUST_FV(Dataset):
             self.folds.append(fold)
             self.flags.append(flag)
         # print(nameLs)
+        # unique images, each pair is (index of left, index of right) in imageList
+        imageList, inverse = np.unique(self.nameLs + self.nameRs,
+                                       return_inverse=True)
+        self.imageList = imageList.tolist()
+        self.pairs = inverse.reshape(2, -1).T
         return
 
     def get_bbox(self, filename):
@@ -145,20 +175,28 @@ class HyperECUST_FV(Dataset):
         square_bbox = convert_to_square(np.array([bbox]))
         return square_bbox
 
+    def add_noise(self, image):
+        """ `self.noise` on one raw image {ndarray(H, W) or (H, W, C)}, as `addsalt_pepper` """
+        x = image.reshape(image.shape[:2] + (-1,)).transpose(2, 0, 1)[np.newaxis]
+        x = self.noise(x)[0].transpose(1, 2, 0)
+        return np.ascontiguousarray(x.reshape(image.shape))
+
     def get_image(self, filename):
         filename = filename.replace('bmp', 'JPG')
         # load image array
         if 'RGB' in filename:
             image = cv2.imread(os.path.join(
                 self.dataset_path, filename), cv2.IMREAD_COLOR)
-            image = addsalt_pepper(image, self.snr)
         else:
             image = cv2.imread(os.path.join(
                 self.dataset_path, filename), cv2.IMREAD_GRAYSCALE)
-            image = addsalt_pepper(image, self.snr)
         if image is None:
             print(filename)
             raise ValueError
+        if self.noise is None:
+            image = addsalt_pepper(image, self.snr)
+        else:
+            image = self.add_noise(image)
         if self.cropped_by_bbox:
             x1, y1, x2, y2 = self.get_bbox(filename)[0]
             h, w = image.shape[:2]
@@ -177,6 +215,11 @@ class HyperECUST_FV(Dataset):
         return image
 
     def __getitem__(self, index):
+        if self.unique_images:
+            img = self.get_image(self.imageList[index])
+            imglist = [img, img[:, ::-1, :].copy()]
+            imglist = [x.transpose(2, 0, 1) for x in imglist]
+            return [(torch.from_numpy(x).float() - 127.5) / 128.0 for x in imglist]
         filenameL = self.nameLs[index]
         filenameR = self.nameRs[index]
         fold = self.folds[index]
@@ -193,6 +236,8 @@ class HyperECUST_FV(Dataset):
         return imgs
 
     def __len__(self):
+        if self.unique_images:
+            return len(self.imageList)
         return len(self.nameLs)
 
 
@@ -279,11 +324,14 @@ class HyperECUST_FI(Dataset):
 
 class HyperECUST_FI_MI(Dataset):
     def __init__(self, dataset_path, dataset_txt, bands,
-                 facesize=None, cropped_by_bbox=False, equalization=True, mode='train'):
+                 facesize=None, cropped_by_bbox=False, equalization=True, mode='train',
+                 cube_path=None):
         """
         Params:
             facesize:   {tuple/list[H, W]}
             mode:       {str} 'train', 'valid'
+            cube_path:  {str} packed cube created by `HyperECUST_cube.pack_cube`,
+                        read band slices from it instead of decoding the JPGs
         """
         self.dataset_path = os.path.expanduser(dataset_path)
         self.dataset_txt = os.path.expanduser(dataset_txt)
@@ -293,6 +341,10 @@ class HyperECUST_FI_MI(Dataset):
         self.equalization = equalization
         self.mode = mode
         self.dicts = getDicts(self.dataset_path)
+        self.cube = None
+        if cube_path is not None:
+            assert not cropped_by_bbox, 'cube samples are already cropped!'
+            self.cube = HyperECUSTCube(cube_path)
         self.image_list = []
         self.label_list = []
         with open(self.dataset_txt, 'r') as f:
@@ -317,6 +369,9 @@ class HyperECUST_FI_MI(Dataset):
         return square_bbox
 
     def get_image(self, filedir):
+        if self.cube is not None:
+            return get_image_from_cube(self.cube, filedir, self.bands,
+                                       self.facesize, self.equalization)
         filenames = glob.glob(os.path.join(self.dataset_path, filedir, '*'))
         filenames = [x[x.find('DATA'):] for x in filenames]
         filenames_ = get_path_from_band_range(filenames, self.bands)
@@ -363,11 +418,16 @@ class HyperECUST_FI_MI(Dataset):
 
 class HyperECUST_FV_MI(Dataset):
     def __init__(self, dataset_path, pairs_txt, bands,
-                 facesize=None, cropped_by_bbox=False, equalization=False, mode='train'):
+                 facesize=None, cropped_by_bbox=False, equalization=False, mode='train',
+                 cube_path=None, unique_images=False):
         """
         Params:
             facesize:   {tuple/list[H, W]}
             mode:       {str} 'train', 'valid'
+            cube_path:  {str} packed cube created by `HyperECUST_cube.pack_cube`,
+                        read band slices from it instead of decoding the JPGs
+            unique_images: {bool} iterate over the unique images of the pairs
+                        instead of the pairs, see `self.imageList` and `self.pairs`
         """
         self.dataset_path = os.path.expanduser(dataset_path)
         self.pairs_txt = os.path.expanduser(pairs_txt)
@@ -376,7 +436,12 @@ class HyperECUST_FV_MI(Dataset):
         self.cropped_by_bbox = cropped_by_bbox
         self.equalization = equalization
         self.mode = mode
+        self.unique_images = unique_images
         self.dicts = getDicts(self.dataset_path)
+        self.cube = None
+        if cube_path is not None:
+            assert not cropped_by_bbox, 'cube samples are already cropped!'
+            self.cube = HyperECUSTCube(cube_path)
         self.in_channels = len(bands)
         self.parseList(self.pairs_txt)
 
@@ -398,6 +463,11 @@ class HyperECUST_FV_MI(Dataset):
             self.folds.append(fold)
             self.flags.append(flag)
         # print(nameLs)
+        # unique images, each pair is (index of left, index of right) in imageList
+        imageList, inverse = np.unique(self.nameLs + self.nameRs,
+                                       return_inverse=True)
+        self.imageList = imageList.tolist()
+        self.pairs = inverse.reshape(2, -1).T
         return
 
     def get_bbox(self, filename):
@@ -413,6 +483,9 @@ class HyperECUST_FV_MI(Dataset):
         return square_bbox
 
     def get_image(self, filedir):
+        if self.cube is not None:
+            return get_image_from_cube(self.cube, filedir, self.bands,
+                                       self.facesize, self.equalization)
         filenames = glob.glob(os.path.join(self.dataset_path, filedir, '*'))
         filenames = [x[x.find('DATA'):] for x in filenames]
         filenames_ = get_path_from_band_range(filenames, self.bands)
@@ -443,6 +516,11 @@ class HyperECUST_FV_MI(Dataset):
         return images
 
     def __getitem__(self, index):
+        if self.unique_images:
+            img = self.get_image(self.imageList[index])
+            imglist = [img, img[:, ::-1, :].copy()]
+            imglist = [x.transpose(2, 0, 1) for x in imglist]
+            return [(torch.from_numpy(x).float() - 127.5) / 128.0 for x in imglist]
         filenameL = self.nameLs[index]
         filenameR = self.nameRs[index]
         fold = self.folds[index]
@@ -459,6 +537,8 @@ class HyperECUST_FV_MI(Dataset):
         return imgs
 
     def __len__(self):
+        if self.unique_images:
+            return len(self.imageList)
         return len(self.nameLs)
 
 
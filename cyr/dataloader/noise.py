@@ -1,7 +1,10 @@
+import os
 import cv2
 import random
 import numpy as np
 import skimage
+import torch
+import torch.utils.data
 from matplotlib import pyplot as plt
 
 # 高斯噪声
@@ -65,6 +68,120 @@ def signal_to_noise_ratio(oriImg, noisedImg):
 
     return ratio
 
+# 批量噪声, N x C x H x W
+
+
+def batch_salt_pepper(batch, SNR, rng=np.random, value_range=(0, 255)):
+    """ vectorized `addsalt_pepper`, the same pixels of all channels are replaced
+    Parameters:
+        batch:  {ndarray(N, C, H, W)} uint8 or float
+        SNR:    {float} proportion of the pixels to keep, on range [0, 1]
+        value_range: {tuple(low, high)} values of pepper and salt
+    """
+    n, c, h, w = batch.shape
+    low, high = value_range
+    u = rng.random_sample((n, 1, h, w))
+    salt = u < (1 - SNR) / 2.
+    pepper = (u >= (1 - SNR) / 2.) & (u < 1 - SNR)
+    noised = np.where(salt, high, np.where(pepper, low, batch))
+    return noised.astype(batch.dtype)
+
+
+def batch_gaussian_noise(batch, means, sigma, percetage=1.0, rng=np.random, value_range=(0, 255)):
+    """ vectorized `gaussianNoise`, the same noise is added to all channels of a pixel
+    Parameters:
+        batch:  {ndarray(N, C, H, W)} uint8 or float
+        means, sigma: {float} of the noise, in pixel values on range [0, 255]
+        percetage: {float} proportion of the noised pixels, on range [0, 1]
+        value_range: {tuple(low, high)} the batch is clipped to
+    """
+    n, c, h, w = batch.shape
+    low, high = value_range
+    scale = (high - low) / 255.
+    noise = rng.normal(means * scale, sigma * scale, (n, 1, h, w))
+    if percetage < 1.0:
+        noise *= rng.random_sample((n, 1, h, w)) < percetage
+    return _clip(batch + noise, batch.dtype, value_range)
+
+
+def batch_snr_noise(batch, SNR, rng=np.random, value_range=(0, 255)):
+    """ additive gaussian noise with the power giving the target `signal_to_noise_ratio` of each image
+    Parameters:
+        batch:  {ndarray(N, C, H, W)} uint8 or float
+        SNR:    {float} target signal to noise ratio, in dB
+        value_range: {tuple(low, high)} the batch is clipped to
+    """
+    n = batch.shape[0]
+    signal = np.mean(batch.reshape(n, -1).astype(np.float64)**2, 1)
+    sigma = np.sqrt(signal / 10**(SNR / 10.)).reshape(n, 1, 1, 1)
+    noise = rng.standard_normal(batch.shape) * sigma
+    return _clip(batch + noise, batch.dtype, value_range)
+
+
+def _clip(noised, dtype, value_range):
+    noised = np.clip(noised, *value_range)
+    if np.issubdtype(dtype, np.integer):
+        noised = np.round(noised)
+    return noised.astype(dtype)
+
+
+class BatchNoise(object):
+    """ seeded batch noise transform, e.g. `BatchNoise('salt_pepper', seed=0, SNR=0.99)`
+
+    Takes {ndarray/tensor(N, C, H, W)} and returns the noised batch of the same type.
+    The generator is created in each process, so that DataLoader workers do not
+    repeat the same noise; it is seeded with `seed` in the main process and with
+    `(seed, worker id + 1)` in the workers, so that a seeded run is reproducible
+    for a given `num_workers`.
+    """
+    modes = {
+        'salt_pepper': batch_salt_pepper,
+        'gaussian': batch_gaussian_noise,
+        'snr': batch_snr_noise,
+    }
+
+    def __init__(self, mode='salt_pepper', seed=None, value_range=(0, 255), **kwargs):
+        """
+        Parameters:
+            mode:   {str} 'salt_pepper', 'gaussian' or 'snr'
+            seed:   {int}
+            value_range: {tuple(low, high)}
+            kwargs: parameters of the noise function, see `batch_salt_pepper`,
+                    `batch_gaussian_noise` and `batch_snr_noise`
+        """
+        assert mode in self.modes, 'unknown noise {}!'.format(mode)
+        self.mode = mode
+        self.seed = seed
+        self.value_range = value_range
+        self.kwargs = kwargs
+        self._pid = None
+        self._rng = None
+
+    @property
+    def rng(self):
+        # a forked worker inherits the generator of the main process, recreate it
+        if self._rng is None or self._pid != os.getpid():
+            seed = self.seed
+            worker = torch.utils.data.get_worker_info()
+            if seed is not None and worker is not None:
+                seed = [seed, worker.id + 1]
+            self._rng = np.random.RandomState(seed)
+            self._pid = os.getpid()
+        return self._rng
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_rng'] = None
+        return state
+
+    def __call__(self, batch):
+        func = self.modes[self.mode]
+        if isinstance(batch, torch.Tensor):
+            noised = func(batch.numpy(), rng=self.rng,
+                          value_range=self.value_range, **self.kwargs)
+            return torch.from_numpy(noised)
+        return func(batch, rng=self.rng, value_range=self.value_range, **self.kwargs)
+
 
 def drawGaussian(mean, sigma):
     """ 显示一维高斯图像
@@ -3,7 +3,7 @@ from torch import nn
 from models.mobilefacenet import MobileFacenet
 from dataloader.CASIA_Face_loader import CASIA_Face
 from dataloader.LFW_loader import LFW
-from dataloader.HyperECUST_loader import HyperECUST_FV, HyperECUST_FI
+from dataloader.HyperECUST_loader import HyperECUST_FV, HyperECUST_FI, BatchNoise
 from trainers.faceverification_trainer import MobileFacenetTrainer
 from utils.faceverification_utils import Evaluation_10_fold
 from torch.optim import lr_scheduler
@@ -50,10 +50,10 @@ def main(split=13, fold=0, s=0):
     # Dataset
     trainset = HyperECUST_FI(params['trainset_path'],
                              params['trainset_txt'])
-    validset = HyperECUST_FV(params['validset_path'],
-                             params['validset_txt'], snr=1 - s)
-    testset = HyperECUST_FV(params['testset_path'],
-                            params['testset_txt'], snr=1 - s)
+    validset = HyperECUST_FV(params['validset_path'], params['validset_txt'],
+                             noise=BatchNoise('salt_pepper', seed=fold, SNR=1 - s))
+    testset = HyperECUST_FV(params['testset_path'], params['testset_txt'],
+                            noise=BatchNoise('salt_pepper', seed=fold, SNR=1 - s))
     datasets = {'train': trainset, 'valid': validset, 'test': testset}
     # Define model
     net = MobileFacenet(trainset.class_nums)
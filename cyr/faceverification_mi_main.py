@@ -1,4 +1,5 @@
 import os
+import sys
 from torch import nn
 from models.mobilefacenet import MobileFacenet
 from dataloader.CASIA_Face_loader import CASIA_Face
@@ -6,6 +7,8 @@ from dataloader.LFW_loader import LFW
 from dataloader.HyperECUST_loader import HyperECUST_FV, HyperECUST_FI, HyperECUST_FI_MI, HyperECUST_FV_MI
 from trainers.faceverification_trainer import MobileFacenetTrainer
 from utils.faceverification_utils import Evaluation_10_fold
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils'))
+from dist_utils import launch, init_from_env
 from torch.optim import lr_scheduler
 import torch
 import torch.optim as optim
@@ -147,6 +150,10 @@ def main(split=14, fold=0, c=12, bands=None):
 
 # -----------------------------------------------------------------------------------
 if __name__ == '__main__':
+    # Data-parallel training, with 'use_gpu': False on the CPU nodes:
+    #   - across nodes, started by `torchrun --nnodes ... faceverification_mi_main.py`
+    #   - in local processes, e.g. one per socket: launch(main, 2, fold=0, c=8, bands=bands3)
+    init_from_env()
     # main()
     bands1 = np.arange(550, 991, 20)
     bands2 = np.arange(550, 991, 40)
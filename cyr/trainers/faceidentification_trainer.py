@@ -9,6 +9,8 @@ sys.path.append(os.path.dirname(__file__))
 import matplotlib.pyplot as plt
 from tensorboardX import SummaryWriter
 from trainer import Trainer
+sys.path.append(os.path.join(os.path.dirname(__file__), '../utils'))
+from dist_utils import NullWriter, gather_shards, all_reduce_mean
 
 
 class AttentionMobileFacenetTrainer(Trainer):
@@ -30,12 +32,13 @@ class AttentionMobileFacenetTrainer(Trainer):
                          batch_size=params['batch_size'], batch_size_valid=params['batch_size_valid'],
                          max_epochs=params['max_epochs'], test_freq=params['test_freq'],
                          use_gpu=params['use_gpu'], resume=params['resume'],
-                         sets=sets, workspace_dir=workspace_dir, log_dir=log_dir)
+                         sets=sets, workspace_dir=workspace_dir, log_dir=log_dir,
+                         loader_params=params, profile_sync=params.get('profile_sync', 0))
 
     def train(self):
         torch.backends.cudnn.benchmark = True
         if self.log_dir:
-            self.writer = SummaryWriter(self.log_dir)
+            self.writer = SummaryWriter(self.log_dir) if self.rank == 0 else NullWriter()
         else:
             raise Exception("Log dir doesn't exist!")
         # Calculate total step
@@ -82,15 +85,24 @@ class AttentionMobileFacenetTrainer(Trainer):
         self.net.to(device)
         self.criterion.to(device)
         self.net.train()
+        if self.train_sampler is not None:
+            self.train_sampler.set_epoch(epoch)
+        net = self.parallel_net()
         # Iterate over data.
+        self.profiler.start()
         for step, data in enumerate(self.trainloader):
+            self.profiler.mark('data')
             image, label = data[0].to(device), data[1].to(device)
+            self.profiler.mark('h2d')
             before_op_time = time.time()
             self.optimizer.zero_grad()
-            output = self.net(image)
+            output = net(image)
             total_loss = self.criterion(output, label)
+            self.profiler.mark('forward')
             total_loss.backward()
+            self.profiler.mark('backward')
             self.optimizer.step()
+            self.profiler.mark('optim')
             fps = image.shape[0] / (time.time() - before_op_time)
             time_sofar = self.train_total_time / 3600
             time_left = (self.n_steps / self.global_step - 1.0) * time_sofar
@@ -101,6 +113,11 @@ class AttentionMobileFacenetTrainer(Trainer):
                 self.print(print_str)
             self.global_step += 1
             self.train_total_time += time.time() - before_op_time
+            self.profiler.step(image.shape[0])
+        self.profiler.log(getattr(self, 'writer', None), epoch)
+        if self.verbose > 0 or self.profiler.loader_bound():
+            self.print(self.profiler.format())
+        self.tune_loader()
         return total_loss
 
     def display_figure(self, epoch):
@@ -165,14 +182,18 @@ class AttentionMobileFacenetTrainer(Trainer):
                     predictions = np.concatenate((predictions, pred), 0)
                     outputs = np.concatenate((outputs, output), 0)
                     #weights = np.concatenate((weights, weight), 0)
-                acc += (pred == label.numpy()).sum()
+                # the labels are on the device too if the validloader is a PrefetchLoader
+                acc += (pred == label.cpu().numpy()).sum()
                 duration = time.time() - before_op_time
                 valid_total_time += duration
                 count += image.shape[0]
                 print('Test step [{}/{}].'.format(step + 1,
                                                   len(self.validloader)))
         fps = count / valid_total_time
-        acc = acc / count
+        # join the shards of the processes in data-parallel mode
+        acc = all_reduce_mean(acc) / all_reduce_mean(count)
+        outputs = gather_shards(outputs, len(self.validset))
+        predictions = gather_shards(predictions, len(self.validset))
         # save tmp_result
         images = np.array(self.validset.image_list)
         labels = np.array(self.validset.label_list)
@@ -180,8 +201,9 @@ class AttentionMobileFacenetTrainer(Trainer):
                   'outputs': outputs, 'predictions': predictions}
         # result = {'filenames': images, 'labels': labels, 'acc': acc,
         #           'outputs': outputs, 'weights': weights, 'predictions': predictions}
-        save_dir = os.path.join(self.log_dir, filename)
-        scipy.io.savemat(save_dir, result)
+        if self.rank == 0:
+            save_dir = os.path.join(self.log_dir, filename)
+            scipy.io.savemat(save_dir, result)
         return acc, fps
 
     def test(self, filename='test_result.mat'):
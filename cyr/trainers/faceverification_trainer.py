@@ -6,8 +6,13 @@ import datetime
 import numpy as np
 import scipy.io
 sys.path.append(os.path.dirname(__file__))
+from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
 from tensorboardX import SummaryWriter
 from trainer import Trainer
+sys.path.append(os.path.join(os.path.dirname(__file__), '../utils'))
+from accumulator import Accumulator
+from dist_utils import NullWriter, ShardSampler, gather_shards
 from torchstat import stat
 
 
@@ -30,14 +35,15 @@ class MobileFacenetTrainer(Trainer):
                          batch_size=params['batch_size'], batch_size_valid=params['batch_size_valid'],
                          max_epochs=params['max_epochs'], test_freq=params['test_freq'],
                          use_gpu=params['use_gpu'], resume=params['resume'],
-                         sets=sets, workspace_dir=workspace_dir, log_dir=log_dir)
+                         sets=sets, workspace_dir=workspace_dir, log_dir=log_dir,
+                         loader_params=params, profile_sync=params.get('profile_sync', 0))
         # uncomment to display the model complexity
         # stat(self.net, (12, self.params['height'], self.params['width']))
 
     def train(self):
         torch.backends.cudnn.benchmark = True
         if self.log_dir:
-            self.writer = SummaryWriter(self.log_dir)
+            self.writer = SummaryWriter(self.log_dir) if self.rank == 0 else NullWriter()
         else:
             raise Exception("Log dir doesn't exist!")
         # Calculate total step
@@ -84,15 +90,24 @@ class MobileFacenetTrainer(Trainer):
         self.net.to(device)
         self.criterion.to(device)
         self.net.train()
+        if self.train_sampler is not None:
+            self.train_sampler.set_epoch(epoch)
+        net = self.parallel_net()
         # Iterate over data.
+        self.profiler.start()
         for step, data in enumerate(self.trainloader):
+            self.profiler.mark('data')
             image, label = data[0].to(device), data[1].to(device)
+            self.profiler.mark('h2d')
             before_op_time = time.time()
             self.optimizer.zero_grad()
-            output = self.net(image)
+            output = net(image)
             total_loss = self.criterion(output, label)
+            self.profiler.mark('forward')
             total_loss.backward()
+            self.profiler.mark('backward')
             self.optimizer.step()
+            self.profiler.mark('optim')
             fps = image.shape[0] / (time.time() - before_op_time)
             time_sofar = self.train_total_time / 3600
             time_left = (self.n_steps / self.global_step - 1.0) * time_sofar
@@ -103,6 +118,11 @@ class MobileFacenetTrainer(Trainer):
                 self.print(print_str)
             self.global_step += 1
             self.train_total_time += time.time() - before_op_time
+            self.profiler.step(image.shape[0])
+        self.profiler.log(getattr(self, 'writer', None), epoch)
+        if self.verbose > 0 or self.profiler.loader_bound():
+            self.print(self.profiler.format())
+        self.tune_loader()
         return total_loss
 
     def eval(self, epoch):
@@ -123,17 +143,63 @@ class MobileFacenetTrainer(Trainer):
                 self.best_epoch, self.acc = epoch, acc
         return acc, threshold
 
-    def eval_epoch(self, filename='valid_result.mat'):
+    def get_pair_features(self, dataset, batch_size):
+        """Embed every unique image of a pairs dataset only once, with its flipped
+        copy in the same forward pass, then gather the features of the pairs by index.
+        The dataset should provide `imageList` and `pairs`, see `HyperECUST_FV`.
+        Set `params['memmap_features']` to keep the features in `log_dir` instead of RAM.
+        In data-parallel mode each process embeds its shard of the images, the features
+        are gathered into every process.
+        Returns:
+            featureLs, featureRs: {ndarray(n_pairs, 2 * feature_dim)}
+            fps: {float} images per second
+        """
+        device = torch.device('cuda:0' if self.use_gpu else 'cpu')
+        self.net.to(device)
+        self.net.eval()
+        total_time = 0
+        dataset.unique_images = True
+        try:
+            n_images = len(dataset)
+            sampler = ShardSampler(n_images, self.rank, self.world_size)
+            features = Accumulator(len(sampler), self.feature_file('features.npy'))
+            loader = DataLoader(dataset, batch_size, shuffle=False, sampler=sampler,
+                                num_workers=2, drop_last=False,
+                                collate_fn=getattr(dataset, 'collate_fn', default_collate))
+            with torch.no_grad():
+                for step, data in enumerate(loader):
+                    n = data[0].shape[0]
+                    images = torch.cat(data, 0).to(device)
+                    before_op_time = time.time()
+                    res = self.net.get_feature(images).data.cpu().numpy()
+                    total_time += time.time() - before_op_time
+                    features.append(np.concatenate((res[:n], res[n:]), 1))
+                    print('Embed step [{}/{}].'.format(step + 1, len(loader)))
+        finally:
+            dataset.unique_images = False
+        count = len(features)
+        features = gather_shards(features.get(), n_images)
+        featureLs = features[dataset.pairs[:, 0]]
+        featureRs = features[dataset.pairs[:, 1]]
+        return featureLs, featureRs, count / total_time
+
+    def get_loader_features(self, loader):
+        """Embed the pairs of a loader, each batch is [imgL, imgL_flip, imgR, imgR_flip].
+        In data-parallel mode the loader iterates the shard of the process, see `shard_sampler`.
+        Returns:
+            featureLs, featureRs: {ndarray(n_pairs, 2 * feature_dim)}
+            fps: {float} pairs per second
+        """
         device = torch.device('cuda:0' if self.use_gpu else 'cpu')
         self.net.to(device)
-        self.criterion.to(device)
         self.net.eval()
-        featureLs = None
-        featureRs = None
-        valid_total_time = 0
-        count = 0
+        n_pairs = len(loader.dataset)
+        n_local = len(ShardSampler(n_pairs, self.rank, self.world_size))
+        featureLs = Accumulator(n_local, self.feature_file('featureLs.npy'))
+        featureRs = Accumulator(n_local, self.feature_file('featureRs.npy'))
+        total_time = 0
         with torch.no_grad():
-            for step, data in enumerate(self.validloader):
+            for step, data in enumerate(loader):
                 for i in range(len(data)):
                     data[i] = data[i].to(device)
                 # forward
@@ -141,21 +207,28 @@ class MobileFacenetTrainer(Trainer):
                 res = [self.net.get_feature(d).data.cpu().numpy()
                        for d in data]
                 duration = time.time() - before_op_time
-                valid_total_time += duration
-                count += len(data[0])
-                featureL = np.concatenate((res[0], res[1]), 1)
-                featureR = np.concatenate((res[2], res[3]), 1)
-                if featureLs is None:
-                    featureLs = featureL
-                else:
-                    featureLs = np.concatenate((featureLs, featureL), 0)
-                if featureRs is None:
-                    featureRs = featureR
-                else:
-                    featureRs = np.concatenate((featureRs, featureR), 0)
-                print('Test step [{}/{}].'.format(step + 1,
-                                                  len(self.validloader)))
-        fps = count / valid_total_time
+                total_time += duration
+                featureLs.append(np.concatenate((res[0], res[1]), 1))
+                featureRs.append(np.concatenate((res[2], res[3]), 1))
+                print('Test step [{}/{}].'.format(step + 1, len(loader)))
+        fps = len(featureLs) / total_time
+        return gather_shards(featureLs.get(), n_pairs), gather_shards(featureRs.get(), n_pairs), fps
+
+    def feature_file(self, filename):
+        """Spill file of a feature buffer in `log_dir` if `params['memmap_features']`, else None"""
+        if self.params.get('memmap_features', False):
+            if self.world_size > 1:
+                filename = 'rank{}_{}'.format(self.rank, filename)
+            return os.path.join(self.log_dir, filename)
+        return None
+
+    def eval_epoch(self, filename='valid_result.mat'):
+        if hasattr(self.validset, 'pairs'):
+            featureLs, featureRs, fps = self.get_pair_features(
+                self.validset, self.batch_size_valid)
+        else:
+            featureLs, featureRs, fps = self.get_loader_features(
+                self.validloader)
         labels = np.array(self.validset.flags)
         Accs, Thresholds, scores, predictions, folds = self.eval_func(
             featureLs, featureRs, labels, True)
@@ -164,42 +237,22 @@ class MobileFacenetTrainer(Trainer):
                   'featureLs': featureLs, 'featureRs': featureRs, 'labels': labels,
                   'Accs': Accs, 'Thresholds': Thresholds, 'scores': scores,
                   'predictions': predictions, 'folds': folds}
-        save_dir = os.path.join(self.log_dir, filename)
-        scipy.io.savemat(save_dir, result)
+        if self.rank == 0:
+            save_dir = os.path.join(self.log_dir, filename)
+            scipy.io.savemat(save_dir, result)
         # accuracy
         return np.mean(Accs), np.mean(Thresholds), fps
 
     def test(self, threshold=0.3, filename='test_result.mat'):
         torch.backends.cudnn.benchmark = True
         n_test = len(self.testset)
-        device = torch.device('cuda:0' if self.use_gpu else 'cpu')
-        self.net.to(device)
-        self.net.eval()
         print("<-------------Test the model-------------->")
-        test_total_time = 0
-        count = 0
-        featureLs = None
-        featureRs = None
-        with torch.no_grad():
-            for step, data in enumerate(self.testloader):
-                for i in range(len(data)):
-                    data[i] = data[i].to(device)
-                before_op_time = time.time()
-                res = [self.net.get_feature(d).data.cpu().numpy()
-                       for d in data]
-                duration = time.time() - before_op_time
-                print('test time: {:.4f}'.format(duration))
-                test_total_time += duration
-                featureL = np.concatenate((res[0], res[1]), 1)
-                featureR = np.concatenate((res[2], res[3]), 1)
-                if featureLs is None:
-                    featureLs = featureL
-                else:
-                    featureLs = np.concatenate((featureLs, featureL), 0)
-                if featureRs is None:
-                    featureRs = featureR
-                else:
-                    featureRs = np.concatenate((featureRs, featureR), 0)
+        if hasattr(self.testset, 'pairs'):
+            featureLs, featureRs, fps = self.get_pair_features(
+                self.testset, self.batch_size_valid)
+        else:
+            featureLs, featureRs, fps = self.get_loader_features(
+                self.testloader)
         # accuracy
         predictions = []
         featureLs = featureLs / \
@@ -216,7 +269,6 @@ class MobileFacenetTrainer(Trainer):
             predictions.append(prediction)
         true = np.sum(predictions)
         acc = 1.0 * true / n_test
-        fps = n_test / test_total_time * len(data)
         print('Test samples {}, fps {:.2f}, accuracy {:.4f}'.format(
             n_test, fps, acc))
         return
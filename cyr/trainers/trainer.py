@@ -1,10 +1,18 @@
 import os
+import sys
 import glob
 import torch
 import time
 import datetime
 import logging
 from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
+sys.path.append(os.path.join(os.path.dirname(__file__), '../utils'))
+from step_profiler import StepProfiler
+from prefetch_loader import make_loader, PrefetchLoader, LoaderTuner
+from dist_utils import get_rank, get_world_size, ShardSampler
 
 
 def init_log(output_dir):
@@ -22,12 +30,20 @@ def init_log(output_dir):
 class Trainer(object):
     """Base trainer class. Contains functions for training and saving/loading chackpoints.
     Trainer classes should inherit from this one and overload the train_epoch function."""
+    # num_workers:        worker processes of each loader
+    # pin_memory:         default `use_gpu`
+    # persistent_workers: keep the workers between epochs (torch>=1.7)
+    # prefetch:           batches kept ready by a background thread, 0 to disable
+    # autotune_loader:    grow num_workers/prefetch while the loader is the bottleneck
+    # max_workers:        limit of the autotuning
+    LOADER_PARAMS = dict(num_workers=2, pin_memory=False, persistent_workers=True,
+                         prefetch=2, autotune_loader=False, max_workers=8)
 
     def __init__(self, net, datasets, optimizer, lr_scheduler, criterion,
                  batch_size, batch_size_valid,
                  max_epochs, test_freq,
                  use_gpu, resume,
-                 sets, workspace_dir, log_dir):
+                 sets, workspace_dir, log_dir, loader_params=None, profile_sync=0):
         self.net = net
         self.datasets = datasets
         self.optimizer = optimizer
@@ -48,30 +64,97 @@ class Trainer(object):
         self.start_epoch = 1
         self.global_step = 1
         self.stats = {}
-        # Dataloader
+        # Data parallel over the processes of torch.distributed if initialized, see utils/dist_utils.py
+        self.rank = get_rank()
+        self.world_size = get_world_size()
+        self._parallel_net = None
+        # Time of data wait/h2d/forward/backward/optim per step, see utils/step_profiler.py,
+        # `profile_sync` > 0 synchronizes every `profile_sync`-th step for a precise breakdown
+        self.profiler = StepProfiler(sync=profile_sync if use_gpu else 0)
+        # Dataloader, the keys of LOADER_PARAMS can be overridden by `loader_params`
+        self.loader_params = dict(self.LOADER_PARAMS, pin_memory=use_gpu)
+        if loader_params is not None:
+            self.loader_params.update({k: v for k, v in loader_params.items() if k in self.loader_params})
         self.trainset = self.datasets[self.sets[0]]
-        self.trainloader = DataLoader(self.trainset, self.batch_size,
-                                      shuffle=True, num_workers=2, drop_last=False)
         self.validset = self.datasets[self.sets[1]]
-        self.validloader = DataLoader(self.validset, self.batch_size_valid,
-                                      shuffle=False, num_workers=2, drop_last=False)
         if 'test' in self.sets:
             self.testset = self.datasets[self.sets[2]]
-            self.testloader = DataLoader(self.testset, 1, shuffle=False)
+        self.loader_tuner = None
+        if self.loader_params['autotune_loader']:
+            self.loader_tuner = LoaderTuner(self.loader_params['num_workers'], self.loader_params['prefetch'],
+                                            self.loader_params['max_workers'], bound_ratio=self.profiler.bound_ratio)
+        self.build_loaders()
         # Workspace and log dir
         if self.workspace_dir is not None:
-            if not os.path.exists(workspace_dir):
-                os.makedirs(workspace_dir)
+            os.makedirs(workspace_dir, exist_ok=True)
         else:
             raise Exception("Workspace dir doesn't exist!")
-        if self.log_dir is not None:
-            if not os.path.exists(self.log_dir):
-                os.mkdir(self.log_dir)
+        if self.rank != 0:
+            self.print = lambda *args, **kwargs: None
+        elif self.log_dir is not None:
+            os.makedirs(self.log_dir, exist_ok=True)
             logging = init_log(self.log_dir)
             self.print = logging.info
         else:
             self.print = print
 
+    def build_loaders(self, train_only=False):
+        """(Re)build the loaders with `self.loader_params`. With `prefetch` > 0 the train
+        and valid loaders are wrapped in a `PrefetchLoader`, which keeps the next batches
+        ready, already on the device, in a background thread.
+        In data-parallel mode each process loads `batch_size / world_size` samples of its
+        part of the trainset, and evaluates its shard of the valid/test sets."""
+        p = self.loader_params
+        device = torch.device('cuda:0' if self.use_gpu else 'cpu')
+        options = dict(num_workers=p['num_workers'], pin_memory=p['pin_memory'],
+                       persistent_workers=p['persistent_workers'])
+        self.train_sampler = None
+        if self.world_size > 1:
+            self.train_sampler = DistributedSampler(self.trainset, self.world_size, self.rank, shuffle=True)
+        self.trainloader = make_loader(self.trainset, max(self.batch_size // self.world_size, 1), shuffle=True,
+                                       drop_last=False, sampler=self.train_sampler, **options)
+        if p['prefetch'] > 0:
+            self.trainloader = PrefetchLoader(self.trainloader, p['prefetch'], device)
+        if train_only:
+            return
+        self.validloader = make_loader(self.validset, self.batch_size_valid, shuffle=False, drop_last=False,
+                                       collate_fn=getattr(self.validset, 'collate_fn', default_collate),
+                                       sampler=self.shard_sampler(self.validset), **options)
+        if p['prefetch'] > 0:
+            self.validloader = PrefetchLoader(self.validloader, p['prefetch'], device)
+        if 'test' in self.sets:
+            self.testloader = make_loader(self.testset, 1, shuffle=False,
+                                          collate_fn=getattr(self.testset, 'collate_fn', default_collate),
+                                          sampler=self.shard_sampler(self.testset), **options)
+
+    def shard_sampler(self, dataset):
+        """The part of `dataset` evaluated by this process, None if not data-parallel.
+        The results of the shards are joined by `gather_shards`."""
+        if self.world_size == 1:
+            return None
+        return ShardSampler(len(dataset), self.rank, self.world_size)
+
+    def parallel_net(self):
+        """The net to train, wrapped in a `DistributedDataParallel` in data-parallel mode,
+        which averages the gradients over the processes during `backward`. The wrapper
+        is built on first use, after the net is moved to its device and reloaded."""
+        if self.world_size == 1:
+            return self.net
+        if self._parallel_net is None or self._parallel_net.module is not self.net:
+            self._parallel_net = DistributedDataParallel(self.net)
+        return self._parallel_net
+
+    def tune_loader(self):
+        """Grow the workers and the prefetch depth of the train loader if the last epoch
+        waited for it, see `LoaderTuner`. Called at the end of `train_epoch`."""
+        if self.loader_tuner is None or not self.loader_tuner.update(self.profiler.data_ratio()):
+            return
+        self.loader_params['num_workers'] = self.loader_tuner.num_workers
+        self.loader_params['prefetch'] = self.loader_tuner.depth
+        self.print('Loader: {} workers, prefetch {} (data wait {:.1%})'.format(
+            self.loader_tuner.num_workers, self.loader_tuner.depth, self.profiler.data_ratio()))
+        self.build_loaders(train_only=True)
+
     def train(self):
         """Do training, you can overload this function according to your need."""
         torch.backends.cudnn.benchmark = True
@@ -109,21 +192,30 @@ class Trainer(object):
         self.print("Spend time: {:.2f}h".format(
             (time.time() - start_time) / 3600))
 
-    def train_epoch(self):
+    def train_epoch(self, epoch):
         """Train one epoch, you can overload this function according to your need."""
         device = torch.device('cuda:0' if self.use_gpu else 'cpu')
         self.net.to(device)
         self.criterion.to(device)
         self.net.train()
+        if self.train_sampler is not None:
+            self.train_sampler.set_epoch(epoch)
+        net = self.parallel_net()
         # Iterate over data.
+        self.profiler.start()
         for step, data in enumerate(self.trainloader):
+            self.profiler.mark('data')
             image, label = data[0].to(device), data[1].to(device)
+            self.profiler.mark('h2d')
             before_op_time = time.time()
             self.optimizer.zero_grad()
-            output = self.net(image)
+            output = net(image)
             total_loss = self.criterion(output, label)
+            self.profiler.mark('forward')
             total_loss.backward()
+            self.profiler.mark('backward')
             self.optimizer.step()
+            self.profiler.mark('optim')
             fps = image.shape[0] / (time.time() - before_op_time)
             time_sofar = self.train_total_time / 3600
             time_left = (self.n_steps / self.global_step - 1.0) * time_sofar
@@ -134,6 +226,11 @@ class Trainer(object):
                 self.print(print_str)
             self.global_step += 1
             self.train_total_time += time.time() - before_op_time
+            self.profiler.step(image.shape[0])
+        self.profiler.log(getattr(self, 'writer', None), epoch)
+        if self.verbose > 0 or self.profiler.loader_bound():
+            self.print(self.profiler.format())
+        self.tune_loader()
         return total_loss
 
     def eval(self, epoch):
@@ -162,8 +259,14 @@ class Trainer(object):
     def save_checkpoint(self, epoch, acc):
         """Saves a checkpoint of the network and other variables.
            Only save the best and latest epoch.
+           In data-parallel mode the files are written by the process of rank 0 only.
         """
         net_type = type(self.net).__name__
+        if self.rank != 0:
+            if acc >= self.best_acc:
+                self.best_epoch = epoch
+                self.best_acc = acc
+            return
         if epoch - self.test_freq != self.best_epoch:
             pre_save = os.path.join(self.log_dir, '{}_{:03d}.pkl'.format(
                 net_type, epoch - self.test_freq))
@@ -245,6 +348,7 @@ class Trainer(object):
         self.start_epoch = start_epoch
         self.best_acc = best_acc
         self.net.load_state_dict(net_state_dict)
+        self._parallel_net = None
         self.stats = checkpoint_dict['stats']
         self.use_gpu = checkpoint_dict['use_gpu']
         return True
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+
+
+class Accumulator(object):
+    """Collect the per-batch results of an eval/test loop into one array,
+    instead of growing it with `np.concatenate` after every batch.
+
+    If the total number of rows `n` is known, the result is preallocated on the
+    first `append` (as a `.npy` memmap if `filename` is given, so that large
+    pair sets stay on disk), otherwise the batches are kept in a list and joined
+    once in `get`.
+
+    Example:
+        outputs = Accumulator(len(dataset))
+        for x in loader:
+            outputs.append(net(x).data.cpu().numpy())
+        outputs = outputs.get()
+    """
+
+    def __init__(self, n=None, filename=None):
+        """
+        Params:
+            n:          {int} total number of rows, None if unknown
+            filename:   {str} spill to a `.npy` memmap, requires `n`
+        """
+        assert filename is None or n is not None, 'memmap needs the number of rows!'
+        self.n = n
+        self.filename = None if filename is None else os.path.expanduser(filename)
+        self.count = 0
+        self.data = None
+        self.chunks = []
+
+    def append(self, x):
+        """
+        Params:
+            x: {ndarray(batch_size, ...)}
+        """
+        x = np.asarray(x)
+        if self.n is None:
+            self.chunks.append(x)
+            self.count += len(x)
+            return
+        if self.data is None:
+            shape = (self.n,) + x.shape[1:]
+            if self.filename is None:
+                self.data = np.empty(shape, dtype=x.dtype)
+            else:
+                self.data = np.lib.format.open_memmap(
+                    self.filename, mode='w+', dtype=x.dtype, shape=shape)
+        if self.count + len(x) > self.n:
+            raise ValueError('Accumulator is full, {} + {} > {} rows!'.format(
+                self.count, len(x), self.n))
+        self.data[self.count: self.count + len(x)] = x
+        self.count += len(x)
+
+    def get(self):
+        """
+        Returns:
+            data: {ndarray(count, ...)} or None if nothing was appended
+        """
+        if self.n is None:
+            if len(self.chunks) > 1:
+                self.chunks = [np.concatenate(self.chunks, 0)]
+            return self.chunks[0] if self.chunks else None
+        if self.data is None:
+            return None
+        if self.filename is not None:
+            self.data.flush()
+        return self.data[:self.count]
+
+    def __len__(self):
+        return self.count
+
+
+if __name__ == '__main__':
+    pass
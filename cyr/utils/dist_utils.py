@@ -0,0 +1,115 @@
+import os
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import Sampler
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def init_from_env(backend='gloo'):
+    """Join the process group described by the environment, e.g. set by `torchrun`
+    (RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT), to train across nodes.
+    Returns:
+        rank, world_size: {int} (0, 1) if WORLD_SIZE is not set
+    """
+    if int(os.environ.get('WORLD_SIZE', 1)) > 1 and not dist.is_initialized():
+        dist.init_process_group(backend, init_method='env://')
+    return get_rank(), get_world_size()
+
+
+def _launch_worker(rank, fn, world_size, n_threads, backend, kwargs):
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+    dist.init_process_group(backend, init_method='env://', rank=rank, world_size=world_size)
+    try:
+        fn(**kwargs)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(fn, world_size, n_threads=None, backend='gloo', master_port=29500, **kwargs):
+    """Run `fn(**kwargs)` in `world_size` local processes forming one process group,
+    e.g. one per socket of a CPU node. A `Trainer` built inside `fn` trains in
+    data-parallel mode.
+
+    Params:
+        fn:         {callable} module-level, builds the datasets, the net and the trainer
+        world_size: {int} number of processes
+        n_threads:  {int} intra-op threads of each process, default cores / world_size
+    Example:
+        launch(main, 4, fold=0, c=8, bands=bands)
+    """
+    if n_threads is None:
+        n_threads = max(1, (os.cpu_count() or 1) // world_size)
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(master_port))
+    mp.spawn(_launch_worker, args=(fn, world_size, n_threads, backend, kwargs), nprocs=world_size)
+
+
+class ShardSampler(Sampler):
+    """Indices rank, rank + world_size, ... of a dataset, without the padding of
+    `DistributedSampler`, so that every sample is evaluated exactly once;
+    see `gather_shards`."""
+
+    def __init__(self, n, rank=None, world_size=None):
+        self.n = n
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+
+    def __iter__(self):
+        return iter(range(self.rank, self.n, self.world_size))
+
+    def __len__(self):
+        return len(range(self.rank, self.n, self.world_size))
+
+
+def gather_shards(local, n):
+    """Gather the rows computed by each rank over its `ShardSampler` into every rank
+    Params:
+        local:  {ndarray(n_local, ...)} rows of the indices rank, rank + world_size, ...
+        n:      {int} total number of rows
+    Returns:
+        rows:   {ndarray(n, ...)} in the order of the dataset
+    """
+    world_size = get_world_size()
+    if world_size == 1:
+        return local
+    local = np.ascontiguousarray(local)
+    n_max = len(range(0, n, world_size))
+    padded = torch.zeros((n_max,) + local.shape[1:], dtype=torch.from_numpy(local[:0]).dtype)
+    padded[:local.shape[0]] = torch.from_numpy(local)
+    gathered = [torch.zeros_like(padded) for _ in range(world_size)]
+    dist.all_gather(gathered, padded)
+    rows = np.empty((n,) + local.shape[1:], dtype=local.dtype)
+    for rank, part in enumerate(gathered):
+        count = len(range(rank, n, world_size))
+        rows[rank::world_size] = part[:count].numpy()
+    return rows
+
+
+def all_reduce_mean(value):
+    """ mean of a python number over the ranks, e.g. the loss of an epoch """
+    if not is_distributed():
+        return value
+    tensor = torch.tensor(float(value), dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return tensor.item() / dist.get_world_size()
+
+
+class NullWriter(object):
+    """ stands for the `SummaryWriter` on the ranks other than 0 """
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
@@ -32,6 +32,41 @@ def getThreshold(scores, labels, thrNum, weighted):
     return bestThreshold
 
 
+def getBestThreshold(scores, labels, weighted=False):
+    """ exact version of `getThreshold`, in O(n log n)
+        params:
+            scores: shape (n_sample, )
+            labels: shape (n_sample, )
+            weighted: see `getAccuracy`
+        returns:
+            the threshold maximizing `getAccuracy`, the middle of the gap between two
+            sorted unique scores; the central one of the best gaps if there are several
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    labels = np.asarray(labels)
+    values, inverse = np.unique(scores, return_inverse=True)
+    # number of positive / negative samples at each unique score
+    n_pos_at = np.bincount(inverse[labels == 1], minlength=len(values))
+    n_neg_at = np.bincount(inverse[labels == -1], minlength=len(values))
+    # threshold in gap k, i.e. (values[k-1], values[k]), k = 0, ..., len(values):
+    #   positives above it are those at values[k:], negatives below it those at values[:k]
+    n_neg_below = np.concatenate(([0], np.cumsum(n_neg_at)))
+    n_pos_above = n_pos_at.sum() - np.concatenate(([0], np.cumsum(n_pos_at)))
+    w_p = 2 / len(scores)
+    w_n = 2 / len(scores)
+    if weighted:
+        w_p = 1 / n_pos_at.sum()
+        w_n = 1 / n_neg_at.sum()
+    accuracys = (n_pos_above * w_p + n_neg_below * w_n) / 2
+    best = np.where(accuracys == np.max(accuracys))[0]
+    k = best[len(best) // 2]
+    if k == 0:
+        return np.nextafter(values[0], -np.inf)
+    if k == len(values):
+        return np.nextafter(values[-1], np.inf)
+    return (values[k - 1] + values[k]) / 2
+
+
 def Evaluation_10_fold(fLs, fRs, labels, weighted=False, arc=True):
     """
         params: fLs, fRs: shape (n_sample, feature_dim)
@@ -75,7 +110,7 @@ def Evaluation_10_fold(fLs, fRs, labels, weighted=False, arc=True):
         scores_test = scores[testFold]
         labels_val = labels[valFold]
         labels_test = labels[testFold]
-        Thresholds[i] = getThreshold(scores_val, labels_val, 1000, weighted)
+        Thresholds[i] = getBestThreshold(scores_val, labels_val, weighted)
         ACCs[i] = getAccuracy(scores_test, labels_test, Thresholds[i])
         predictions[idx_pos_test] = scores[idx_pos_test] > Thresholds[i]
         predictions[idx_neg_test] = scores[idx_neg_test] < Thresholds[i]
@@ -124,7 +159,7 @@ def EvaluationLDA_10_fold(fLs, fRs, labels, weighted=False):
         scores_test = scores[testFold]
         labels_val = labels[valFold]
         labels_test = labels[testFold]
-        Thresholds[i] = getThreshold(scores_val, labels_val, 1000, weighted)
+        Thresholds[i] = getBestThreshold(scores_val, labels_val, weighted)
         ACCs[i] = getAccuracy(scores_test, labels_test, Thresholds[i])
         predictions[idx_pos_test] = scores[idx_pos_test] > 0.3
         predictions[idx_neg_test] = scores[idx_neg_test] < 0.3
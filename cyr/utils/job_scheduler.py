@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import multiprocessing as mp
+
+
+class JobScheduler(object):
+    """Run the experiments of a sweep, e.g. the `EasyDict` configers generated by
+    `main_update_config.py`, `n_jobs` at a time, each in its own process.
+
+    A job is done if all of its `outputs(configer)` exist, e.g. its `.pkl` and
+    `test_log.txt`, which `test` writes last and atomically; done jobs are skipped,
+    so are the experiments run before the sweep. A job started by the scheduler must
+    also have returned from its function, which `_run_job` records with the marker
+    `<statefile>.logs/<key>.done`, as its outputs may be those of an earlier run.
+    The status of each job is saved into `statefile` whenever it changes, so that
+    a killed sweep is resumed by running it again: the jobs which were running are
+    started over, the failed jobs are retried up to `max_attempts` times in total.
+
+    The output of each job goes to `<statefile>.logs/<key>.log`.
+
+    Example:
+        def train_and_test(configer):
+            train(configer)
+            test(configer)
+
+        scheduler = JobScheduler('./sweeps/main_split.json', outputs=outputs, n_jobs=4, n_threads=4)
+        scheduler.run(configers, train_and_test)
+    """
+
+    def __init__(self, statefile, outputs, n_jobs=1, n_threads=None, devices=None, max_attempts=2, verbose=True):
+        """
+        Params:
+            statefile:  {str} json file of the queue state
+            outputs:    {callable} outputs(configer) -> {list[str]} files written by the job
+            n_jobs:     {int} number of jobs at a time
+            n_threads:  {int} CPU threads of each job (OMP/MKL and `torch.set_num_threads`), None to leave it
+            devices:    {list[str]} CUDA_VISIBLE_DEVICES of each slot, e.g. ['0', '1'], None to leave it
+            max_attempts: {int} attempts of a failing job over all runs
+        """
+        self.statefile = statefile
+        self.outputs = outputs
+        self.n_jobs = n_jobs
+        self.n_threads = n_threads
+        self.devices = devices
+        self.max_attempts = max_attempts
+        self.verbose = verbose
+        self.logdir = statefile + '.logs'
+        self.state = self._load()
+
+    @staticmethod
+    def key(configer):
+        """ unique name of the job, the model file without extension """
+        return os.path.join(configer.mdlspath, configer.modelname)
+
+    def _load(self):
+        if not os.path.exists(self.statefile):
+            return dict()
+        with open(self.statefile, 'r') as f:
+            state = json.load(f)
+        for job in state.values():
+            if job['status'] == 'running':      # killed with the sweep
+                job['status'] = 'pending'
+        return state
+
+    def _save(self):
+        dirname = os.path.dirname(self.statefile)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        # write to a temporary file first, so that a kill never leaves a partial state
+        tmpfile = '{}.{}.tmp'.format(self.statefile, os.getpid())
+        with open(tmpfile, 'w') as f:
+            json.dump(self.state, f, indent=2, default=str)
+        os.replace(tmpfile, self.statefile)
+
+    def _logname(self, key, ext):
+        return os.path.join(self.logdir, key.strip('/').replace('/', '_') + ext)
+
+    def is_done(self, configer):
+        key = self.key(configer)
+        if not all([os.path.exists(path) for path in self.outputs(configer)]):
+            return False
+        if self.state.get(key, dict()).get('attempts', 0) > 0:
+            return os.path.exists(self._logname(key, '.done'))
+        return True
+
+    def _log(self, message):
+        if self.verbose:
+            print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()), message)
+            sys.stdout.flush()
+
+    def _start(self, slot, key, configer, fn, ctx):
+        """ the environment of the parent is copied by `spawn`, so set it around `start` """
+        env = dict()
+        if self.n_threads is not None:
+            for name in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS']:
+                env[name] = str(self.n_threads)
+        if self.devices is not None:
+            env['CUDA_VISIBLE_DEVICES'] = self.devices[slot % len(self.devices)]
+        saved = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+
+        logfile = self._logname(key, '.log')
+        donefile = self._logname(key, '.done')
+        if os.path.exists(donefile):
+            os.remove(donefile)
+        p = ctx.Process(target=_run_job, args=(fn, configer, self.n_threads, logfile, donefile))
+        try:
+            p.start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name)
+                else:
+                    os.environ[name] = value
+        return p
+
+    def run(self, configers, fn):
+        """
+        Params:
+            configers:  {list[EasyDict]} jobs in order
+            fn:         {callable} fn(configer), a module-level function, run in a new process
+        Returns:
+            state:      {dict} {key: dict(status, attempts, ...)} of the jobs of `configers`,
+                            status is 'done', 'failed' or 'pending' if interrupted
+        """
+        os.makedirs(self.logdir, exist_ok=True)
+        queue = []
+        for configer in configers:
+            key = self.key(configer)
+            job = self.state.setdefault(key, dict(status='pending', attempts=0))
+            job['configer'] = configer
+            if self.is_done(configer):
+                job['status'] = 'done'
+            elif job['status'] == 'done':       # outputs removed since
+                job['status'] = 'pending'
+            if job['status'] == 'failed' and job['attempts'] < self.max_attempts:
+                job['status'] = 'pending'
+            if job['status'] == 'pending':
+                queue.append((key, configer))
+        self._save()
+        self._log('{}: {} jobs, {} to run, {} at a time'.format(
+                    self.statefile, len(configers), len(queue), self.n_jobs))
+
+        ctx = mp.get_context('spawn')
+        running = dict()                        # slot: (key, process)
+        try:
+            while len(queue) > 0 or len(running) > 0:
+                for slot in range(self.n_jobs):
+                    if slot in running or len(queue) == 0:
+                        continue
+                    key, configer = queue.pop(0)
+                    job = self.state[key]
+                    job.update(status='running', attempts=job['attempts'] + 1, start=time.time())
+                    self._save()
+                    running[slot] = (key, self._start(slot, key, configer, fn, ctx))
+                    self._log('start  {} [slot {}, attempt {}]'.format(key, slot, job['attempts']))
+
+                time.sleep(1)
+                for slot, (key, p) in list(running.items()):
+                    if p.is_alive():
+                        continue
+                    p.join()
+                    del running[slot]
+                    job = self.state[key]
+                    job['elapsed'] = time.time() - job['start']
+                    job['status'] = 'done' if p.exitcode == 0 and self.is_done(job['configer']) else 'failed'
+                    self._save()
+                    self._log('{:6s} {} [{:.1f} min, exit code {}]'.format(
+                                job['status'], key, job['elapsed'] / 60, p.exitcode))
+        finally:
+            for key, p in running.values():
+                if p.is_alive():
+                    p.terminate()
+                    p.join()
+                self.state[key]['status'] = 'pending'
+            self._save()
+
+        keys = [self.key(configer) for configer in configers]
+        n_done = sum([self.state[key]['status'] == 'done' for key in keys])
+        self._log('{}: {}/{} jobs done'.format(self.statefile, n_done, len(keys)))
+        return {key: self.state[key] for key in keys}
+
+
+def _run_job(fn, configer, n_threads, logfile, donefile):
+    """ entry of the job processes, the output is redirected to `logfile`,
+    `donefile` is written once `fn` has returned """
+    fd = os.open(logfile, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+
+    if n_threads is not None and 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(n_threads)
+    fn(configer)
+    with open(donefile, 'w') as f:
+        f.write(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()) + '\n')
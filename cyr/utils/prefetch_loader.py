@@ -0,0 +1,187 @@
+import queue
+import inspect
+import threading
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
+
+
+def make_loader(dataset, batch_size, shuffle=False, num_workers=0, pin_memory=False,
+                persistent_workers=False, prefetch_factor=2, collate_fn=None, drop_last=False, sampler=None):
+    """Build a `DataLoader`, passing the worker options only when there are workers
+    and the installed torch supports them (`persistent_workers` needs torch>=1.7).
+
+    Params:
+        persistent_workers: {bool} keep the worker processes between epochs
+        prefetch_factor:    {int} batches loaded in advance by each worker
+        sampler:            {Sampler} e.g. a `DistributedSampler`, replaces `shuffle`
+    """
+    kwargs = dict(batch_size=batch_size, shuffle=shuffle and sampler is None, sampler=sampler,
+                  num_workers=num_workers, pin_memory=pin_memory, drop_last=drop_last,
+                  collate_fn=collate_fn if collate_fn is not None else default_collate)
+    if num_workers > 0:
+        supported = inspect.signature(DataLoader.__init__).parameters
+        if 'persistent_workers' in supported:
+            kwargs['persistent_workers'] = persistent_workers
+        if 'prefetch_factor' in supported:
+            kwargs['prefetch_factor'] = prefetch_factor
+    return DataLoader(dataset, **kwargs)
+
+
+def _to_device(batch, device):
+    """ copy the tensors of a batch, staged in pinned memory so that the copy is asynchronous """
+    if isinstance(batch, torch.Tensor):
+        if device.type == 'cuda':
+            if not batch.is_pinned():
+                batch = batch.pin_memory()
+            return batch.to(device, non_blocking=True)
+        return batch
+    if isinstance(batch, (list, tuple)):
+        return type(batch)([_to_device(b, device) for b in batch])
+    if isinstance(batch, dict):
+        return {k: _to_device(v, device) for k, v in batch.items()}
+    return batch
+
+
+def _record_stream(batch, stream):
+    """ the tensors were allocated on the copy stream, tell the allocator they are used on `stream` """
+    if isinstance(batch, torch.Tensor):
+        if batch.is_cuda:
+            batch.record_stream(stream)
+    elif isinstance(batch, (list, tuple)):
+        for b in batch:
+            _record_stream(b, stream)
+    elif isinstance(batch, dict):
+        for b in batch.values():
+            _record_stream(b, stream)
+
+
+class _End(object):
+    def __init__(self, error=None):
+        self.error = error
+
+
+class PrefetchLoader(object):
+    """Iterate a loader in a background thread, which keeps the next `depth`
+    batches ready. With a CUDA `device` the thread also copies them to the device
+    on its own stream, so the copy of the next batch overlaps the current step.
+    All the tensors of a batch are copied, the labels included, so they need a
+    `.cpu()` before `.numpy()`.
+
+    Example:
+        trainloader = PrefetchLoader(make_loader(trainset, 64, shuffle=True, num_workers=4,
+                                                 pin_memory=True), depth=2, device=torch.device('cuda:0'))
+        for step, (image, label) in enumerate(trainloader):
+            ...     # already on the device
+    """
+
+    def __init__(self, loader, depth=2, device=None):
+        """
+        Params:
+            loader: {iterable} e.g. a `DataLoader`, iterated once per epoch
+            depth:  {int} number of batches ready in advance
+            device: {torch.device} copy the batches to it, None to leave them
+        """
+        self.loader = loader
+        self.depth = depth
+        self.device = torch.device(device) if device is not None else None
+        self.dataset = getattr(loader, 'dataset', None)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _produce(self, out, stop, stream):
+        end = _End()
+        try:
+            for batch in self.loader:
+                if stop.is_set():
+                    break
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = _to_device(batch, self.device)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                elif self.device is not None:
+                    batch = _to_device(batch, self.device)
+                out.put((batch, event))
+        except Exception as e:
+            end = _End(e)
+        out.put(end)
+
+    def __iter__(self):
+        stream = None
+        if self.device is not None and self.device.type == 'cuda':
+            stream = torch.cuda.Stream(self.device)
+        out = queue.Queue(maxsize=max(self.depth, 1))
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(out, stop, stream), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = out.get()
+                if isinstance(item, _End):
+                    if item.error is not None:
+                        raise item.error
+                    break
+                batch, event = item
+                if event is not None:
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    _record_stream(batch, current)
+                yield batch
+        finally:
+            # unblock the thread if the epoch was left early
+            stop.set()
+            while thread.is_alive():
+                try:
+                    out.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+            thread.join()
+
+
+class LoaderTuner(object):
+    """Grow the workers and the prefetch depth of the train loader while the steps
+    wait for it, e.g. by `StepProfiler.data_ratio()` at the end of each epoch.
+
+    The workers are doubled and the depth increased by one at a time; if a change
+    does not reduce the data wait by at least `min_gain`, it is reverted and the
+    tuning stops, as more workers only compete for the CPU then.
+    """
+
+    def __init__(self, num_workers, depth, max_workers=8, max_depth=8, bound_ratio=0.3, min_gain=0.1):
+        self.num_workers = num_workers
+        self.depth = depth
+        self.max_workers = max_workers
+        self.max_depth = max_depth
+        self.bound_ratio = bound_ratio
+        self.min_gain = min_gain
+        self.frozen = False
+        self._previous = None       # ((num_workers, depth), data_ratio) before the last change
+
+    def update(self, data_ratio):
+        """
+        Params:
+            data_ratio: {float} fraction of the epoch spent waiting for the loader
+        Returns:
+            changed:    {bool} the loader should be rebuilt with `num_workers` and `depth`
+        """
+        if self.frozen:
+            return False
+        if self._previous is not None:
+            setting, ratio = self._previous
+            self._previous = None
+            if data_ratio > ratio * (1 - self.min_gain):
+                self.num_workers, self.depth = setting
+                self.frozen = True
+                return True
+        if data_ratio <= self.bound_ratio:
+            return False
+        if self.num_workers >= self.max_workers and self.depth >= self.max_depth:
+            self.frozen = True
+            return False
+        self._previous = ((self.num_workers, self.depth), data_ratio)
+        self.num_workers = min(max(2 * self.num_workers, 1), self.max_workers)
+        self.depth = min(self.depth + 1, self.max_depth)
+        return True
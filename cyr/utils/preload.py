@@ -0,0 +1,155 @@
+import os
+import time
+import warnings
+import ctypes
+import cv2
+import torch
+import numpy as np
+import multiprocessing as mp
+
+getTime = lambda: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+
+def _init_preload_worker(buffer, shape, read_fn, args):
+    global _preload_state
+    cv2.setNumThreads(1)
+    _preload_state = (buffer, shape, read_fn, args)
+
+
+def _preload_shard(shard):
+    """ decode a shard of (index, path) into the shared buffer """
+    buffer, shape, read_fn, args = _preload_state
+    images = np.frombuffer(buffer, dtype=np.uint8).reshape(shape)
+    for i, path in shard:
+        images[i] = read_fn(path, *args).transpose(2, 0, 1)
+    return len(shard)
+
+
+def preload_images(read_fn, filelist, args=(), n_workers=0, shardsize=32, verbose=True):
+    """ Decode all images of `filelist` into one preallocated uint8 buffer
+
+    Params:
+        read_fn:    {callable} read_fn(path, *args) -> {ndarray(H, W, C)} uint8,
+                        must be picklable, e.g. a module-level function or classmethod
+        filelist:   {list[str]}
+        args:       {tuple} extra arguments of `read_fn`
+        n_workers:  {int} size of the process pool, load serially if less than 2
+        shardsize:  {int} number of files sent to a worker at a time
+    Returns:
+        images:     {tensor(N, C, H, W)} uint8
+    Notes:
+        The buffer is a `multiprocessing.RawArray`, the workers write their shards
+        into it directly, so no decoded image is pickled back to the main process.
+    """
+    n = len(filelist)
+    if n == 0:
+        return torch.zeros(0, dtype=torch.uint8)
+    image = read_fn(filelist[0], *args)
+    h, w, c = image.shape
+    shape = (n, c, h, w)
+    buffer = mp.RawArray(ctypes.c_uint8, n * c * h * w)
+    images = np.frombuffer(buffer, dtype=np.uint8).reshape(shape)
+    images[0] = image.transpose(2, 0, 1)
+
+    shards = list(zip(range(1, n), filelist[1:]))
+    shards = [shards[i: i + shardsize] for i in range(0, len(shards), shardsize)]
+
+    start_time = time.time(); n_done = 1
+    def _report(n_done):
+        if verbose:
+            duration = time.time() - start_time
+            print("{} || preload [{:5d}]/[{:5d}] | {:.1f} images/s".\
+                    format(getTime(), n_done, n, n_done / max(duration, 1e-6)), 
+                    end='\n' if n_done == n else '\r')
+
+    if n_workers < 2 or len(shards) < 2:
+        for shard in shards:
+            for i, path in shard:
+                images[i] = read_fn(path, *args).transpose(2, 0, 1)
+            n_done += len(shard); _report(n_done)
+    else:
+        pool = mp.Pool(n_workers, initializer=_init_preload_worker, 
+                            initargs=(buffer, shape, read_fn, args))
+        try:
+            for n_shard in pool.imap_unordered(_preload_shard, shards):
+                n_done += n_shard; _report(n_done)
+            pool.close()
+        except BaseException:
+            # a decode error (or Ctrl-C) must not leave the workers running
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    if len(shards) == 0: _report(n_done)
+
+    return torch.from_numpy(images)
+
+
+def _read_cache(cachefile, n, sources):
+    """ the memory-mapped cache, None if it is missing, stale or of another number of images """
+    if not os.path.isfile(cachefile):
+        return None
+    mtime = os.path.getmtime(cachefile)
+    if any([os.path.getmtime(source) > mtime for source in sources]):
+        return None
+    images = np.load(cachefile, mmap_mode='r')
+    return images if images.shape[0] == n else None
+
+
+def _lock_is_stale(lockfile):
+    """ the process which holds `lockfile` is dead, e.g. killed while decoding """
+    try:
+        with open(lockfile, 'r') as f:
+            pid = int(f.read().strip() or 0)
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return True
+    return False
+
+
+def preload_images_cached(cachefile, read_fn, filelist, args=(), n_workers=0, sources=(), verbose=True):
+    """ `preload_images` backed by the `.npy` file `cachefile`, so that the images are
+    decoded once for all the processes which load them, e.g. the jobs of a sweep
+
+    The cache is opened memory-mapped and read-only, the processes share its pages.
+    It is rebuilt if it is missing, older than one of `sources` or of another number
+    of images; one process decodes while the others wait for `<cachefile>.lock`.
+
+    Params:
+        cachefile:  {str} e.g. `./split/<splitmode>/<mode>_<dataset>_cube.npy`
+        sources:    {list[str]} files the images depend on, e.g. the split file
+        others:     see `preload_images`
+    Returns:
+        images:     {tensor(N, C, H, W)} uint8, read-only
+    """
+    n = len(filelist)
+    lockfile = cachefile + '.lock'
+    images = _read_cache(cachefile, n, sources)
+    while images is None:
+        try:
+            fd = os.open(lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _lock_is_stale(lockfile):
+                try:
+                    os.remove(lockfile)
+                except OSError:
+                    pass
+            else:
+                time.sleep(1)
+            continue
+        try:
+            os.write(fd, str(os.getpid()).encode())
+            if _read_cache(cachefile, n, sources) is None:
+                decoded = preload_images(read_fn, filelist, args, n_workers, verbose=verbose)
+                # write to a temporary file first, so that the others never map a partial cache
+                tmpfile = '{}.{}.tmp.npy'.format(cachefile, os.getpid())
+                np.save(tmpfile, decoded.numpy())
+                os.replace(tmpfile, cachefile)
+        finally:
+            os.close(fd)
+            os.remove(lockfile)
+        images = _read_cache(cachefile, n, sources)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')         # not writable, the samples are never modified in place
+        return torch.from_numpy(images)
@@ -0,0 +1,123 @@
+import time
+import torch
+
+
+class StepProfiler(object):
+    """Break the time of each training step down into phases, e.g. the time
+    blocked on the loader, the host-to-device copy, forward, backward and the
+    optimizer step, and aggregate them per epoch.
+
+    `mark(phase)` charges the time since the previous mark to `phase`, the first
+    mark of a step is charged the time since the end of the previous step, which
+    is the time waiting for the loader. CUDA kernels run asynchronously, so their
+    time shows up in the next phase that blocks on them (usually `optim` or the
+    `.item()` of the loss). A synchronization at each mark stalls the pipeline of
+    every step, so it is done on every `sync`-th step only, whose phases give the
+    breakdown of `means_ms`; the other steps still give the data wait and the fps.
+
+    Example:
+        profiler = StepProfiler(sync=50 if use_gpu else 0)
+        profiler.start()
+        for step, data in enumerate(loader):
+            profiler.mark('data')
+            image, label = data[0].to(device), data[1].to(device)
+            profiler.mark('h2d')
+            loss = criterion(net(image), label)
+            profiler.mark('forward')
+            ...
+            profiler.step(image.shape[0])
+        profiler.log(writer, epoch)
+        if profiler.loader_bound():
+            print(profiler.format())
+    """
+
+    PHASES = ['data', 'h2d', 'forward', 'backward', 'optim']
+
+    def __init__(self, sync=0, bound_ratio=0.3):
+        """
+        Params:
+            sync:           {int} `torch.cuda.synchronize` at the marks of every `sync`-th
+                                step, e.g. 1 (or True) for all of them, 0 (or False) to never wait
+            bound_ratio:    {float} the loader is the bottleneck if the steps wait
+                                for it longer than this fraction of their time
+        """
+        self.sync = int(sync) if torch.cuda.is_available() else 0
+        self.bound_ratio = bound_ratio
+        self.start()
+
+    def start(self):
+        """ reset the totals, call before the first batch is requested """
+        self.totals = dict()
+        self.synced = dict()                    # totals of the synchronized steps
+        self.n_steps = 0
+        self.n_synced = 0
+        self.n_samples = 0
+        self.elapsed = 0.
+        self._synced_step = self._is_synced(0)
+        self._last = self._epoch_start = self._now()
+
+    def _is_synced(self, step):
+        """ the first step of an epoch is skipped unless `sync` is 1, it pays the warm-up """
+        return self.sync > 0 and (step + 1) % self.sync == 0
+
+    def _now(self):
+        if self._synced_step:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def mark(self, phase):
+        now = self._now()
+        self.totals[phase] = self.totals.get(phase, 0.) + now - self._last
+        if self._synced_step:
+            self.synced[phase] = self.synced.get(phase, 0.) + now - self._last
+        self._last = now
+
+    def step(self, n_samples=0):
+        """ end of a step, the time since the last mark is charged to `other` """
+        if self._synced_step:
+            self.n_synced += 1
+        elif self._is_synced(self.n_steps + 1):
+            # the kernels of this step are not charged to the `data` of the next one
+            torch.cuda.synchronize()
+        self.mark('other')
+        self.n_steps += 1
+        self.n_samples += n_samples
+        self.elapsed = self._last - self._epoch_start
+        self._synced_step = self._is_synced(self.n_steps)
+
+    def means_ms(self):
+        """
+        Returns:
+            means:  {dict} {phase: mean ms per step}, of the synchronized steps if any
+        """
+        totals, n = (self.synced, self.n_synced) if self.n_synced > 0 else (self.totals, self.n_steps)
+        n = max(n, 1)
+        phases = [p for p in self.PHASES if p in totals] + \
+                    [p for p in totals if p not in self.PHASES]
+        return {p: totals[p] / n * 1000 for p in phases}
+
+    def data_ratio(self):
+        """ fraction of the time of the steps spent waiting for the loader """
+        return self.totals.get('data', 0.) / self.elapsed if self.elapsed > 0 else 0.
+
+    def loader_bound(self):
+        return self.data_ratio() > self.bound_ratio
+
+    def fps(self):
+        """ samples per second including the data wait, unlike the fps of the compute only """
+        return self.n_samples / self.elapsed if self.elapsed > 0 else 0.
+
+    def format(self):
+        s = ' | '.join(['{} {:.1f}ms'.format(p, ms) for p, ms in self.means_ms().items()])
+        s = 'Step time: {} | fps {:4.2f} | data wait {:.1%}'.format(s, self.fps(), self.data_ratio())
+        if self.loader_bound():
+            s += ' | the loader is the bottleneck!'
+        return s
+
+    def log(self, writer, epoch, tag='step_ms'):
+        """ add the means of the epoch to a `SummaryWriter` """
+        if writer is None:
+            return
+        writer.add_scalars(tag, self.means_ms(), epoch)
+        writer.add_scalar('data_wait_ratio', self.data_ratio(), epoch)
+        writer.add_scalar('fps', self.fps(), epoch)
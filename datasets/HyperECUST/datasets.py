@@ -15,6 +15,8 @@ import sys
 sys.path.append(os.path.abspath('../../louishsu/recognize/'))
 from config import configer
 from utiles import convert_to_npy_path, get_label_from_path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from detect_index import getDicts as getDetectIndex
 
 n_channels = 46
 notUsedSubjects = []
@@ -118,12 +120,7 @@ def getBbox(imgpath):
     return score, bbox, landmark
 
 def getDicts():
-    dicts = dict()
-    for vol in ["DATA%d" % _ for _ in range(1, 5)]:
-        txtfile = os.path.join(configer.datapath, vol, "detect.txt")
-        with open(txtfile, 'r') as f:
-            dicts[vol] = eval(f.read())
-    return dicts
+    return getDetectIndex(configer.datapath, range(1, 5))
 
 def show_result(image, score, bbox, landmarks, winname="", waitkey=0):
     """
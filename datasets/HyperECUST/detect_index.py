@@ -0,0 +1,183 @@
+"""
+Compiled binary index of the `DATAx/detect.txt` annotations.
+
+`detect.txt` is a python dict literal
+    {'/1/Multi/non-obtructive/Multi_1_W1_1': (score, [x1, y1, x2, y2], [x1, y1, ..., x5, y5]), ...}
+with `(None, None, None)` for the images where no face was detected. Parsing it
+with `eval` in every dataset constructor (and in every DataLoader worker) is slow,
+so it is compiled once into `DATAx/detect.npy`, a structured array sorted by key
+
+    key: |S{n}, score: f8, bbox: (4,), landmark: (10,), valid: ?
+
+where `bbox` and `landmark` are `i8` if all coordinates of the file are integers,
+as in the annotations rounded by hand, and `f8` otherwise, as written by
+`1_detect_and_savetxt.py`, so that they are read back unchanged.
+It is opened with `np.load(..., mmap_mode='r')` and searched by bisection.
+The index is recompiled automatically when `detect.txt` is newer than it.
+"""
+import os
+import ast
+import numpy as np
+from collections.abc import Mapping
+
+
+def get_index_path(txtfile):
+    return os.path.splitext(txtfile)[0] + '.npy'
+
+
+def compile_detect(txtfile, npyfile=None):
+    """ compile `detect.txt` into a sorted binary index
+
+    Params:
+        txtfile:    {str} path of `detect.txt`
+        npyfile:    {str} output path, `detect.npy` next to `txtfile` by default
+    Returns:
+        npyfile:    {str}
+    """
+    if npyfile is None:
+        npyfile = get_index_path(txtfile)
+    with open(txtfile, 'r') as f:
+        dict_save = ast.literal_eval(f.read())
+    keys = sorted(dict_save.keys())
+    n_bbox, n_landmark = 4, 10
+    coord = 'i8'
+    for key in keys:
+        score, bbox, landmark = dict_save[key]
+        if score is None:
+            continue
+        n_bbox, n_landmark = len(bbox), len(landmark)
+        if not all([isinstance(v, int) for v in list(bbox) + list(landmark)]):
+            coord = 'f8'
+            break
+    len_key = max([len(key.encode()) for key in keys] + [1])
+    dtype = np.dtype([('key', 'S{}'.format(len_key)), ('score', 'f8'),
+                      ('bbox', coord, (n_bbox,)), ('landmark', coord, (n_landmark,)),
+                      ('valid', '?')])
+    index = np.zeros(len(keys), dtype=dtype)
+    for i, key in enumerate(keys):
+        score, bbox, landmark = dict_save[key]
+        index[i]['key'] = key.encode()
+        if score is None:
+            continue
+        index[i]['score'] = score
+        index[i]['bbox'] = bbox
+        index[i]['landmark'] = landmark
+        index[i]['valid'] = True
+    # write to a temporary file first, so that readers never see a partial index
+    tmpfile = '{}.{}.tmp'.format(npyfile, os.getpid())
+    with open(tmpfile, 'wb') as f:
+        np.save(f, index)
+    os.replace(tmpfile, npyfile)
+    return npyfile
+
+
+def check_index(txtfile):
+    """ compare the compiled index of `txtfile` with the evaluated dict
+
+    Returns:
+        n_diff:     {int} number of keys that are missing or read back differently
+    """
+    with open(txtfile, 'r') as f:
+        dict_save = ast.literal_eval(f.read())
+    index = DetectIndex(txtfile)
+    n_diff = len(index) - len(dict_save)
+    for key, (score, bbox, landmark) in dict_save.items():
+        if index.get(key) != (score, None if bbox is None else list(bbox),
+                                     None if landmark is None else list(landmark)):
+            n_diff += 1
+    return n_diff
+
+
+class DetectIndex(Mapping):
+    """ read-only, dict-like view of one compiled `detect.txt`
+
+    `index[key]` returns `(score, bbox, landmark)` with python types, or
+    `(None, None, None)`, exactly as the evaluated `detect.txt` dict does.
+    `key in index` and `key in index.keys()` search the sorted keys by bisection.
+    """
+
+    def __init__(self, txtfile, recompile=True):
+        self.txtfile = txtfile
+        self.npyfile = get_index_path(txtfile)
+        if recompile and (not os.path.isfile(self.npyfile) or
+                        os.path.getmtime(self.npyfile) < os.path.getmtime(txtfile)):
+            compile_detect(txtfile, self.npyfile)
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = np.load(self.npyfile, mmap_mode='r')
+        return self._index
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_index'] = None
+        return state
+
+    def find(self, key):
+        """ returns the row of `key`, or -1 """
+        key = key.encode() if isinstance(key, str) else key
+        keys = self.index['key']
+        i = np.searchsorted(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return int(i)
+        return -1
+
+    def __contains__(self, key):
+        return self.find(key) != -1
+
+    def __getitem__(self, key):
+        i = self.find(key)
+        if i == -1:
+            raise KeyError(key)
+        return self.get_row(i)
+
+    def get(self, key, default=None):
+        i = self.find(key)
+        return default if i == -1 else self.get_row(i)
+
+    def get_row(self, i):
+        row = self.index[i]
+        if not row['valid']:
+            return None, None, None
+        return float(row['score']), row['bbox'].tolist(), row['landmark'].tolist()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        for key in self.index['key']:
+            yield key.decode()
+
+
+def getDicts(datapath, vols=range(1, 10), strict=True):
+    """ load the compiled annotations of all volumes under `datapath`
+
+    Params:
+        strict: {bool} raise if the `detect.txt` of a volume is missing, else skip it
+    Returns:
+        dicts:  {dict{'DATAx': DetectIndex}}
+    """
+    dicts = dict()
+    for vol in ["DATA%d" % _ for _ in vols]:
+        txtfile = os.path.join(os.path.expanduser(datapath), vol, "detect.txt")
+        if not strict and not os.path.isfile(txtfile):
+            continue
+        dicts[vol] = DetectIndex(txtfile)
+    return dicts
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    datapath = sys.argv[1] if len(sys.argv) > 1 else '~/myDataset/ECUST/'
+    for vol in ["DATA%d" % _ for _ in range(1, 10)]:
+        txtfile = os.path.join(os.path.expanduser(datapath), vol, "detect.txt")
+        if os.path.isfile(txtfile):
+            print('compiled {}'.format(compile_detect(txtfile)))
+            assert check_index(txtfile) == 0, 'the index of {} differs from it! '.format(txtfile)
+    start_time = time.time()
+    dicts = getDicts(datapath, strict=False)
+    print('{} volumes opened in {:.2f}ms'.format(
+        len(dicts), (time.time() - start_time) * 1000))
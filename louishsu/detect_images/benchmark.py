@@ -0,0 +1,83 @@
+"""
+Per-stage profile of `MtcnnDetector` over a directory of images, e.g.
+
+    python benchmark.py ./images --outfile ./anno/profile.jsonl --dsize 400 300
+    python benchmark.py ./images --backend torch --pack --min_face_size 20 --scale_factor 0.709
+
+Each image is written as one record into `outfile` (see `models/mtcnn/profiler.py`),
+and the summary of all the records is printed at the end. The summary of an existing
+file is printed by
+
+    python models/mtcnn/profiler.py ./anno/profile.jsonl
+"""
+import os
+import glob
+import argparse
+import cv2
+from detect import init_detector
+from models.mtcnn.profiler import StageProfiler, summarize, format_summary
+
+
+def list_images(imgdir, exts=('jpg', 'jpeg', 'png', 'bmp')):
+    paths = []
+    for ext in exts:
+        paths += glob.glob(os.path.join(imgdir, '**', '*.' + ext), recursive=True)
+    return sorted(paths)
+
+
+def benchmark(detector, paths, outfile=None, dsize=None, warmup=3):
+    """
+    Params:
+        detector:   {MtcnnDetector}
+        paths:      {list[str]}
+        outfile:    {str} json-lines file, or None
+        dsize:      {tuple(w: int, h: int)} resize the images before detection, as `detect_size`
+        warmup:     {int} number of images detected before profiling
+    Returns:
+        records:    {list[dict]}
+    """
+    profiler = StageProfiler(outfile)
+    previous = detector.profiler
+    for i, path in enumerate(paths):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            print('{}: not an image'.format(path))
+            continue
+        if dsize is not None:
+            image = cv2.resize(image, dsize)
+        if i < warmup:
+            detector.detect(image)
+            continue
+        detector.profiler = profiler
+        profiler.begin(image=path)
+        detector.detect(image)
+        profiler.end()
+    detector.profiler = previous
+    profiler.close()
+    return profiler.records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='per-stage profile of MtcnnDetector')
+    parser.add_argument('imgdir')
+    parser.add_argument('--outfile', default='./anno/profile.jsonl')
+    parser.add_argument('--dsize', type=int, nargs=2, default=None, metavar=('W', 'H'))
+    parser.add_argument('--backend', default='tf', choices=['tf', 'torch'])
+    parser.add_argument('--pack', action='store_true', help='pack the pyramid, see `detect_pnet_packed`')
+    parser.add_argument('--threshold', type=float, nargs=3, default=None)
+    parser.add_argument('--min_face_size', type=int, default=None)
+    parser.add_argument('--scale_factor', type=float, default=None)
+    parser.add_argument('--warmup', type=int, default=3)
+    args = parser.parse_args()
+
+    detector = init_detector(pack_pyramid=args.pack, backend=args.backend)
+    if args.threshold is not None:
+        detector.thresh = args.threshold
+    if args.min_face_size is not None:
+        detector.min_face_size = args.min_face_size
+    if args.scale_factor is not None:
+        detector.scale_factor = args.scale_factor
+
+    records = benchmark(detector, list_images(args.imgdir), args.outfile,
+                        None if args.dsize is None else tuple(args.dsize), args.warmup)
+    print(format_summary(summarize(records)))
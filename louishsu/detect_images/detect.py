@@ -1,40 +1,56 @@
 import os
 import sys
 import cv2
+import zlib
+from functools import partial
 from PIL import Image
 import numpy as np
 import matplotlib.pyplot as plt
 from models.mtcnn.detectors import Detector, FcnDetector, MtcnnDetector
 from models.mtcnn.models import P_Net, R_Net, O_Net
+from models.mtcnn.nms import overlaps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models/mtcnn'))
+from detect_farm import run_farm
 from load_data import load_rgb, load_multi, show_result
 from utiles import getTime, getVol, getWavelen
 from processbar import ProcessBar
 from noise import gaussianNoise, spNoise, signal_to_noise_ratio
+from detect_cache import DetectCache, detector_params
 
 ORIGINSIZE = (1648, 1236)
 DATAPATH   = "/home/louishsu/Work/Workspace/ECUST2019_rename"
 # DATAPATH   = "/home/louishsu/Work/Workspace/ECUST2019"
 DIRNAME    = "DATA{volidx}/{subidx}/{datatype}/{illumtype}/{datatype}_{posidx}_W1_{glass}"
 
-def init_detector():
+def init_detector(pack_pyramid=False, n_threads=None, backend='tf'):
+    """
+    Params:
+        backend:    {str} 'tf' for the checkpoints in `models/mtcnn/modelfile`,
+                    'torch' for the `det1/2/3.npy` weights, see `models/mtcnn/torch_mtcnn.py`
+    """
     thresh = [0.9, 0.6, 0.7]
     min_face_size = 12
     stride = 2
     slide_window = False
-    detectors = [None, None, None]
-    prefix = ['./models/mtcnn/modelfile/PNet/PNet', 
-                './models/mtcnn/modelfile/RNet/RNet', 
-                './models/mtcnn/modelfile/ONet/ONet']
-    epoch = [18, 14, 16]
-    model_path = ['%s-%s' % (x, y) for x, y in zip(prefix, epoch)]
-    PNet = FcnDetector(P_Net, model_path[0]);       detectors[0] = PNet
-    RNet = Detector(R_Net, 24, 1, model_path[1]);   detectors[1] = RNet
-    ONet = Detector(O_Net, 48, 1, model_path[2]);   detectors[2] = ONet
+    if backend == 'torch':
+        from models.mtcnn.torch_mtcnn import create_detectors
+        detectors = create_detectors(n_threads=n_threads)
+    else:
+        detectors = [None, None, None]
+        prefix = ['./models/mtcnn/modelfile/PNet/PNet', 
+                    './models/mtcnn/modelfile/RNet/RNet', 
+                    './models/mtcnn/modelfile/ONet/ONet']
+        epoch = [18, 14, 16]
+        model_path = ['%s-%s' % (x, y) for x, y in zip(prefix, epoch)]
+        PNet = FcnDetector(P_Net, model_path[0], n_threads=n_threads);       detectors[0] = PNet
+        RNet = Detector(R_Net, 24, None, model_path[1], n_threads=n_threads);   detectors[1] = RNet
+        ONet = Detector(O_Net, 48, None, model_path[2], n_threads=n_threads);   detectors[2] = ONet
     mtcnn_detector = MtcnnDetector(detectors=detectors,
                                     min_face_size=min_face_size,
                                     stride=stride, 
                                     threshold=thresh, 
-                                    slide_window=slide_window)
+                                    slide_window=slide_window,
+                                    pack_pyramid=pack_pyramid)
     return mtcnn_detector
 
 def _square(bbox):
@@ -69,7 +85,17 @@ def _detect_c3(detector, img_c3):
     for i in range(3):
         img_c3[:, :, i] = cv2.equalizeHist(img_c3[:, :, i])     # 直方图均衡化
     boxes_c, landmarks = detector.detect(img_c3)
+    return _select_center(boxes_c, landmarks, img_c3.shape)
 
+def _select_center(boxes_c, landmarks, shape):
+    """
+    Params:
+        boxes_c:    {ndarray(n_faces, 5)} output of `detector.detect`
+        landmarks:  {ndarray(n_faces, 10)}
+        shape:      {tuple(H, W, C)}
+    Returns:
+        see `_detect_c3`
+    """
     n = boxes_c.shape[0]
     if n==0: return None, None, None
     scores = boxes_c[:, -1]
@@ -80,7 +106,7 @@ def _detect_c3(detector, img_c3):
     # idx = np.argmax(areas)
     
     # 最中心
-    imgct = np.array(img_c3.shape[:2]) / 2
+    imgct = np.array(shape[:2]) / 2
     xx = 0.5 * (bboxes[:, 2] + bboxes[:, 0]).reshape((-1, 1))
     yy = 0.5 * (bboxes[:, 3] + bboxes[:, 1]).reshape((-1, 1))
     centers = np.c_[yy, xx]
@@ -93,12 +119,19 @@ def _detect_c3(detector, img_c3):
     landmark = landmarks[idx].astype('int')
     return score, bbox, landmark
 
-def detect_multi(detector, multi):
+def detect_multi(detector, multi, adaptive=False, n_seeds=3, n_agree=3, iou_thresh=0.6):
     """
     Params:
         detector:   {mtcnn_detector}
         multi:      {ndarray(H, W, C)}
+        adaptive:   {bool} detect on a few high-contrast bands only, see `_detect_multi_adaptive`
+        n_seeds, n_agree, iou_thresh: see `_detect_multi_adaptive`
+    Returns:
+        score, bbox, landmark: as `_detect_c3`, averaged over the bands
     """
+    if adaptive:
+        return _detect_multi_adaptive(detector, multi, n_seeds, n_agree, iou_thresh)
+
     c = multi.shape[-1]
     scores = []
     bboxes = []
@@ -120,6 +153,89 @@ def detect_multi(detector, multi):
     # show_result(img, score.reshape([-1]), bbox.reshape([1, -1]), landmark.reshape([1, -1]))
     return score, bbox, landmark
 
+def band_contrast(multi, step=4):
+    """
+    Params:
+        multi:      {ndarray(H, W, C)}
+        step:       {int} subsampling of the pixels
+    Returns:
+        contrast:   {ndarray(C)} standard deviation of each band
+    """
+    c = multi.shape[-1]
+    return multi[::step, ::step].reshape(-1, c).std(axis=0)
+
+def _equalize_c3(band):
+    """
+    Params:
+        band:       {ndarray(H, W)}
+    Returns:
+        img_c3:     {ndarray(H, W, 3)} equalized, as the input of `detector.detect` in `_detect_c3`
+    """
+    band = cv2.equalizeHist(band)
+    return np.stack([band, band, band], axis=2)
+
+def _detect_multi_adaptive(detector, multi, n_seeds=3, n_agree=3, iou_thresh=0.6):
+    """
+    Params:
+        detector:   {mtcnn_detector}
+        multi:      {ndarray(H, W, C)}
+        n_seeds:    {int} number of bands with the full three-stage detection
+        n_agree:    {int} stop once this number of bands agree
+        iou_thresh: {float} bands agree if their box overlaps the reference one by IoU >= iou_thresh
+    Returns:
+        score, bbox, landmark: as `_detect_c3`, averaged over the agreeing bands
+    Notes:
+        - Bands are visited from the highest contrast.
+        - The seed bands run P-Net, R-Net and O-Net, and return early once `n_agree` bands agree
+          with the most confident box. If no seed band finds a face, the next bands are tried
+          until one does, as `detect_multi` finds a face if any band does.
+        - The other bands only run O-Net on the box fused from the seeds, `n_agree` bands per
+          `predict`, until `n_agree` bands agree in total.
+    """
+    order = np.argsort(-band_contrast(multi), kind='stable')
+
+    detections = []         # (score, bbox, landmark)
+    def agreeing():
+        bboxes = np.array([bbox for _, bbox, _ in detections], dtype='float')
+        ref = bboxes[[np.argmax([score for score, _, _ in detections])]]
+        ious = overlaps(bboxes, ref)[:, 0]
+        return [d for d, iou in zip(detections, ious) if iou >= iou_thresh]
+
+    ## full detection on the seed bands
+    n_visited = 0
+    for i in order:
+        if n_visited >= n_seeds and len(detections) > 0: break
+        n_visited += 1
+        score, bbox, landmark = _select_center(
+                *detector.detect(_equalize_c3(multi[:, :, i])), shape=multi.shape)
+        if score is None: continue
+        detections.append((score, bbox, landmark))
+        if len(agreeing()) >= n_agree: break
+    if len(detections)==0: return None, None, None
+    detections = agreeing()
+
+    ## check the fused box on the other bands with O-Net only
+    rest = order[n_visited:]
+    fused = np.mean([bbox for _, bbox, _ in detections], axis=0)
+    dets = np.r_[fused, np.max([score for score, _, _ in detections])].reshape(1, 5)
+    for start in range(0, len(rest), n_agree):
+        if len(detections) >= n_agree: break
+        crops = [detector.crop_boxes(_equalize_c3(multi[:, :, i]), dets.copy(), 48) \
+                                                for i in rest[start: start + n_agree]]
+        cls_scores, reg, landmarks = detector.onet_detector.predict(
+                                                np.concatenate([c for _, c in crops], axis=0))
+        for j, (dets_sq, _) in enumerate(crops):
+            _, boxes_c, landmark = detector.refine_onet(dets_sq,
+                        cls_scores[j: j + 1], reg[j: j + 1], landmarks[j: j + 1])
+            if boxes_c is None: continue
+            if overlaps(boxes_c, dets)[0, 0] < iou_thresh: continue
+            detections.append((boxes_c[0, -1], boxes_c[0, :-1].astype('int'), landmark[0].astype('int')))
+
+    score     = np.mean([score    for score, _, _    in detections], axis=0)
+    bbox      = np.mean([bbox     for _, bbox, _     in detections], axis=0, dtype='int')
+    landmark  = np.mean([landmark for _, _, landmark in detections], axis=0, dtype='int')
+    return score, bbox, landmark
+
 def listFiles():
     """
     Note:
@@ -148,12 +264,27 @@ def listFiles():
                             filelist += [filename]
     return filelist
 
-def detect_size(detector, filelist, dsize):
+def _format_line(filename, score, bbox, landmark):
+    score = "" if score is None else str(score)
+    bbox = "" if bbox is None else ' '.join(map(str, list(bbox)))
+    landmark = "" if landmark is None else ' '.join(map(str, list(landmark)))
+    return "{} {} {} {}\n".format(filename, score, bbox, landmark)
+
+def _to_cached(score, bbox, landmark, **kwargs):
+    """ detection result as a json serializable `DetectCache` value,
+    the score is kept as printed so that the cached lines are identical """
+    return dict(score=None if score is None else str(score),
+                bbox=None if bbox is None else [int(x) for x in bbox],
+                landmark=None if landmark is None else [int(x) for x in landmark],
+                **kwargs)
+
+def detect_size(detector, filelist, dsize, cache=None):
     """
     Params:
         detector:   {MtcnnDetector}
         filelist:   {list[str]}
         dsize:      {tuple(w: int, h: int)}
+        cache:      {DetectCache} reuse the results of the same file, size and detector
     """
     annodir = './anno'
     if not os.path.exists(annodir):
@@ -162,10 +293,19 @@ def detect_size(detector, filelist, dsize):
     
     bar = ProcessBar(total_step=len(filelist), title='{}x{} Almost D'.format(dsize[0], dsize[1]))
     f = open(annofile, 'w')
+    params = None if cache is None else detector_params(detector)
     
     for filename in filelist:
         bar.step()
 
+        ## cached
+        if cache is not None:
+            key = cache.key(os.path.join(DATAPATH, filename), dsize=list(dsize), detector=params)
+            cached = cache.get(key)
+            if cached is not None:
+                f.write(_format_line(filename, cached['score'], cached['bbox'], cached['landmark']))
+                continue
+
         ## read image
         image = cv2.imread(os.path.join(DATAPATH, filename), cv2.IMREAD_ANYCOLOR)
         if len(image.shape) == 2:
@@ -175,22 +315,26 @@ def detect_size(detector, filelist, dsize):
         
         ## detect
         score, bbox, landmark = _detect_c3(detector, image)
-        score = "" if score is None else str(score)
-        bbox = "" if bbox is None else ' '.join(map(str, list(bbox)))
-        landmark = "" if landmark is None else ' '.join(map(str, list(landmark)))
-        line = "{} {} {} {}\n".format(filename, score, bbox, landmark)
+        line = _format_line(filename, score, bbox, landmark)
+        if cache is not None:
+            cache.put(key, _to_cached(score, bbox, landmark))
         
         ## save result
         f.write(line)
 
     f.close()
+    if cache is not None:
+        cache.flush()
 
-def detect_noise(detector, filelist, dsize, noise_rate):
+def detect_noise(detector, filelist, dsize, noise_rate, cache=None, seed=None):
     """
     Params:
         detector:   {MtcnnDetector}
         filelist:   {list[str]}
         dsize:      {tuple(w: int, h: int)}
+        cache:      {DetectCache} reuse the results of the same file, size, noise and detector,
+                        only used if `seed` is given
+        seed:       {int} the noise of each file is seeded by `seed` and its name, so it is reproducible
     """
 
     annodir = './anno'
@@ -202,9 +346,22 @@ def detect_noise(detector, filelist, dsize, noise_rate):
     bar = ProcessBar(total_step=len(filelist), title='{:.2f} Almost D'.format(noise_rate))
     f = open(annofile, 'w')
     snr = []
+    if seed is None: cache = None       # unseeded noise is not reproducible
+    params = None if cache is None else detector_params(detector)
     
     for filename in filelist:
         bar.step()
+        noise_seed = None if seed is None else zlib.crc32('{}:{}'.format(seed, filename).encode())
+
+        ## cached
+        if cache is not None:
+            key = cache.key(os.path.join(DATAPATH, filename), dsize=list(dsize), detector=params,
+                            noise=dict(mode='s&p', amount=noise_rate, seed=noise_seed))
+            cached = cache.get(key)
+            if cached is not None:
+                snr += [cached['snr']]
+                f.write(_format_line(filename, cached['score'], cached['bbox'], cached['landmark']))
+                continue
 
         ## read image
         img = cv2.imread(os.path.join(DATAPATH, filename), cv2.IMREAD_ANYCOLOR)
@@ -212,7 +369,7 @@ def detect_noise(detector, filelist, dsize, noise_rate):
 
         ## add noise
         # image = gaussianNoise(img, 0, 75, noise_rate)
-        image = spNoise(img, noise_rate)
+        image = spNoise(img, noise_rate, seed=noise_seed)
         # cv2.imshow("", image); cv2.waitKey(1)
         snr += [signal_to_noise_ratio(img, image)]
 
@@ -221,16 +378,57 @@ def detect_noise(detector, filelist, dsize, noise_rate):
         
         ## detect
         score, bbox, landmark = _detect_c3(detector, image)
-        score = "" if score is None else str(score)
-        bbox = "" if bbox is None else ' '.join(map(str, list(bbox)))
-        landmark = "" if landmark is None else ' '.join(map(str, list(landmark)))
-        line = "{} {} {} {}\n".format(filename, score, bbox, landmark)
+        line = _format_line(filename, score, bbox, landmark)
+        if cache is not None:
+            cache.put(key, _to_cached(score, bbox, landmark, snr=float(snr[-1])))
         
         ## save result
         f.write(line)
 
     f.write("SNR: {:.6f}".format(np.mean(np.array(snr))))
     f.close()
+    if cache is not None:
+        cache.flush()
+
+def _detect_file(detector, payload):
+    """
+    Params:
+        detector:   {MtcnnDetector}
+        payload:    {tuple(path: str, dsize: tuple(w: int, h: int) or None)}
+    Returns:
+        see `_detect_c3`
+    """
+    path, dsize = payload
+    image = cv2.imread(path, cv2.IMREAD_ANYCOLOR)
+    if len(image.shape) == 2:
+        image = image[:, :, np.newaxis]
+        image = np.concatenate([image, image, image], axis=2)
+    if dsize is not None:
+        image = cv2.resize(image, dsize)
+    return _detect_c3(detector, image)
+
+def detect_farm(filelist, dsize=None, n_workers=4, n_threads=1, resume=True, backend='tf'):
+    """ detect with `n_workers` processes and save the results into `DATAx/detect.txt`
+    Params:
+        filelist:   {list[str]} e.g. from `listFiles`
+        dsize:      {tuple(w: int, h: int)}
+        n_workers:  {int} number of processes, each with its own detector
+        n_threads:  {int} intra-op threads of each detector
+        resume:     {bool} keep the results in `detect.txt` and its journal, only detect the others
+        backend:    {str} 'tf' or 'torch', see `init_detector`
+    Notes:
+        - see `models/mtcnn/detect_farm.py`
+    """
+    volumes = dict()
+    for filename in filelist:
+        vol = filename.split('/')[0]                            # DATAx
+        volumes.setdefault(vol, []).append(filename)
+
+    for vol, files in sorted(volumes.items()):
+        tasks = [(filename[len(vol):].split('.')[0], (os.path.join(DATAPATH, filename), dsize)) \
+                                                                        for filename in files]
+        run_farm(tasks, partial(init_detector, backend=backend), _detect_file,
+                        os.path.join(DATAPATH, vol, 'detect.txt'), n_workers=n_workers, n_threads=n_threads, resume=resume)
 
 def detect_statistic_size(dsize):
     """
@@ -358,6 +556,8 @@ if __name__ == "__main__":
     # detector = init_detector()
     # filelist = listFiles()
     # detect_size(detector, filelist, ORIGINSIZE)
+    # detect_size(detector, filelist, ORIGINSIZE, cache=DetectCache('./anno/detect_cache.db'))
+    # detect_farm(listFiles(), n_workers=4, n_threads=2)
     # detect_statistic((400, 300))
     
 
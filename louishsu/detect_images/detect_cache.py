@@ -0,0 +1,150 @@
+"""
+Persistent cache of the detection results of `detect_size` / `detect_noise`.
+
+Each result is addressed by the sha1 of
+    (file path, mtime, size, resize target, noise parameters, detector parameters)
+so that a result is reused only if the image and all the parameters are the same,
+and stored in an sqlite3 database in WAL mode, which allows several sweeps to read
+and write it at the same time. Interrupted or repeated sweeps only detect the
+images that are missing.
+"""
+import os
+import json
+import sqlite3
+import hashlib
+
+
+def _net_id(net):
+    """ e.g. 'FcnDetector:/path/to/PNet-18', 'TorchDetector:/path/to/det2.npy', or None for a missing stage """
+    if net is None:
+        return None
+    model_path = getattr(net, 'model_path', None)
+    return '%s:%s' % (type(net).__name__, os.path.abspath(model_path) if model_path else '')
+
+
+def detector_params(detector):
+    """
+    Params:
+        detector:   {MtcnnDetector}
+    Returns:
+        params:     {dict} parameters of the detector which change the results,
+                    including the backend and weights of the P/R/O-Nets
+    """
+    return dict(
+        nets=[_net_id(net) for net in (detector.pnet_detector, detector.rnet_detector, detector.onet_detector)],
+        thresh=[float(t) for t in detector.thresh],
+        min_face_size=detector.min_face_size,
+        stride=detector.stride,
+        scale_factor=detector.scale_factor,
+        slide_window=detector.slide_window,
+        pack_pyramid=getattr(detector, 'pack_pyramid', False),
+    )
+
+
+class DetectCache(object):
+    """ e.g.
+
+        cache = DetectCache('./anno/detect_cache.db')
+        key = cache.key(path, dsize=dsize, detector=detector_params(detector))
+        result = cache.get(key)
+        if result is None:
+            result = dict(score=..., bbox=..., landmark=...)
+            cache.put(key, result)
+        cache.close()
+
+    The connection is opened lazily in each process, so that the cache can be
+    passed to worker processes.
+    """
+
+    def __init__(self, dbfile='./anno/detect_cache.db', timeout=60, commit_every=64):
+        """
+        Params:
+            dbfile:     {str}
+            timeout:    {float} seconds to wait for the lock of other writers
+            commit_every: {int} number of `put` per transaction
+        """
+        self.dbfile = dbfile
+        self.timeout = timeout
+        self.commit_every = commit_every
+        self._pid = None
+        self._conn = None
+        self._pending = []
+
+    @property
+    def conn(self):
+        if self._conn is None or self._pid != os.getpid():
+            dirname = os.path.dirname(self.dbfile)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname, exist_ok=True)
+            self._conn = sqlite3.connect(self.dbfile, timeout=self.timeout)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS detect (key TEXT PRIMARY KEY, value TEXT)')
+            self._conn.commit()
+            self._pid = os.getpid()
+            self._pending = []
+        return self._conn
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_conn'] = None
+        state['_pending'] = []
+        return state
+
+    @staticmethod
+    def key(filepath, **params):
+        """
+        Params:
+            filepath:   {str} image file, its mtime and size are part of the key
+            params:     {dict} json serializable, e.g. dsize, noise and detector parameters
+        Returns:
+            key:        {str} sha1 hex digest
+        """
+        st = os.stat(filepath)
+        content = json.dumps([os.path.abspath(filepath), st.st_mtime_ns, st.st_size, params],
+                             sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Returns:
+            value:      {dict} or None if not cached
+        """
+        for k, value in self._pending:
+            if k == key:
+                return json.loads(value)
+        row = self.conn.execute('SELECT value FROM detect WHERE key = ?', (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key, value):
+        """
+        Params:
+            key:        {str} from `key`
+            value:      {dict} json serializable
+        """
+        self.conn
+        self._pending.append((key, json.dumps(value)))
+        if len(self._pending) >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO detect (key, value) VALUES (?, ?)', self._pending)
+        self._pending = []
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self.flush()
+            self._conn.close()
+        self._conn = None
+
+    def __len__(self):
+        self.flush()
+        return self.conn.execute('SELECT COUNT(*) FROM detect').fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -1,3 +1,8 @@
+"""
+The default detectors `PNet`, `RNet`, `ONet` and `mtcnn_detector` are built on
+first access, so that importing a submodule, e.g. `models.mtcnn.detectors`
+in `detect.py` and its `detect_farm` workers, creates no TensorFlow session.
+"""
 from .detectors import Detector, FcnDetector, MtcnnDetector, py_nms
 from .models import P_Net, R_Net, O_Net
 
@@ -5,13 +10,25 @@ prefix = ['./models/mtcnn/modelfile/PNet/PNet', './models/mtcnn/modelfile/RNet/R
 epoch = [18, 14, 16]
 model_path = ['%s-%s' % (x, y) for x, y in zip(prefix, epoch)]
 
-detectors = [None, None, None]
-PNet = FcnDetector(P_Net,     model_path[0]);   detectors[0] = PNet
-RNet = Detector(R_Net, 24, 1, model_path[1]);   detectors[1] = RNet
-ONet = Detector(O_Net, 48, 1, model_path[2]);   detectors[2] = ONet
+_default = None
 
-mtcnn_detector = MtcnnDetector(detectors=detectors,
-                                min_face_size=48,
-                                stride=2, 
-                                threshold=[0.9, 0.6, 0.6], 
-                                slide_window=False)
\ No newline at end of file
+def _build_default():
+    detectors = [None, None, None]
+    PNet = FcnDetector(P_Net,     model_path[0]);   detectors[0] = PNet
+    RNet = Detector(R_Net, 24, None, model_path[1]);   detectors[1] = RNet
+    ONet = Detector(O_Net, 48, None, model_path[2]);   detectors[2] = ONet
+
+    mtcnn_detector = MtcnnDetector(detectors=detectors,
+                                    min_face_size=48,
+                                    stride=2, 
+                                    threshold=[0.9, 0.6, 0.6], 
+                                    slide_window=False)
+    return dict(PNet=PNet, RNet=RNet, ONet=ONet, mtcnn_detector=mtcnn_detector)
+
+def __getattr__(name):
+    global _default
+    if name in ('PNet', 'RNet', 'ONet', 'mtcnn_detector'):
+        if _default is None:
+            _default = _build_default()
+        return _default[name]
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
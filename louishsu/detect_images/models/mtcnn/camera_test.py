@@ -20,8 +20,8 @@ epoch = [18, 14, 16]
 
 model_path = ['%s-%s' % (x, y) for x, y in zip(prefix, epoch)]
 PNet = FcnDetector(P_Net, model_path[0]);       detectors[0] = PNet
-RNet = Detector(R_Net, 24, 1, model_path[1]);   detectors[1] = RNet
-ONet = Detector(O_Net, 48, 1, model_path[2]);   detectors[2] = ONet
+RNet = Detector(R_Net, 24, None, model_path[1]);   detectors[1] = RNet
+ONet = Detector(O_Net, 48, None, model_path[2]);   detectors[2] = ONet
 mtcnn_detector = MtcnnDetector(detectors=detectors,
                                 min_face_size=min_face_size,
                                 stride=stride, 
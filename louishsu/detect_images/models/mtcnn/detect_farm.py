@@ -0,0 +1,172 @@
+# coding:utf-8
+"""
+Multi-process detection runner shared by
+    - louishsu/detect_images/detect.py
+    - zxy/detect and crop/0_detect_only.py, 1_detect_and_savetxt.py
+
+The tasks are sharded over `n_workers` processes. Each worker builds its detector
+(TensorFlow session) once with `init_fn`, pinned to `n_threads` intra-op threads, and
+streams the results back over a queue. The main process is the only writer: it
+appends each result to a journal `<outfile>.part` as soon as it arrives, and writes
+`<outfile>` in the `detect.txt` format, i.e. `str(dict)` of
+    {key: (score, bbox, landmark)}
+when all the tasks are done. After a crash, running again skips the keys already
+in the journal (or in `<outfile>`) and only detects the rest.
+
+This file does not import TensorFlow, the workers are started with `spawn`, so
+`init_fn` and `detect_fn` must be module-level functions. Each worker imports their
+module again, which must not build any detector at import, otherwise the worker
+holds unpinned sessions besides the one of `init_fn` (see `models/mtcnn/__init__.py`).
+"""
+import os
+import ast
+import queue
+import numpy as np
+import multiprocessing as mp
+
+
+def _to_python(value):
+    """ numpy values to python ones, so that the results can be read back by `ast.literal_eval` """
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_python(v) for v in value)
+    return value
+
+
+def load_results(outfile):
+    """
+    Params:
+        outfile:    {str} `detect.txt` format file, its journal is read too
+    Returns:
+        results:    {dict} finished results, a truncated last line of the journal is ignored
+    """
+    results = dict()
+    if os.path.exists(outfile):
+        with open(outfile, 'r') as f:
+            results.update(ast.literal_eval(f.read()))
+    journal = outfile + '.part'
+    if os.path.exists(journal):
+        with open(journal, 'r') as f:
+            for line in f:
+                try:
+                    key, value = ast.literal_eval(line)
+                except (SyntaxError, ValueError):
+                    continue
+                results[key] = value
+    return results
+
+
+def save_results(outfile, results, keys):
+    """ write `results` to `outfile` in the `detect.txt` format, the journal is removed
+    once the results of all the `keys` are there
+
+    Params:
+        outfile:    {str}
+        results:    {dict} {key: (score, bbox, landmark)}, all the entries of `outfile`,
+                        including those of other runs which are not in `keys`
+        keys:       {iterable} keys of the tasks of this run
+    """
+    # write to a temporary file first, so that a crash never leaves a partial `outfile`
+    tmpfile = '{}.{}.tmp'.format(outfile, os.getpid())
+    with open(tmpfile, 'w') as f:
+        f.write(str(results))
+        f.write('\n')
+    os.replace(tmpfile, outfile)
+    journal = outfile + '.part'
+    if all([key in results for key in keys]) and os.path.exists(journal):
+        os.remove(journal)
+
+
+def _worker(init_fn, init_args, detect_fn, n_threads, tasks, results):
+    os.environ['OMP_NUM_THREADS'] = str(n_threads)
+    try:
+        import cv2
+        cv2.setNumThreads(n_threads)
+    except ImportError:
+        pass
+
+    state = init_fn(*init_args, n_threads=n_threads)
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        key, payload = task
+        try:
+            results.put((key, _to_python(detect_fn(state, payload)), None))
+        except Exception as e:
+            results.put((key, None, '{}: {}'.format(payload, e)))
+    results.put(None)
+
+
+def run_farm(tasks, init_fn, detect_fn, outfile, init_args=(), n_workers=4, n_threads=1, resume=True, verbose=True):
+    """
+    Params:
+        tasks:      {list[tuple(key, payload)]} `key` of the result dict, `payload` for `detect_fn`
+        init_fn:    {callable} init_fn(*init_args, n_threads=n_threads) -> state, called once per worker
+        detect_fn:  {callable} detect_fn(state, payload) -> (score, bbox, landmark), the task
+                        is left undone if it raises, and retried by the next run
+        outfile:    {str} output file in the `detect.txt` format
+        n_workers:  {int} number of worker processes
+        n_threads:  {int} intra-op threads of each worker
+        resume:     {bool} skip the keys in the journal or in `outfile`, detect all the `tasks` again if False
+    Returns:
+        results:    {dict} {key: (score, bbox, landmark)} in the order of `tasks`
+    """
+    keys = [key for key, _ in tasks]
+    journal = outfile + '.part'
+    if not resume and os.path.exists(journal):
+        os.remove(journal)
+    done = load_results(outfile)
+    if not resume:
+        retry = set(keys)
+        done = {key: value for key, value in done.items() if key not in retry}
+    todo = [(key, payload) for key, payload in tasks if key not in done]
+    if verbose:
+        print('{}: {} done, {} to detect'.format(outfile, len(tasks) - len(todo), len(todo)))
+
+    if len(todo) > 0:
+        ctx = mp.get_context('spawn')
+        task_queue = ctx.Queue()
+        result_queue = ctx.Queue()
+        for task in todo:
+            task_queue.put(task)
+        n_workers = max(1, min(n_workers, len(todo)))
+        for _ in range(n_workers):
+            task_queue.put(None)
+        workers = [ctx.Process(target=_worker, daemon=True,
+                        args=(init_fn, init_args, detect_fn, n_threads, task_queue, result_queue)) \
+                                for _ in range(n_workers)]
+        for w in workers:
+            w.start()
+
+        n_running, n_finished = n_workers, 0
+        with open(journal, 'a') as f:
+            while n_running > 0:
+                try:
+                    item = result_queue.get(timeout=10)
+                except queue.Empty:
+                    if not any([w.is_alive() for w in workers]):
+                        print('all the workers exited, {} tasks left undone'.format(len(todo) - n_finished))
+                        break
+                    continue
+                if item is None:
+                    n_running -= 1
+                    continue
+                key, value, error = item
+                n_finished += 1
+                if error is not None:
+                    print(error)
+                    continue
+                done[key] = value
+                f.write(repr((key, value)) + '\n')
+                f.flush()
+                if verbose and n_finished % 100 == 0:
+                    print('{}/{}'.format(n_finished, len(todo)))
+        for w in workers:
+            w.join(timeout=10)
+
+    # the entries of `outfile` which are not in `tasks`, e.g. of other file lists, are kept
+    save_results(outfile, done, keys)
+    results = {key: done[key] for key, _ in tasks if key in done}
+    return results
@@ -1,10 +1,22 @@
 # coding:utf-8
 
+import os
 import sys
 import cv2
 import time
 import numpy as np
 import tensorflow as tf
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from box_utils import crop_resize
+from nms import nms, batched_nms
+from profiler import NULL_PROFILER
+
+def session_config(n_threads=None):
+    """ config of the sessions, `n_threads` pins the intra-op threads, e.g. one session per process """
+    if n_threads is None:
+        return tf.ConfigProto(allow_soft_placement=True, gpu_options=tf.GPUOptions(allow_growth=True))
+    return tf.ConfigProto(allow_soft_placement=True, gpu_options=tf.GPUOptions(allow_growth=True),
+                        intra_op_parallelism_threads=n_threads, inter_op_parallelism_threads=1)
 
 def py_nms(dets, thresh, mode="Union"):
     """
@@ -14,37 +26,9 @@ def py_nms(dets, thresh, mode="Union"):
     :param dets: [[x1, y1, x2, y2 score]]
     :param thresh: retain overlap <= thresh
     :return: indexes to keep
+    :note: the same boxes as the original loop, see `nms.py`
     """
-    x1 = dets[:, 0]
-    y1 = dets[:, 1]
-    x2 = dets[:, 2]
-    y2 = dets[:, 3]
-    scores = dets[:, 4]
-
-    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-    order = scores.argsort()[::-1]
-
-    keep = []
-    while order.size > 0:
-        i = order[0]
-        keep.append(i)
-        xx1 = np.maximum(x1[i], x1[order[1:]])
-        yy1 = np.maximum(y1[i], y1[order[1:]])
-        xx2 = np.minimum(x2[i], x2[order[1:]])
-        yy2 = np.minimum(y2[i], y2[order[1:]])
-
-        w = np.maximum(0.0, xx2 - xx1 + 1)
-        h = np.maximum(0.0, yy2 - yy1 + 1)
-        inter = w * h
-        if mode == "Union":
-            ovr = inter / (areas[i] + areas[order[1:]] - inter)
-        elif mode == "Minimum":
-            ovr = inter / np.minimum(areas[i], areas[order[1:]])
-        #keep
-        inds = np.where(ovr <= thresh)[0]
-        order = order[inds + 1]
-
-    return keep
+    return nms(dets, thresh, mode)
 
 
 class FcnDetector(object):
@@ -57,7 +41,7 @@ class FcnDetector(object):
         - For P-Net
     """
 
-    def __init__(self, net_factory, model_path):
+    def __init__(self, net_factory, model_path, n_threads=None):
 
         graph = tf.Graph()
         with graph.as_default():        # 新生成的图作为整个`tensorflow`运行环境的默认
@@ -68,7 +52,7 @@ class FcnDetector(object):
             image_reshape = tf.reshape(self.image_op, [1, self.height_op, self.width_op, 3])
             self.cls_prob, self.bbox_pred, _ = net_factory(image_reshape, training=False)
             
-            self.sess = tf.Session(config=tf.ConfigProto(allow_soft_placement=True, gpu_options=tf.GPUOptions(allow_growth=True)))
+            self.sess = tf.Session(config=session_config(n_threads))
             
             saver = tf.train.Saver()
             # ----- check -----
@@ -83,6 +67,8 @@ class FcnDetector(object):
 
             # print(self.sess.graph.get_operations())
 
+        self.model_path = model_path
+
     def predict(self, databatch):
         height, width, _ = databatch.shape
         cls_prob, bbox_pred = self.sess.run([self.cls_prob, self.bbox_pred],
@@ -100,12 +86,14 @@ class Detector(object):
         cls_prob:   {tensor(batch_size, 2)}
         bbox_pred:  {tensor(batch_size, 4)}
         data_size:  24 for R-Net and 48 for O-Net
-        batch_size: 
+        batch_size: {int} fixed batch size, or None for a variable batch dimension
+        max_batch_size: {int} maximum number of boxes in one run if `batch_size` is None
+        n_threads:  {int} intra-op threads of the session, see `session_config`
     Notes:
         - For R-Net and O-Net
     """
 
-    def __init__(self, net_factory, data_size, batch_size, model_path):
+    def __init__(self, net_factory, data_size, batch_size, model_path, max_batch_size=512, n_threads=None):
 
         graph = tf.Graph()
         with graph.as_default():
@@ -116,8 +104,7 @@ class Detector(object):
             self.cls_prob, self.bbox_pred, self.landmark_pred = net_factory(self.image_op, training=False)
             
 
-            self.sess = tf.Session(
-                config=tf.ConfigProto(allow_soft_placement=True, gpu_options=tf.GPUOptions(allow_growth=True)))
+            self.sess = tf.Session(config=session_config(n_threads))
             
 
             saver = tf.train.Saver()
@@ -131,8 +118,10 @@ class Detector(object):
             # -----------------
             saver.restore(self.sess, model_path)
 
+        self.model_path = model_path
         self.data_size = data_size
         self.batch_size = batch_size
+        self.max_batch_size = max_batch_size
 
 
     def predict(self, databatch):
@@ -142,6 +131,9 @@ class Detector(object):
             databatch: {tensor(batch_size, data_size, data_size)}
         """
 
+        if self.batch_size is None:
+            return self.predict_variable(databatch)
+
         scores = []
         batch_size = self.batch_size
 
@@ -187,6 +179,32 @@ class Detector(object):
                 np.concatenate(bbox_pred_list, axis=0),\
                 np.concatenate(landmark_pred_list, axis=0)
 
+    def predict_variable(self, databatch):
+        """ all boxes in one run, or in runs of `max_batch_size`, without padding
+
+        Args:
+            databatch: {tensor(n_boxes, data_size, data_size, 3)}
+        """
+        n = databatch.shape[0]
+        if n == 0:
+            return np.zeros((0, 2), dtype=np.float32),\
+                    np.zeros((0, 4), dtype=np.float32),\
+                    np.zeros((0, 10), dtype=np.float32)
+
+        cls_prob_list = []
+        bbox_pred_list = []
+        landmark_pred_list = []
+        for cur in range(0, n, self.max_batch_size):
+            data = databatch[cur: cur + self.max_batch_size]
+            cls_prob, bbox_pred, landmark_pred = self.sess.run([self.cls_prob, self.bbox_pred, self.landmark_pred], feed_dict={self.image_op: data})
+            cls_prob_list.append(cls_prob)
+            bbox_pred_list.append(bbox_pred)
+            landmark_pred_list.append(landmark_pred)
+
+        return np.concatenate(cls_prob_list, axis=0),\
+                np.concatenate(bbox_pred_list, axis=0),\
+                np.concatenate(landmark_pred_list, axis=0)
+
 
 class MtcnnDetector(object):
 
@@ -197,7 +215,16 @@ class MtcnnDetector(object):
                  threshold=[0.6, 0.7, 0.7],
                  scale_factor=0.79,
                  # scale_factor=0.709,#change
-                 slide_window=False):
+                 slide_window=False,
+                 pack_pyramid=False,
+                 profiler=None):
+        """
+        Args:
+            pack_pyramid: {bool} run P-Net once over all the scales tiled on one canvas,
+                        see `detect_pnet_packed`
+            profiler: {StageProfiler} records the time and the number of candidates of
+                        each stage, see `profiler.py`
+        """
 
         self.pnet_detector = detectors[0]
         self.rnet_detector = detectors[1]
@@ -207,6 +234,8 @@ class MtcnnDetector(object):
         self.thresh = threshold
         self.scale_factor = scale_factor
         self.slide_window = slide_window
+        self.pack_pyramid = pack_pyramid
+        self.profiler = NULL_PROFILER if profiler is None else profiler
 
     def convert_to_square(self, bbox):
         """ 以图像中心为基准，以长边为边长，划出新的正方形框
@@ -377,42 +406,162 @@ class MtcnnDetector(object):
                                     x1_offset, y1_offset, x2_offset, y2_offset ]
         """
 
+        if self.pack_pyramid:
+            all_boxes, all_scales = self.detect_pnet_packed(im)
+            return self.merge_pnet_boxes(all_boxes, all_scales)
+
         h, w, c = im.shape
         net_size = 12
+        prof = self.profiler
 
         current_scale = float(net_size) / self.min_face_size    # find initial scale
-        im_resized = self.processed_image(im, current_scale)    # resize
+        with prof.timer('resize', scale=current_scale):
+            im_resized = self.processed_image(im, current_scale)    # resize
         current_height, current_width, _ = im_resized.shape
 
 
         # 改变图像的尺度，在多尺度下进行搜索框，并使用NMS算法合并框
         all_boxes = list()
+        all_scales = list()
         while min(current_height, current_width) > net_size:
 
             # generate boxes using P-Net
-            cls_cls_map, reg = self.pnet_detector.predict(im_resized)
+            with prof.timer('pnet', scale=current_scale, size=im_resized.shape[:2]) as event:
+                cls_cls_map, reg = self.pnet_detector.predict(im_resized)
             boxes = self.generate_bbox(cls_cls_map[:, :, 1], reg, current_scale, self.thresh[0])
+            event['n_boxes'] = len(boxes)
 
             # resize image
             current_scale *= self.scale_factor
-            im_resized = self.processed_image(im, current_scale)
+            with prof.timer('resize', scale=current_scale):
+                im_resized = self.processed_image(im, current_scale)
             current_height, current_width, _ = im_resized.shape
 
-            # merging boxes
             if boxes.size == 0:
                 continue
-            keep = py_nms(boxes[:, :5], 0.5, 'Union')
-            boxes = boxes[keep]
             all_boxes.append(boxes)
+            all_scales.append(np.full(boxes.shape[0], len(all_scales)))
+
+        return self.merge_pnet_boxes(all_boxes, all_scales)
+
+    def pyramid_scales(self, h, w):
+        """ scales of the image pyramid, the same as the loop in `detect_pnet`
+
+        Args:
+            h, w:   {int} size of the image
+        Returns:
+            scales: {list[float]}
+        """
+        net_size = 12
+        scales = []
+        current_scale = float(net_size) / self.min_face_size
+        while min(int(h * current_scale), int(w * current_scale)) > net_size:
+            scales.append(current_scale)
+            current_scale *= self.scale_factor
+        return scales
+
+    def packed_pyramid(self, im, scales, gap=2):
+        """ tile the resized images of all scales onto one canvas, shelf by shelf
+
+        Args:
+            im:     {ndarray(H, W, C)}
+            scales: {list[float]} in descending order
+            gap:    {int} pixels between the images
+        Returns:
+            canvas: {ndarray(H', W', C)} normalized as `processed_image`, 0 between the images
+            places: {list[tuple(y, x, h, w)]} even offsets and sizes of each scale on the canvas
+        """
+        even = lambda x: x + x % 2
+        sizes = [(int(im.shape[0] * scale), int(im.shape[1] * scale)) for scale in scales]
+        canvas_w = even(sizes[0][1]) + gap
+        if len(sizes) > 1:
+            canvas_w += even(sizes[1][1]) + gap
+
+        places = []
+        x, y, shelf_h = 0, 0, 0
+        for h, w in sizes:
+            if x + w > canvas_w:
+                x, y, shelf_h = 0, y + shelf_h, 0
+            places.append((y, x, h, w))
+            x += even(w) + gap
+            shelf_h = max(shelf_h, even(h) + gap)
+
+        canvas = np.zeros((y + shelf_h, canvas_w, im.shape[2]), dtype=np.float32)
+        for scale, (y, x, h, w) in zip(scales, places):
+            canvas[y: y + h, x: x + w] = self.processed_image(im, scale)
+        return canvas, places
+
+    def detect_pnet_packed(self, im):
+        """ P-Net over the whole pyramid in one run
+
+        The offsets on the canvas are even, so the stride-2 cells of P-Net over the
+        canvas align with those over each scale, and each scale gets the sub-block of
+        the heatmap whose windows lie inside it. The boxes are the same as the loop in
+        `detect_pnet`, except for slightly different scores on the last row/column of
+        odd-sized scales, whose pooling window reaches one pixel past the image.
+
+        Args:
+            im: {ndarray(H, W, C)}
+        Returns:
+            all_boxes: {list[ndarray(n_boxes, 9)]} boxes of each scale before NMS
+            all_scales:{list[ndarray(n_boxes)]} index of the scale of the boxes
+        """
+
+        h, w, c = im.shape
+        scales = self.pyramid_scales(h, w)
+        if len(scales) == 0:
+            return [], []
+        with self.profiler.timer('resize', scales=len(scales)):
+            canvas, places = self.packed_pyramid(im, scales)
+        with self.profiler.timer('pnet', scales=len(scales), size=canvas.shape[:2]) as event:
+            cls_cls_map, reg = self.pnet_detector.predict(canvas)
+        event['n_boxes'] = 0
+
+        all_boxes = list()
+        all_scales = list()
+        for scale, (y, x, h, w) in zip(scales, places):
+            # output size of P-Net: conv 3x3, pool 2x2 'SAME', conv 3x3, conv 3x3
+            out_h, out_w = (h - 1) // 2 - 4, (w - 1) // 2 - 4
+            cls_map = cls_cls_map[y // 2: y // 2 + out_h, x // 2: x // 2 + out_w, 1]
+            reg_map = reg[y // 2: y // 2 + out_h, x // 2: x // 2 + out_w]
+            boxes = self.generate_bbox(cls_map, reg_map, scale, self.thresh[0])
+            event['n_boxes'] += len(boxes)
+
+            if boxes.size == 0:
+                continue
+            all_boxes.append(boxes)
+            all_scales.append(np.full(boxes.shape[0], len(all_scales)))
+
+        return all_boxes, all_scales
+
+    def merge_pnet_boxes(self, all_boxes, all_scales):
+        """ merge the boxes of all scales and calibrate them
+
+        Args:
+            all_boxes: {list[ndarray(n_boxes, 9)]}
+            all_scales:{list[ndarray(n_boxes)]} index of the scale of the boxes
+        Returns:
+            see `detect_pnet`
+        Notes:
+            - NMS of each scale is done by one `batched_nms` call
+        """
 
         if len(all_boxes) == 0:
             return None, None, None
         all_boxes = np.vstack(all_boxes)
-
-
-        # merge the detection from first stage
-        keep = py_nms(all_boxes[:, 0:5], 0.7, 'Union')
-        all_boxes = all_boxes[keep]
+        all_scales = np.concatenate(all_scales)
+        prof = self.profiler
+
+        with prof.timer('nms', n_boxes=all_boxes.shape[0]):
+            # merging boxes of each scale
+            keep = batched_nms(all_boxes[:, 0:5], all_scales, 0.5, 'Union')
+            all_boxes = all_boxes[keep]
+            prof.count('pnet_nms_scale', len(keep))
+
+            # merge the detection from first stage
+            keep = py_nms(all_boxes[:, 0:5], 0.7, 'Union')
+            all_boxes = all_boxes[keep]
+            prof.count('pnet_nms', len(keep))
         boxes = all_boxes[:, :5]
 
         # refine the boxes
@@ -430,45 +579,49 @@ class MtcnnDetector(object):
 
         return boxes, boxes_c, None
 
-    def detect_rnet(self, im, dets):
-        """ Get face candidates using rnet
+    def crop_boxes(self, im, dets, size):
+        """ crop the candidates of last stage from the image
 
         Parameters:
-            im:     {ndarray(batch_size, H, W, C)}
-            dets:   {ndarray(batch_size, n_boxes, 5)}
-                        output of last stage, [x1, y1, x2, y2, score]
+            im:     {ndarray(H, W, C)}
+            dets:   {ndarray(n_boxes, 5)} output of last stage, [x1, y1, x2, y2, score]
+            size:   {int} 24 for R-Net and 48 for O-Net
         Returns:
-            boxes:  {ndarray(batch_size, 5)} 
-                        - [x1, y1, x2, y2, score] 
-                        - detected boxes before calibration
-            boxes_c:{ndarray(batch_size, 5)} 
-                        - [x1, y1, x2, y2, score]
-                        - boxes after calibration
+            dets:   {ndarray(n_boxes, 5)} squared, rounded and clipped to the image
+            cropped_ims: {ndarray(n_boxes, size, size, 3)} normalized
         """
 
         h, w, c = im.shape
 
 
-        dets = self.convert_to_square(dets)
-        dets[:, 0: 4] = np.round(dets[:, 0: 4])
+        with self.profiler.timer('crop', size=size, n_boxes=dets.shape[0]):
+            dets = self.convert_to_square(dets)
+            dets[:, 0: 4] = np.round(dets[:, 0: 4])
 
-        [dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph] = self.pad(dets, w, h)
-        n_boxes = dets.shape[0]
+            [dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph] = self.pad(dets, w, h)
+
+            # 按上一级输出结果，切割原图中的人脸
+            cropped_ims = crop_resize(im, y - dy, x - dx, tmph, tmpw, size)
+            cropped_ims = (cropped_ims - 127.5) / 128
 
-        
-        # 按P-Net输出结果，切割原图中的人脸
-        cropped_ims = np.zeros((n_boxes, 24, 24, 3), dtype=np.float32)
-        for i in range(n_boxes):
-            tmp = np.zeros((tmph[i], tmpw[i], 3), dtype=np.uint8)
-            tmp[dy[i]:edy[i] + 1, dx[i]:edx[i] + 1, :] = im[y[i]:ey[i] + 1, x[i]:ex[i] + 1, :]
-            cropped_ims[i, :, :, :] = (cv2.resize(tmp, (24, 24)) - 127.5) / 128
 
+        return dets, cropped_ims
 
-        cls_scores, reg, _ = self.rnet_detector.predict(cropped_ims)
+    def refine_rnet(self, dets, cls_scores, reg):
+        """ filter and calibrate the candidates with the outputs of R-Net
+
+        Parameters:
+            dets:       {ndarray(n_boxes, 5)} output of `crop_boxes`
+            cls_scores: {ndarray(n_boxes, 2)}
+            reg:        {ndarray(n_boxes, 4)}
+        Returns:
+            see `detect_rnet`
+        """
 
         # 筛选出概率大于阈值的结果
         cls_scores = cls_scores[:, 1]
         keep_inds = np.where(cls_scores > self.thresh[1])[0]
+        self.profiler.count('rnet_pass', len(keep_inds))
         if len(keep_inds) > 0:
             boxes = dets[keep_inds]             # 筛选出P-Net的框
             boxes[:, 4] = cls_scores[keep_inds] # 更新框的评分
@@ -477,55 +630,28 @@ class MtcnnDetector(object):
 
         keep = py_nms(boxes, 0.6)
         boxes = boxes[keep]
+        self.profiler.count('rnet_nms', len(keep))
 
         boxes_c = self.calibrate_box(boxes, reg[keep])
 
         return boxes, boxes_c, None
 
+    def refine_onet(self, dets, cls_scores, reg, landmark):
+        """ filter and calibrate the candidates with the outputs of O-Net
 
-
-    def detect_onet(self, im, dets):
-        """Get face candidates using onet
-
-        Args:
-            im:     {ndarray(batch_size, H, W, C)}
-            dets:   {ndarray(batch_size, n_boxes, 5)}
-                        output of last stage, [x1, y1, x2, y2, score]
+        Parameters:
+            dets:       {ndarray(n_boxes, 5)} output of `crop_boxes`
+            cls_scores: {ndarray(n_boxes, 2)}
+            reg:        {ndarray(n_boxes, 4)}
+            landmark:   {ndarray(n_boxes, 10)}
         Returns:
-            boxes:  {ndarray(batch_size, 5)} 
-                        - [x1, y1, x2, y2, score] 
-                        - detected boxes before calibration
-            boxes_c:{ndarray(batch_size, 5)} 
-                        - [x1, y1, x2, y2, score]
-                        - boxes after calibration
-            landmark:{ndarray(batch_size, 10)}
+            see `detect_onet`
         """
 
-        h, w, c = im.shape
-
-
-        dets = self.convert_to_square(dets)
-        dets[:, 0: 4] = np.round(dets[:, 0: 4])
-
-        [dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph] = self.pad(dets, w, h)
-        n_boxes = dets.shape[0]
-
-        
-        # 按R-Net输出结果，切割原图中的人脸
-        cropped_ims = np.zeros((n_boxes, 48, 48, 3), dtype=np.float32)
-        for i in range(n_boxes):
-            tmp = np.zeros((tmph[i], tmpw[i], 3), dtype=np.uint8)
-            tmp[dy[i]:edy[i] + 1, dx[i]:edx[i] + 1, :] =\
-                                    im[y[i]:ey[i] + 1, x[i]:ex[i] + 1, :]
-            cropped_ims[i, :, :, :] = (cv2.resize(tmp, (48, 48)) - 127.5) / 128
-
-
-        cls_scores, reg, landmark = self.onet_detector.predict(cropped_ims)
-
-
         # 筛选出概率大于阈值的结果
         cls_scores = cls_scores[:, 1]
         keep_inds = np.where(cls_scores > self.thresh[2])[0]
+        self.profiler.count('onet_pass', len(keep_inds))
         if len(keep_inds) > 0:
             boxes = dets[keep_inds]             # 筛选出R-Net的框
             boxes[:, 4] = cls_scores[keep_inds] # 更新框的评分
@@ -548,12 +674,96 @@ class MtcnnDetector(object):
 
         keep = py_nms(boxes_c, 0.6, "Minimum")
         boxes_c = boxes_c[keep]
+        self.profiler.count('onet_nms', len(keep))
 
         landmark = landmark[keep]
 
 
         return boxes, boxes_c, landmark
 
+    def detect_rnet(self, im, dets):
+        """ Get face candidates using rnet
+
+        Parameters:
+            im:     {ndarray(batch_size, H, W, C)}
+            dets:   {ndarray(batch_size, n_boxes, 5)}
+                        output of last stage, [x1, y1, x2, y2, score]
+        Returns:
+            boxes:  {ndarray(batch_size, 5)} 
+                        - [x1, y1, x2, y2, score] 
+                        - detected boxes before calibration
+            boxes_c:{ndarray(batch_size, 5)} 
+                        - [x1, y1, x2, y2, score]
+                        - boxes after calibration
+        """
+
+        dets, cropped_ims = self.crop_boxes(im, dets, 24)
+        with self.profiler.timer('rnet', batch=cropped_ims.shape[0]):
+            cls_scores, reg, _ = self.rnet_detector.predict(cropped_ims)
+        return self.refine_rnet(dets, cls_scores, reg)
+
+    def detect_onet(self, im, dets):
+        """Get face candidates using onet
+
+        Args:
+            im:     {ndarray(batch_size, H, W, C)}
+            dets:   {ndarray(batch_size, n_boxes, 5)}
+                        output of last stage, [x1, y1, x2, y2, score]
+        Returns:
+            boxes:  {ndarray(batch_size, 5)} 
+                        - [x1, y1, x2, y2, score] 
+                        - detected boxes before calibration
+            boxes_c:{ndarray(batch_size, 5)} 
+                        - [x1, y1, x2, y2, score]
+                        - boxes after calibration
+            landmark:{ndarray(batch_size, 10)}
+        """
+
+        dets, cropped_ims = self.crop_boxes(im, dets, 48)
+        with self.profiler.timer('onet', batch=cropped_ims.shape[0]):
+            cls_scores, reg, landmark = self.onet_detector.predict(cropped_ims)
+        return self.refine_onet(dets, cls_scores, reg, landmark)
+
+    def detect_images(self, imgs):
+        """ Detect faces over several images, the candidates of all images are
+        refined by R-Net and O-Net in one `predict` each
+
+        Args: 
+            imgs: {list[ndarray(H, W, C)]}
+        Returns:
+            results: {list[tuple(boxes_c, landmark)]} as `detect`
+        """
+
+        empty = (np.array([]), np.array([]))
+        self.profiler.begin(n_images=len(imgs))
+        boxes_list = [self.detect_pnet(img)[1] for img in imgs]
+
+        stages = [(self.rnet_detector, 24), (self.onet_detector, 48)]
+        landmarks = [None] * len(imgs)
+        for stage, (detector, size) in enumerate(stages):
+            index = [i for i, boxes in enumerate(boxes_list) if boxes is not None]
+            if len(index) == 0:
+                break
+
+            crops = [self.crop_boxes(imgs[i], boxes_list[i], size) for i in index]
+            batch = np.concatenate([c for _, c in crops], axis=0)
+            with self.profiler.timer(['rnet', 'onet'][stage], batch=batch.shape[0]):
+                outputs = detector.predict(batch)
+            sections = np.cumsum([c.shape[0] for _, c in crops])[:-1]
+            outputs = [np.split(o, sections) for o in outputs]
+
+            for j, i in enumerate(index):
+                cls_scores, reg, landmark = [o[j] for o in outputs]
+                if stage == 0:
+                    _, boxes_list[i], _ = self.refine_rnet(crops[j][0], cls_scores, reg)
+                else:
+                    _, boxes_list[i], landmarks[i] = self.refine_onet(crops[j][0], cls_scores, reg, landmark)
+
+        results = [empty if boxes is None else (boxes, landmark) \
+                    for boxes, landmark in zip(boxes_list, landmarks)]
+        self.profiler.end(n_faces=[len(boxes) for boxes, _ in results])
+        return results
+
 
     def detect(self, img):
         """ 
@@ -566,6 +776,13 @@ class MtcnnDetector(object):
             - Detect face over image
         """
 
+        self.profiler.begin(shape=img.shape[:2])
+        boxes_c, landmark = self._detect(img)
+        self.profiler.end(n_faces=len(boxes_c))
+        return boxes_c, landmark
+
+    def _detect(self, img):
+
         boxes = None
         t = time.time()
 
@@ -0,0 +1,227 @@
+# coding:utf-8
+"""
+Per-stage profiling of the MTCNN detectors in
+    - louishsu/detect_images/models/mtcnn/detectors.py (`MtcnnDetector(profiler=...)`)
+    - zxy/detect and crop/toolkit/detect_face.py (`detect_face(..., profiler=...)`)
+
+One record is written per image, as one line of json:
+
+    {"image": "...", "shape": [h, w], "total_ms": 35.2, "n_faces": 1,
+     "stages": [{"stage": "resize", "ms": 1.2, "scale": 0.6},
+                {"stage": "pnet", "ms": 3.1, "scale": 0.6, "size": [741, 988], "n_boxes": 120},
+                ...
+                {"stage": "crop", "ms": 0.4, "size": 24, "n_boxes": 35},
+                {"stage": "rnet", "ms": 2.0, "batch": 35},
+                ...],
+     "counts": {"pnet_nms_scale": 80, "pnet_nms": 35, "rnet_pass": 6, "rnet_nms": 4, ...}}
+
+The detectors use `NULL_PROFILER` by default, which records nothing.
+
+    - `StageProfiler`:  collects the records, into a json-lines file and/or in memory
+    - `load_records`:   reads a json-lines file
+    - `summarize`, `format_summary`: statistics of the time of each stage and of the counts
+
+Run `python profiler.py <file.jsonl>` to print the summary of a file.
+"""
+import os
+import sys
+import time
+import json
+from contextlib import contextmanager
+import numpy as np
+
+
+class _NullProfiler(object):
+    """ the interface of `StageProfiler`, doing nothing """
+
+    def begin(self, **info):
+        pass
+
+    def end(self, **info):
+        pass
+
+    @contextmanager
+    def timer(self, stage, **info):
+        yield dict()
+
+    def count(self, name, n):
+        pass
+
+NULL_PROFILER = _NullProfiler()
+
+
+class StageProfiler(object):
+    """ e.g.
+
+        profiler = StageProfiler('./anno/profile.jsonl')
+        detector = MtcnnDetector(detectors, ..., profiler=profiler)
+        for path in paths:
+            profiler.begin(image=path)
+            detector.detect(cv2.imread(path))
+            profiler.end()
+        profiler.close()
+        print(format_summary(summarize(profiler.records)))
+
+    `begin`/`end` may be nested, e.g. by the caller and by `detect`, the record is
+    written by the outermost `end`.
+    """
+
+    def __init__(self, sink=None, keep=True):
+        """
+        Params:
+            sink:   {str} json-lines file to append the records to, or None
+            keep:   {bool} keep the records in `self.records`
+        """
+        self.sink = None
+        if sink is not None:
+            dirname = os.path.dirname(sink)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname, exist_ok=True)
+            self.sink = open(sink, 'a')
+        self.keep = keep
+        self.records = []
+        self._record = None
+        self._depth = 0
+        self._start = 0.
+
+    def begin(self, **info):
+        if self._depth == 0:
+            self._record = dict(stages=[], counts=dict())
+            self._start = time.perf_counter()
+        self._depth += 1
+        for k, v in info.items():
+            self._record.setdefault(k, _to_json(v))
+
+    def end(self, **info):
+        if self._depth == 0:
+            return
+        self._depth -= 1
+        for k, v in info.items():
+            self._record[k] = _to_json(v)
+        if self._depth > 0:
+            return
+        self._record['total_ms'] = (time.perf_counter() - self._start) * 1000
+        self._record['stages'] = [{k: _to_json(v) for k, v in event.items()} for event in self._record['stages']]
+        if self.sink is not None:
+            self.sink.write(json.dumps(self._record) + '\n')
+            self.sink.flush()
+        if self.keep:
+            self.records.append(self._record)
+        self._record = None
+
+    @contextmanager
+    def timer(self, stage, **info):
+        """ time the block as `stage`, the yielded dict takes more fields until `end`,
+        e.g. the number of boxes known after the block """
+        event = dict(stage=stage)
+        event.update(info)
+        start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            event['ms'] = (time.perf_counter() - start) * 1000
+            if self._record is not None:
+                self._record['stages'].append(event)
+
+    def count(self, name, n):
+        """ number of candidates, e.g. surviving an NMS, summed over the calls of the record """
+        if self._record is not None:
+            counts = self._record['counts']
+            counts[name] = counts.get(name, 0) + int(n)
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+
+def _to_json(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, tuple):
+        return [_to_json(v) for v in value]
+    return value
+
+
+def load_records(jsonl):
+    """
+    Params:
+        jsonl:      {str}
+    Returns:
+        records:    {list[dict]}
+    """
+    with open(jsonl, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _stats(values):
+    values = np.asarray(values, dtype=np.float64)
+    return dict(n=int(values.size), mean=float(values.mean()), p50=float(np.percentile(values, 50)),
+                p95=float(np.percentile(values, 95)), max=float(values.max()))
+
+
+def summarize(records):
+    """
+    Params:
+        records:    {list[dict]}
+    Returns:
+        summary:    {dict}
+            - total:    statistics of `total_ms` of the images
+            - stages:   {stage: dict(calls=statistics of the ms of each call,
+                                    image=statistics of the ms summed per image,
+                                    batch=statistics of the batch sizes, if any)}
+            - counts:   {name: statistics of the count per image}
+    """
+    summary = dict(n_images=len(records), stages=dict(), counts=dict())
+    if len(records) == 0:
+        return summary
+    summary['total'] = _stats([r['total_ms'] for r in records])
+
+    calls, per_image, batches = dict(), dict(), dict()
+    for r in records:
+        image_ms = dict()
+        for event in r['stages']:
+            stage = event['stage']
+            calls.setdefault(stage, []).append(event['ms'])
+            image_ms[stage] = image_ms.get(stage, 0.) + event['ms']
+            if 'batch' in event:
+                batches.setdefault(stage, []).append(event['batch'])
+        for stage, ms in image_ms.items():
+            per_image.setdefault(stage, []).append(ms)
+    for stage in calls:
+        summary['stages'][stage] = dict(calls=_stats(calls[stage]),
+                    image=_stats(per_image[stage] + [0.] * (len(records) - len(per_image[stage]))))
+        if stage in batches:
+            summary['stages'][stage]['batch'] = _stats(batches[stage])
+
+    names = sorted(set([name for r in records for name in r['counts']]))
+    for name in names:
+        summary['counts'][name] = _stats([r['counts'].get(name, 0) for r in records])
+    return summary
+
+
+def format_summary(summary):
+    """ the summary as a table """
+    lines = ['{} images'.format(summary['n_images'])]
+    if summary['n_images'] == 0:
+        return lines[0]
+    total = summary['total']
+    lines.append('total ms/image: mean {:.2f}, p50 {:.2f}, p95 {:.2f}, max {:.2f}'.format(
+                    total['mean'], total['p50'], total['p95'], total['max']))
+    lines.append('')
+    lines.append('{:>10s} | {:>7s} {:>9s} {:>9s} | {:>9s} {:>7s} | {:>9s}'.format(
+                    'stage', 'calls', 'mean ms', 'p95 ms', 'ms/image', 'share', 'batch'))
+    for stage, s in sorted(summary['stages'].items(), key=lambda x: -x[1]['image']['mean']):
+        batch = '{:.1f}'.format(s['batch']['mean']) if 'batch' in s else '-'
+        lines.append('{:>10s} | {:7d} {:9.3f} {:9.3f} | {:9.3f} {:6.1%} | {:>9s}'.format(
+                    stage, s['calls']['n'], s['calls']['mean'], s['calls']['p95'],
+                    s['image']['mean'], s['image']['mean'] / total['mean'], batch))
+    lines.append('')
+    lines.append('{:>16s} | {:>9s} {:>9s} {:>9s}'.format('count/image', 'mean', 'p95', 'max'))
+    for name, s in summary['counts'].items():
+        lines.append('{:>16s} | {:9.1f} {:9.1f} {:9.0f}'.format(name, s['mean'], s['p95'], s['max']))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    print(format_summary(summarize(load_records(sys.argv[1]))))
@@ -0,0 +1,273 @@
+# coding:utf-8
+"""
+PyTorch P-Net, R-Net and O-Net with the weights `det1.npy`, `det2.npy` and `det3.npy`
+of zxy/detect and crop/toolkit, i.e. the same graphs as `PNet`, `RNet` and `ONet` of
+`detect_face.py`, without building TensorFlow sessions.
+
+    - `PNet`, `RNet`, `ONet`:   {nn.Module} NCHW, scriptable by `torch.jit.script`
+    - `create_mtcnn`:           the same functions as `detect_face.create_mtcnn`, for
+                                `detect_face` and `bulk_detect_face`
+    - `TorchFcnDetector`, `TorchDetector`:
+                                the `predict` interface of `FcnDetector` and `Detector`,
+                                for `MtcnnDetector`
+
+The weights were converted from caffe, so the networks take the images transposed
+(width as height), as `detect_face.py` feeds them; the adapters of `MtcnnDetector`
+transpose the inputs and outputs themselves.
+"""
+import os
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from typing import Tuple
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          '../../../../zxy/detect and crop/toolkit')
+
+
+def max_pool_same(x, kernel_size: int, stride: int):
+    """ max pooling with the 'SAME' padding of TensorFlow, i.e. padded by -inf, more at the bottom/right """
+    h, w = x.shape[2], x.shape[3]
+    pad_h = max(((h + stride - 1) // stride - 1) * stride + kernel_size - h, 0)
+    pad_w = max(((w + stride - 1) // stride - 1) * stride + kernel_size - w, 0)
+    x = F.pad(x, [pad_w // 2, pad_w - pad_w // 2, pad_h // 2, pad_h - pad_h // 2], value=float('-inf'))
+    return F.max_pool2d(x, kernel_size, stride)
+
+
+def flatten_nhwc(x):
+    """ flatten in the order of TensorFlow, the weights of the fc layers expect NHWC """
+    return x.permute(0, 2, 3, 1).reshape(x.shape[0], -1)
+
+
+class PNet(nn.Module):
+
+    def __init__(self):
+        super(PNet, self).__init__()
+        self.conv1 = nn.Conv2d(3, 10, 3)
+        self.prelu1 = nn.PReLU(10)
+        self.conv2 = nn.Conv2d(10, 16, 3)
+        self.prelu2 = nn.PReLU(16)
+        self.conv3 = nn.Conv2d(16, 32, 3)
+        self.prelu3 = nn.PReLU(32)
+        self.conv4_1 = nn.Conv2d(32, 2, 1)
+        self.conv4_2 = nn.Conv2d(32, 4, 1)
+
+    def forward(self, x) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            x:      {tensor(N, 3, H, W)}
+        Returns:
+            reg:    {tensor(N, 4, H', W')}
+            prob:   {tensor(N, 2, H', W')}
+        """
+        x = max_pool_same(self.prelu1(self.conv1(x)), 2, 2)
+        x = self.prelu2(self.conv2(x))
+        x = self.prelu3(self.conv3(x))
+        return self.conv4_2(x), F.softmax(self.conv4_1(x), dim=1)
+
+
+class RNet(nn.Module):
+
+    def __init__(self):
+        super(RNet, self).__init__()
+        self.conv1 = nn.Conv2d(3, 28, 3)
+        self.prelu1 = nn.PReLU(28)
+        self.conv2 = nn.Conv2d(28, 48, 3)
+        self.prelu2 = nn.PReLU(48)
+        self.conv3 = nn.Conv2d(48, 64, 2)
+        self.prelu3 = nn.PReLU(64)
+        self.conv4 = nn.Linear(576, 128)
+        self.prelu4 = nn.PReLU(128)
+        self.conv5_1 = nn.Linear(128, 2)
+        self.conv5_2 = nn.Linear(128, 4)
+
+    def forward(self, x) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            x:      {tensor(N, 3, 24, 24)}
+        Returns:
+            reg:    {tensor(N, 4)}
+            prob:   {tensor(N, 2)}
+        """
+        x = max_pool_same(self.prelu1(self.conv1(x)), 3, 2)
+        x = F.max_pool2d(self.prelu2(self.conv2(x)), 3, 2)
+        x = self.prelu3(self.conv3(x))
+        x = self.prelu4(self.conv4(flatten_nhwc(x)))
+        return self.conv5_2(x), F.softmax(self.conv5_1(x), dim=1)
+
+
+class ONet(nn.Module):
+
+    def __init__(self):
+        super(ONet, self).__init__()
+        self.conv1 = nn.Conv2d(3, 32, 3)
+        self.prelu1 = nn.PReLU(32)
+        self.conv2 = nn.Conv2d(32, 64, 3)
+        self.prelu2 = nn.PReLU(64)
+        self.conv3 = nn.Conv2d(64, 64, 3)
+        self.prelu3 = nn.PReLU(64)
+        self.conv4 = nn.Conv2d(64, 128, 2)
+        self.prelu4 = nn.PReLU(128)
+        self.conv5 = nn.Linear(1152, 256)
+        self.prelu5 = nn.PReLU(256)
+        self.conv6_1 = nn.Linear(256, 2)
+        self.conv6_2 = nn.Linear(256, 4)
+        self.conv6_3 = nn.Linear(256, 10)
+
+    def forward(self, x) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            x:      {tensor(N, 3, 48, 48)}
+        Returns:
+            reg:    {tensor(N, 4)}
+            landmark: {tensor(N, 10)} [x1, ..., x5, y1, ..., y5]
+            prob:   {tensor(N, 2)}
+        """
+        x = max_pool_same(self.prelu1(self.conv1(x)), 3, 2)
+        x = F.max_pool2d(self.prelu2(self.conv2(x)), 3, 2)
+        x = max_pool_same(self.prelu3(self.conv3(x)), 2, 2)
+        x = self.prelu4(self.conv4(x))
+        x = self.prelu5(self.conv5(flatten_nhwc(x)))
+        return self.conv6_2(x), self.conv6_3(x), F.softmax(self.conv6_1(x), dim=1)
+
+
+def load_npy(net, npyfile):
+    """ load the weights saved by `Network.load` of `detect_face.py`, e.g. 'conv4-1' into `net.conv4_1` """
+    data = np.load(npyfile, encoding='latin1', allow_pickle=True).item()
+    state = dict()
+    for layer, params in data.items():
+        name = layer.replace('-', '_').lower()
+        for param, value in params.items():
+            if param == 'alpha':
+                state[name + '.weight'] = value
+            elif param == 'biases':
+                state[name + '.bias'] = value
+            elif value.ndim == 4:                   # (k_h, k_w, c_i, c_o) -> (c_o, c_i, k_h, k_w)
+                state[name + '.weight'] = value.transpose(3, 2, 0, 1)
+            else:                                   # (c_i, c_o) -> (c_o, c_i)
+                state[name + '.weight'] = value.T
+    net.load_state_dict({k: torch.from_numpy(np.ascontiguousarray(v, dtype=np.float32)) for k, v in state.items()})
+    return net.eval()
+
+
+def load_nets(model_path=None, jit=True):
+    """
+    Returns:
+        pnet, rnet, onet: {nn.Module} or {torch.jit.ScriptModule} if `jit`
+    """
+    if not model_path:
+        model_path = MODEL_PATH
+    nets = [load_npy(net, os.path.join(model_path, npyfile)) for net, npyfile in \
+                zip([PNet(), RNet(), ONet()], ['det1.npy', 'det2.npy', 'det3.npy'])]
+    if jit:
+        nets = [torch.jit.script(net) for net in nets]
+    return nets
+
+
+def _run(net, img):
+    """ NHWC ndarray in, NHWC ndarrays out, as `sess.run` """
+    with torch.no_grad():
+        x = torch.from_numpy(np.ascontiguousarray(img, dtype=np.float32)).permute(0, 3, 1, 2)
+        outputs = net(x)
+    return tuple([o.permute(0, 2, 3, 1).numpy() if o.dim() == 4 else o.numpy() for o in outputs])
+
+
+def create_mtcnn(model_path=None, jit=True, n_threads=None):
+    """ the same as `detect_face.create_mtcnn(sess, model_path)`
+
+    Returns:
+        pnet_fun:   img {ndarray(N, W, H, 3)} -> (reg, prob)
+        rnet_fun:   img {ndarray(N, 24, 24, 3)} -> (reg, prob)
+        onet_fun:   img {ndarray(N, 48, 48, 3)} -> (reg, landmark, prob)
+    """
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+    pnet, rnet, onet = load_nets(model_path, jit)
+    pnet_fun = lambda img : _run(pnet, img)
+    rnet_fun = lambda img : _run(rnet, img)
+    onet_fun = lambda img : _run(onet, img)
+    return pnet_fun, rnet_fun, onet_fun
+
+
+class _TorchAdapter(object):
+
+    def __init__(self, net, bgr=True, model_path=None):
+        """
+        Args:
+            net:    {nn.Module} one of the outputs of `load_nets`
+            bgr:    {bool} the inputs are BGR, e.g. read by `cv2.imread`, the networks take RGB
+            model_path: {str} the weights file of `net`, identifies the detector, e.g. in `detector_params`
+        """
+        self.net = net
+        self.bgr = bgr
+        self.model_path = model_path
+
+    def run(self, databatch):
+        """ {ndarray(N, H, W, 3)} normalized as `processed_image`, transposed for the networks """
+        if self.bgr:
+            databatch = databatch[..., ::-1]
+        with torch.no_grad():
+            x = torch.from_numpy(np.ascontiguousarray(databatch, dtype=np.float32)).permute(0, 3, 2, 1)
+            return [o.numpy() for o in self.net(x)]
+
+
+class TorchFcnDetector(_TorchAdapter):
+    """ `FcnDetector.predict` with `PNet`, also takes batches of images of the same size """
+
+    def predict(self, databatch):
+        """
+        Args:
+            databatch:  {ndarray(H, W, 3)} or {ndarray(N, H, W, 3)}
+        Returns:
+            cls_prob:   {ndarray(H', W', 2)} or {ndarray(N, H', W', 2)}
+            bbox_pred:  {ndarray(H', W', 4)} or {ndarray(N, H', W', 4)} [dx1, dy1, dx2, dy2]
+        """
+        single = databatch.ndim == 3
+        if single:
+            databatch = databatch[np.newaxis]
+        reg, prob = self.run(databatch)
+        cls_prob, bbox_pred = prob.transpose(0, 3, 2, 1), reg.transpose(0, 3, 2, 1)
+        if single:
+            return cls_prob[0], bbox_pred[0]
+        return cls_prob, bbox_pred
+
+
+class TorchDetector(_TorchAdapter):
+    """ `Detector.predict` with `RNet` or `ONet` """
+
+    def predict(self, databatch):
+        """
+        Args:
+            databatch:  {ndarray(N, size, size, 3)}
+        Returns:
+            cls_prob:   {ndarray(N, 2)}
+            bbox_pred:  {ndarray(N, 4)}
+            landmark_pred: {ndarray(N, 10)} [x1, y1, ..., x5, y5], zeros for R-Net
+        """
+        n = databatch.shape[0]
+        if n == 0:
+            return np.zeros((0, 2), np.float32), np.zeros((0, 4), np.float32), np.zeros((0, 10), np.float32)
+        outputs = self.run(databatch)
+        landmark_pred = np.zeros((n, 10), dtype=np.float32)
+        if len(outputs) == 3:
+            reg, points, prob = outputs
+            landmark_pred[:, 0::2] = points[:, :5]
+            landmark_pred[:, 1::2] = points[:, 5:]
+        else:
+            reg, prob = outputs
+        return prob, reg, landmark_pred
+
+
+def create_detectors(model_path=None, jit=True, bgr=True, n_threads=None):
+    """
+    Returns:
+        detectors: {list} [P-Net, R-Net, O-Net] for `MtcnnDetector(detectors=...)`
+    """
+    if n_threads is not None:
+        torch.set_num_threads(n_threads)
+    pnet, rnet, onet = load_nets(model_path, jit)
+    npyfiles = [os.path.join(model_path or MODEL_PATH, npyfile) for npyfile in ['det1.npy', 'det2.npy', 'det3.npy']]
+    return [TorchFcnDetector(pnet, bgr, npyfiles[0]),
+            TorchDetector(rnet, bgr, npyfiles[1]),
+            TorchDetector(onet, bgr, npyfiles[2])]
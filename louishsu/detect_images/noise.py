@@ -17,16 +17,23 @@ def gaussianNoise(src, means, sigma, percetage):
     return dst
 
 # 椒盐噪声
-def spNoise(image, amount):
+def spNoise(image, amount, seed=None):
     """ 
     Parameters:
         image:  {ndarray(H, W, C)}
         amount: {float} roportion of image pixels to replace with noise on range [0, 1]
+        seed:   {int} seed of the noise, not reproducible if None
     Notes:
         Function to add random noise of various types to a floating-point image.
     """
     dtype = image.dtype
-    image = skimage.util.random_noise(image, mode='s&p', amount=amount)
+    if seed is None:
+        image = skimage.util.random_noise(image, mode='s&p', amount=amount)
+    else:
+        try:
+            image = skimage.util.random_noise(image, mode='s&p', amount=amount, rng=seed)
+        except TypeError:   # skimage < 0.21
+            image = skimage.util.random_noise(image, mode='s&p', amount=amount, seed=seed)
     image = (image * 255).astype(dtype)
     return image
 
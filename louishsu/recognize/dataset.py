@@ -13,6 +13,9 @@ from torchvision.transforms import ToTensor
 from config import configer
 from utiles import get_label_from_path, get_vol, get_wavelen
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../datasets/HyperECUST'))
+from detect_index import getDicts as getDetectIndex
+
 def load_multi(imgdir, dsize=None):
     assert os.path.exists(imgdir), "multi directory does not exist!"
     imgfiles = os.listdir(imgdir)
@@ -51,12 +54,7 @@ def resizeMulti(image, dsize):
     return ret
 
 def getDicts():
-    dicts = dict()
-    for vol in ["DATA%d" % _ for _ in range(1, 8)]:
-        txtfile = os.path.join(configer.datapath, vol, "detect.txt")
-        with open(txtfile, 'r') as f:
-            dicts[vol] = eval(f.read())
-    return dicts
+    return getDetectIndex(configer.datapath, range(1, 8))
 
 def gen_Multi_split(train=0.6, valid=0.2, test=0.2):
     get_vol = lambda i: (i-1)//10+1
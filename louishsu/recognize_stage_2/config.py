@@ -19,6 +19,8 @@ configer.batchsize = 2**7
 configer.lrbase = 5e-4
 configer.gamma = 0.2
 configer.cuda = True
+configer.n_workers = 8                 # 预载数据集的进程数, 0为串行
+configer.profile_sync = 0              # 每隔多少步同步CUDA以统计各阶段耗时, 0为不同步
 configer.savepath = 'checkpoints'
 
 ## ------------------------- 数据集相关 -------------------------
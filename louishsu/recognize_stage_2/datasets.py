@@ -8,7 +8,9 @@
 import os
 import cv2
 import numpy as np
+from functools import partial
 
+import torch
 from torch.utils.data       import Dataset
 from torchvision.transforms import ToTensor
 
@@ -19,7 +21,8 @@ class RecognizeDataset(Dataset):
 
     Attributes:
         labels:     {list[int]} label of subjects
-        samplelist: {list[list[tensor(C, H, W), int]]}
+        images:     {tensor(N, C, H, W)} uint8, only if `load_in_memory`
+        targets:    {tensor(N)} int64, only if `load_in_memory`
         
     Example:
         ```
@@ -40,7 +43,7 @@ class RecognizeDataset(Dataset):
     
     def __init__(self, datapath, type, splitmode, mode, 
                     usedChannels=None, condition=None, hist=True, 
-                    dsize=None, load_in_memory=True):
+                    dsize=None, load_in_memory=True, n_workers=0):
         """
         Params:
             datapath    {str} '/datasets/ECUSTDETECT/'
@@ -55,6 +58,7 @@ class RecognizeDataset(Dataset):
             hist:       {bool} 是否直方图均衡化
             dsize:      {tuple(H, W)}
             load_in_memory: {bool}
+            n_workers:  {int} 预载数据集的进程数, 小于2时串行载入
         """
         txtfile = './split/{}/{}_{}.txt'.format(splitmode, mode, type)
         with open(txtfile, 'r') as f:
@@ -72,13 +76,10 @@ class RecognizeDataset(Dataset):
         self.load_in_memory = load_in_memory
         
         if load_in_memory:
-            self.samplelist = list(map(lambda  x: \
-                [
-                    self.load_image(self.datapath, x, 
-                        self.type, self.usedChannels, 
-                        self.hist, self.dsize), 
-                    self._get_label(x)
-                ], self.filelist))
+            self.images = utils.preload_images(
+                    partial(self.read_image, self.datapath), self.filelist, 
+                    (self.type, self.usedChannels, self.hist, self.dsize), n_workers)
+            self.targets = torch.tensor(list(map(self._get_label, self.filelist)), dtype=torch.int64)
         
         print("{} total: {}".format(mode, len(self)))
 
@@ -102,6 +103,21 @@ class RecognizeDataset(Dataset):
         Returns:
             image:  {tensor(C, H, W)}
         """
+        image = RecognizeDataset.read_image(datapath, path, type, usedChannels, hist, dsize)
+        image = ToTensor()(image)
+        
+        # X = image[0].numpy(); cv2.imshow("", X); cv2.waitKey(0)   # for DEBUG
+
+        return image
+
+    @staticmethod
+    def read_image(datapath, path, type, 
+                usedChannels=None, hist=True, dsize=None):
+        """ the same as `load_image`, but returns the uint8 array
+
+        Returns:
+            image:  {ndarray(H, W, C)} uint8
+        """
         clahe = cv2.createCLAHE(clipLimit=5.0, tileGridSize=(8,8))
 
         if type == 'Multi':
@@ -142,11 +158,6 @@ class RecognizeDataset(Dataset):
                 elif usedChannels == 'B':
                     image = b[:, :, np.newaxis]
 
-        
-        image = ToTensor()(image)
-        
-        # X = image[0].numpy(); cv2.imshow("", X); cv2.waitKey(0)   # for DEBUG
-
         return image
 
     def _get_label(self, path):
@@ -172,7 +183,8 @@ class RecognizeDataset(Dataset):
         """
         image = label = None
         if self.load_in_memory:
-            image, label = self.samplelist[index]
+            image = self.images[index].float().div(255.)
+            label = int(self.targets[index])
 
         else:
             path = self.filelist[index]
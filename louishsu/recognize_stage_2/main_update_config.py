@@ -8,6 +8,7 @@
 @Update: 
 '''
 import os
+import sys
 import time
 import numpy as np
 from matplotlib import pyplot as plt 
@@ -28,6 +29,8 @@ from utils import accuracy, gen_markdown_table_2d, parse_log, ImageAttributes
 
 from train import train
 from test  import test
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../cyr/utils'))
+from job_scheduler import JobScheduler
 
 def get_configer(n_epoch=150, stepsize=120, batchsize=2**5, lrbase=5e-4, gamma=0.2, cuda=True, 
                 dsize=(112//2, 96//2), n_channel=25, n_class=80, 
@@ -35,7 +38,7 @@ def get_configer(n_epoch=150, stepsize=120, batchsize=2**5, lrbase=5e-4, gamma=0
                 splitratio=[0.6, 0.2, 0.2], splitcount=1, 
                 modelbase= 'recognize_resnet34', 
                 datapath = '/datasets/Indoordetect', savepath = 'checkpoints', 
-                hist=False, training_no_glass=False, training_no_sunglass=True):    # TODO: condition
+                hist=False, training_no_glass=False, training_no_sunglass=True, n_workers=0):    # TODO: condition
     """
     Params:
         n_epoch:        {int}                   总计迭代周期数
@@ -54,6 +57,7 @@ def get_configer(n_epoch=150, stepsize=120, batchsize=2**5, lrbase=5e-4, gamma=0
         modelbase:      {str}                   使用模型
         datapath:       {str}                   数据根目录
         savepath:       {str}                   程序输出目录
+        n_workers:      {int}                   预载数据集的进程数
     """
     configer = EasyDict()
 
@@ -74,6 +78,7 @@ def get_configer(n_epoch=150, stepsize=120, batchsize=2**5, lrbase=5e-4, gamma=0
     ## ------------------------- 数据集相关 -------------------------
     configer.datapath = datapath
     configer.dsize = dsize
+    configer.n_workers = n_workers
     configer.n_channel = n_channel          # 一份多光谱数据，包含25通道
     configer.n_class = n_class              # 人员数目共92人
 
@@ -102,7 +107,40 @@ def get_configer(n_epoch=150, stepsize=120, batchsize=2**5, lrbase=5e-4, gamma=0
 
     return configer
 
-def main_3_1(make_table_figure=False):
+def train_and_test(configer):
+    train(configer)
+    test(configer)
+
+def test_outputs(configer):
+    """ files written by `train` and `test`, a finished job is run again if one of them is removed """
+    return [os.path.join(configer.mdlspath, configer.modelname) + '.pkl',
+            os.path.join(configer.logspath, configer.modelname, 'test_log.txt')]
+
+def read_test_log(configer):
+    """
+    Returns:
+        acc, loss: {float} from `test_log.txt`
+    """
+    with open(os.path.join(configer.logspath, configer.modelname, 'test_log.txt'), 'r') as f:
+        return parse_log(f.readlines()[0])
+
+def run_sweep(name, configers, n_jobs=1, n_threads=None, devices=None):
+    """ `train` and `test` the configers with `n_jobs` processes
+    Params:
+        name:       {str} the queue state is saved in `./sweeps/<name>.json`, the logs of the jobs in `./sweeps/<name>.json.logs/`
+        configers:  {list[EasyDict]}
+        n_jobs:     {int} number of jobs at a time
+        n_threads:  {int} CPU threads of each job
+        devices:    {list[str]} CUDA_VISIBLE_DEVICES of each job slot
+    Notes:
+        - see `cyr/utils/job_scheduler.py`, the finished jobs are skipped, a killed sweep is resumed by running it again
+    """
+    scheduler = JobScheduler('./sweeps/{}.json'.format(name), test_outputs, n_jobs, n_threads, devices)
+    state = scheduler.run(configers, train_and_test)
+    failed = [key for key, job in state.items() if job['status'] != 'done']
+    assert len(failed) == 0, 'unfinished jobs: {}'.format(failed)
+
+def main_3_1(make_table_figure=False, n_jobs=1, n_threads=None, devices=None):
 
     datatypes   = ["Multi", "RGB"]
     splitcounts = [i for i in range(1, 11)]
@@ -147,12 +185,11 @@ def main_3_1(make_table_figure=False):
 
         return
 
-    start_time = time.time(); elapsed_time = 0
-
     for datatype in datatypes:
 
         data_acc  = np.zeros(shape=(H, W))
         data_loss = np.zeros(shape=(H, W))
+        jobs = []
 
         for i in range(H):                  # 1, 2, ..., 5
 
@@ -167,23 +204,12 @@ def main_3_1(make_table_figure=False):
                 configer = get_configer(datatype=datatype, splitratio=splitratio, splitcount=splitcount, 
                     usedChannels=[i+1 for i in range(25)] if datatype=="Multi" else "RGB")
 
-                elapsed_time += time.time() - start_time
-                start_time    = time.time()
-                print("Main 3.1 [{}] [{}]... Elaped >>> {} min".\
-                            format(configer.datatype, configer.splitmode, elapsed_time/60))
-
-                logpath = os.path.join(configer.logspath, configer.modelname)
-                print(logpath)
-                if os.path.exists(logpath):
-                    with open(os.path.join(logpath, 'test_log.txt'), 'r') as f:
-                        test_log = f.readlines()[0]
-                        data_acc[i, j], data_loss[i, j] = parse_log(test_log)
-                        print(test_log)
-                else:
-                    train(configer)
-                    data_acc[i, j], data_loss[i, j] = test(configer)
-                print("-------------------------------------------------")
+                jobs.append(((i, j), configer))
         
+        run_sweep('main_3_1_[{}]'.format(datatype), [configer for _, configer in jobs], n_jobs, n_threads, devices)
+        for index, configer in jobs:
+            data_acc[index], data_loss[index] = read_test_log(configer)
+
         ## 保存数据
         avg_acc  = np.mean(data_acc,  axis=0)
         avg_loss = np.mean(data_loss, axis=0)
@@ -194,7 +220,7 @@ def main_3_1(make_table_figure=False):
 
         np.savetxt("images/3_1_<data>_[{}].txt".format(datatype), table_data)
 
-def main_3_2(make_table_figure=False):
+def main_3_2(make_table_figure=False, n_jobs=1, n_threads=None, devices=None):
 
     datatypes   = ["Multi", "RGB"]
     splitcounts = [i for i in range(1, 11)]
@@ -247,8 +273,6 @@ def main_3_2(make_table_figure=False):
 
         return
 
-    start_time = time.time(); elapsed_time = 0
-
     for datatype in datatypes:
         
         usedChannels_list = [[i] for i in range(1, 26)] \
@@ -257,6 +281,7 @@ def main_3_2(make_table_figure=False):
 
         data_acc  = np.zeros(shape=(H, W))
         data_loss = np.zeros(shape=(H, W))
+        jobs = []
         
         for i in range(len(splitcounts)):
             splitcount = splitcounts[i]
@@ -267,23 +292,12 @@ def main_3_2(make_table_figure=False):
                 configer = get_configer(datatype=datatype, 
                             splitcount=splitcount, usedChannels=usedChannels)
 
-                elapsed_time += time.time() - start_time
-                start_time    = time.time()
-                print("Main 3.2 [{}] [{}] {}... Elaped >>> {} min".\
-                            format(configer.datatype, configer.splitmode, usedChannels, elapsed_time/60))
-
-                logpath = os.path.join(configer.logspath, configer.modelname)
-                print(logpath)
-                if os.path.exists(logpath):
-                    with open(os.path.join(logpath, 'test_log.txt'), 'r') as f:
-                        test_log = f.readlines()[0]
-                        data_acc[i, j], data_loss[i, j] = parse_log(test_log)
-                        print(test_log)
-                else:
-                    train(configer)
-                    data_acc[i, j], data_loss[i, j] = test(configer)
-                print("-------------------------------------------------")
+                jobs.append(((i, j), configer))
         
+        run_sweep('main_3_2_[{}]'.format(datatype), [configer for _, configer in jobs], n_jobs, n_threads, devices)
+        for index, configer in jobs:
+            data_acc[index], data_loss[index] = read_test_log(configer)
+
         ## 保存数据
         avg_acc  = np.mean(data_acc,  axis=0)
         avg_loss = np.mean(data_loss, axis=0)
@@ -294,7 +308,7 @@ def main_3_2(make_table_figure=False):
 
         np.savetxt("images/3_2_<data>_[{}].txt".format(datatype), table_data)
 
-def main_3_3(make_table_figure=False):
+def main_3_3(make_table_figure=False, n_jobs=1, n_threads=None, devices=None):
 
     ORDER = [
         23, 19, 24, 16,  7,
@@ -343,10 +357,9 @@ def main_3_3(make_table_figure=False):
 
         return
 
-    start_time = time.time(); elapsed_time = 0
-
     data_acc  = np.zeros(shape=(H, W))
     data_loss = np.zeros(shape=(H, W))
+    jobs = []
     
     for i in range(len(splitcounts)):
         splitcount = splitcounts[i]
@@ -355,24 +368,12 @@ def main_3_3(make_table_figure=False):
             usedChannels = usedChannels_list[j]
             
             configer = get_configer(splitcount=splitcount, usedChannels=usedChannels)
-
-            elapsed_time += time.time() - start_time
-            start_time    = time.time()
-            print("Main 3.3 [Multi] [{}] {}... Elaped >>> {} min".\
-                        format(configer.splitmode, usedChannels, elapsed_time/60))
-
-            logpath = os.path.join(configer.logspath, configer.modelname)
-            print(logpath)
-            if os.path.exists(logpath):
-                with open(os.path.join(logpath, 'test_log.txt'), 'r') as f:
-                    test_log = f.readlines()[0]
-                    data_acc[i, j], data_loss[i, j] = parse_log(test_log)
-                    print(test_log)
-            else:
-                train(configer)
-                data_acc[i, j], data_loss[i, j] = test(configer)
-            print("-------------------------------------------------")
+            jobs.append(((i, j), configer))
     
+    run_sweep('main_3_3', [configer for _, configer in jobs], n_jobs, n_threads, devices)
+    for index, configer in jobs:
+        data_acc[index], data_loss[index] = read_test_log(configer)
+
     ## 保存数据
     avg_acc  = np.mean(data_acc,  axis=0)
     avg_loss = np.mean(data_loss, axis=0)
@@ -383,7 +384,7 @@ def main_3_3(make_table_figure=False):
 
     np.savetxt("images/3_3_<data>_[Multi].txt", table_data)
 
-def main_3_4(make_table_figure=False):
+def main_3_4(make_table_figure=False, n_jobs=1, n_threads=None, devices=None):
 
     ORDER = [i+1 for i in range(25)]
     usedChannels_list = [ORDER[: : i+1] for i in range(len(ORDER))]
@@ -426,10 +427,9 @@ def main_3_4(make_table_figure=False):
 
         return
 
-    start_time = time.time(); elapsed_time = 0
-
     data_acc  = np.zeros(shape=(H, W))
     data_loss = np.zeros(shape=(H, W))
+    jobs = []
     
     for i in range(len(splitcounts)):
         splitcount = splitcounts[i]
@@ -438,24 +438,12 @@ def main_3_4(make_table_figure=False):
             usedChannels = usedChannels_list[j]
             
             configer = get_configer(splitcount=splitcount, usedChannels=usedChannels)
-
-            elapsed_time += time.time() - start_time
-            start_time    = time.time()
-            print("Main 3.4 [Multi] [{}] {}... Elaped >>> {} min".\
-                        format(configer.splitmode, usedChannels, elapsed_time/60))
-
-            logpath = os.path.join(configer.logspath, configer.modelname)
-            print(logpath)
-            if os.path.exists(logpath):
-                with open(os.path.join(logpath, 'test_log.txt'), 'r') as f:
-                    test_log = f.readlines()[0]
-                    data_acc[i, j], data_loss[i, j] = parse_log(test_log)
-                    print(test_log)
-            else:
-                train(configer)
-                data_acc[i, j], data_loss[i, j] = test(configer)
-            print("-------------------------------------------------")
+            jobs.append(((i, j), configer))
     
+    run_sweep('main_3_4', [configer for _, configer in jobs], n_jobs, n_threads, devices)
+    for index, configer in jobs:
+        data_acc[index], data_loss[index] = read_test_log(configer)
+
     ## 保存数据
     avg_acc  = np.mean(data_acc,  axis=0)
     avg_loss = np.mean(data_loss, axis=0)
@@ -466,7 +454,7 @@ def main_3_4(make_table_figure=False):
 
     np.savetxt("images/3_4_<data>_[Multi].txt", table_data)
 
-def main_3_5(make_table_figure=False):
+def main_3_5(make_table_figure=False, n_jobs=1, n_threads=None, devices=None):
 
     datatypes   = ["Multi", "RGB"]
     splitcounts = [i for i in range(1, 11)]
@@ -508,8 +496,8 @@ def main_3_5(make_table_figure=False):
 
                 ## 读取文件列表
                 testset = RecognizeDataset(configer.datapath, configer.datatype, 
-                        configer.splitmode, 'test', configer.usedChannels)
-                y_true = np.array(list(map(lambda x: x[1], testset.samplelist)))
+                        configer.splitmode, 'test', configer.usedChannels, load_in_memory=False)
+                y_true = np.array(list(map(testset._get_label, testset.filelist)))
                 test_list  = testset.filelist
                 test_attr_list = list(map(lambda  x: ImageAttributes(x), test_list))
                 del testset
@@ -635,8 +623,6 @@ def main_3_5(make_table_figure=False):
 
         return
 
-    start_time = time.time(); elapsed_time = 0
-
     for datatype in datatypes:
         
         usedChannels = [i for i in range(1, 26)] \
@@ -644,30 +630,19 @@ def main_3_5(make_table_figure=False):
 
         data_acc  = np.zeros(H)
         data_loss = np.zeros(H)
+        jobs = []
         
         for i in range(len(splitcounts)):
             splitcount = splitcounts[i]
 
             configer = get_configer(datatype=datatype, 
                         splitcount=splitcount, usedChannels=usedChannels)
-
-            elapsed_time += time.time() - start_time
-            start_time    = time.time()
-            print("Main 3.2 [{}] [{}] {}... Elaped >>> {} min".\
-                        format(configer.datatype, configer.splitmode, usedChannels, elapsed_time/60))
-
-            logpath = os.path.join(configer.logspath, configer.modelname)
-            print(logpath)
-            if os.path.exists(logpath):
-                with open(os.path.join(logpath, 'test_log.txt'), 'r') as f:
-                    test_log = f.readlines()[0]
-                    data_acc[i], data_loss[i] = parse_log(test_log)
-                    print(test_log)
-            else:
-                train(configer)
-                data_acc[i], data_loss[i] = test(configer)
-            print("-------------------------------------------------")
+            jobs.append(((i, ), configer))
         
+        run_sweep('main_3_5_[{}]'.format(datatype), [configer for _, configer in jobs], n_jobs, n_threads, devices)
+        for index, configer in jobs:
+            data_acc[index], data_loss[index] = read_test_log(configer)
+
         ## 保存数据
         avg_acc  = np.mean(data_acc,  axis=0)
         avg_loss = np.mean(data_loss, axis=0)
@@ -24,7 +24,8 @@ def test(configer):
 
     ## datasets
     testset = RecognizeDataset(configer.datapath, configer.datatype, 
-                    configer.splitmode, 'test', configer.usedChannels, dsize=configer.dsize, hist=configer.hist)
+                    configer.splitmode, 'test', configer.usedChannels, dsize=configer.dsize, hist=configer.hist, 
+                    n_workers=configer.get('n_workers', 0))
     testloader = DataLoader(testset, configer.batchsize, shuffle=False)
 
     ## model
@@ -38,7 +39,6 @@ def test(configer):
 
     ## log
     logpath = os.path.join(configer.logspath, configer.modelname)
-    ftest = open(os.path.join(logpath, 'test_log.txt'), 'w')
 
     ## initialize
     acc_test = []; loss_test = []
@@ -79,11 +79,15 @@ def test(configer):
     acc_test  = np.mean(np.array(acc_test))
     print_log = "{} || test | acc: {:2.2%}, loss: {:4.4f}".\
             format(getTime(), acc_test, loss_test)
-    print(print_log); ftest.write(print_log + '\n')
+    print(print_log)
     np.save(os.path.join(logpath, 'test_out.npy'), output)
 
     # print('==================================================================================================================')
-    ftest.close()
+    # the log is written last and atomically, the sweeps take a job with `test_log.txt` as done
+    tmpfile = os.path.join(logpath, 'test_log.txt.{}.tmp'.format(os.getpid()))
+    with open(tmpfile, 'w') as ftest:
+        ftest.write(print_log + '\n')
+    os.replace(tmpfile, os.path.join(logpath, 'test_log.txt'))
 
     return acc_test, loss_test
 
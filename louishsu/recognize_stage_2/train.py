@@ -10,6 +10,7 @@
 @Update: 
 '''
 import os
+import sys
 import time
 import numpy as np
 
@@ -25,6 +26,9 @@ from tensorboardX import SummaryWriter
 from datasets import RecognizeDataset
 from models import modeldict
 from utils import accuracy, getTime, is_with_no_glasses, is_with_no_sunglasses
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../cyr/utils'))
+from step_profiler import StepProfiler
+from prefetch_loader import make_loader, PrefetchLoader
 
 def train(configer):
     """
@@ -40,12 +44,21 @@ def train(configer):
     ## datasets
     trainset = RecognizeDataset(configer.datapath, configer.datatype, 
             configer.splitmode, 'train', configer.usedChannels, 
-            dsize=configer.dsize, hist=configer.hist, condition=condition)
+            dsize=configer.dsize, hist=configer.hist, condition=condition, 
+            n_workers=configer.get('n_workers', 0))
     validset = RecognizeDataset(configer.datapath, configer.datatype, 
             configer.splitmode, 'valid', configer.usedChannels, 
-            dsize=configer.dsize, hist=configer.hist, condition=condition)
-    trainloader = DataLoader(trainset, configer.batchsize, shuffle=True)
-    validloader = DataLoader(validset, configer.batchsize, shuffle=False)
+            dsize=configer.dsize, hist=configer.hist, condition=condition, 
+            n_workers=configer.get('n_workers', 0))
+    cuda = configer.cuda and is_available()
+    trainloader = make_loader(trainset, configer.batchsize, shuffle=True, 
+            num_workers=configer.get('loader_workers', 0), pin_memory=cuda, persistent_workers=True)
+    validloader = make_loader(validset, configer.batchsize, shuffle=False, 
+            num_workers=configer.get('loader_workers', 0), pin_memory=cuda, persistent_workers=True)
+    if configer.get('prefetch', 2) > 0:
+        # keep the next batches ready, already on the device, in a background thread
+        trainloader = PrefetchLoader(trainloader, configer.get('prefetch', 2), 'cuda' if cuda else None)
+        validloader = PrefetchLoader(validloader, configer.get('prefetch', 2), 'cuda' if cuda else None)
 
     ## model: pre-initialized
     modelpath = os.path.join(configer.mdlspath, configer.modelname) + '.pkl'
@@ -92,6 +105,7 @@ def train(configer):
     loss_train = float('inf')
     loss_valid = float('inf')
     loss_valid_last = float('inf')
+    profiler = StepProfiler(sync=configer.get('profile_sync', 0) if configer.cuda else 0)
 
 
     ## start training
@@ -105,22 +119,28 @@ def train(configer):
 
         model.train()
         start_time = time.time()
+        profiler.start()
         for i_batch, (X, y) in enumerate(trainloader):
             
             # get batch
             X = Variable(X.float()); y = Variable(y)
+            profiler.mark('data')
             if configer.cuda and is_available():
                 X = X.cuda(); y = y.cuda()
+            profiler.mark('h2d')
 
             # forward
             y_pred_prob = model(X)
             loss_i = loss(y_pred_prob, y)
             acc_i  = accuracy(y_pred_prob, y)
+            profiler.mark('forward')
 
             # backward
             optimizer.zero_grad()
             loss_i.backward() 
+            profiler.mark('backward')
             optimizer.step()
+            profiler.mark('optim')
 
             # time
             duration_time = time.time() - start_time
@@ -137,6 +157,7 @@ def train(configer):
 
             loss_train += [loss_i.detach().cpu().numpy()]
             acc_train  += [acc_i.cpu().numpy()]
+            profiler.step(X.shape[0])
         
         # print('------------------------------------------------------------------------------------------------------------------')
 
@@ -176,6 +197,9 @@ def train(configer):
         logger.add_scalars('accuracy', {'train': acc_train,  'valid': acc_valid},  i_epoch)
         logger.add_scalars('logloss',  {'train': loss_train, 'valid': loss_valid}, i_epoch)
         logger.add_scalar('lr', scheduler.get_lr()[-1], i_epoch)
+        profiler.log(logger, i_epoch)
+        if profiler.loader_bound():
+            print("{} || Epoch: [{:3d}]/[{:3d}] || {}".format(getTime(), i_epoch, configer.n_epoch, profiler.format()))
 
         # print('------------------------------------------------------------------------------------------------------------------')
 
@@ -8,10 +8,14 @@
 @Update: 
 '''
 import os
+import sys
 import time
 import torch
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../cyr/utils'))
+from preload import preload_images
+
 getTime     = lambda: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
 class ImageAttributes():
@@ -296,6 +300,7 @@ def parse_log(log):
     
     return acc, loss
 
+
 if __name__ == '__main__':
 
     # parse_log("2019-08-10 07:17:03 || test | acc: 96.25%, loss: 0.2208")
@@ -13,6 +13,8 @@ configer.batchsize = 32
 configer.stepsize = 250
 configer.gamma = 0.2
 configer.cuda = True
+configer.n_workers = 8                   # 预载数据集的进程数, 0为串行
+configer.profile_sync = 0                # 每隔多少步同步CUDA以统计各阶段耗时, 0为不同步
 
 
 configer.splitmode = 'split_{}x{}_1'.format(configer.dsize[0], configer.dsize[1])
@@ -2,17 +2,21 @@ import os
 import cv2
 import numpy as np
 
+import torch
 from torch.utils.data       import Dataset
 from torchvision.transforms import ToTensor
 
-from utiles import getWavelen, getLabel
+from utiles import getWavelen, getLabel, preload_images, preload_images_cached
+
+ALL_CHANNELS = [550+i*20 for i in range(23)]
 
 class RecognizeDataset(Dataset):
     """ 识别数据集
 
     Attributes:
         labels:     {list[int]} label of subjects
-        samplelist: {list[list[tensor(C, H, W), int]]}
+        images:     {tensor(N, C, H, W)} uint8, preloaded samples
+        targets:    {tensor(N)} int64, index of label
         
     Example:
         ```
@@ -31,13 +35,16 @@ class RecognizeDataset(Dataset):
     """
     labels = [i+1 for i in range(63)]
     
-    def __init__(self, datapath, type, splitmode, mode, usedChannels, hist=True):
+    def __init__(self, datapath, type, splitmode, mode, usedChannels, hist=True, n_workers=0, cachefile=None):
         """
         Params:
             datapath    {str} 'xxxx/ECUST2019_xxx'
             type:       {str} 'Multi', 'RGB'
             splitmode:  {str} 
             mode:       {str} 'train', 'valid', 'test'
+            n_workers:  {int} preload with a pool of `n_workers` processes if larger than 1
+            cachefile:  {str} keep the decoded samples in this `.npy` file, shared by the
+                            processes, see `preload_images_cached`
         """
         if type == 'Multi':
             txtfile = './split/{}/{}.txt'.format(splitmode, mode)
@@ -48,7 +55,32 @@ class RecognizeDataset(Dataset):
             filelist = f.readlines()
         
         filelist = [os.path.join('/'.join(datapath.split('/')[:-1]), filename.strip()) for filename in filelist]
-        self.samplelist = [[self._load_image(filename, type, usedChannels, hist), self.labels.index(getLabel(filename))] for filename in filelist]
+        self._preload(filelist, type, usedChannels, hist, n_workers, cachefile, [txtfile])
+
+    def _preload(self, filelist, type, usedChannels, hist=True, n_workers=0, cachefile=None, sources=()):
+        """
+        Params:
+            filelist:   {list[str]} absolute path of samples
+        """
+        self.type = type
+        self.usedChannels = usedChannels
+        if cachefile is None:
+            self.images = preload_images(self._read_image, filelist, 
+                                (type, usedChannels, hist), n_workers)
+        else:
+            self.images = preload_images_cached(cachefile, self._read_image, filelist, 
+                                (type, usedChannels, hist), n_workers, sources)
+        self.targets = torch.tensor([self.labels.index(getLabel(filename)) for filename in filelist], dtype=torch.int64)
+
+    def channel_view(self, usedChannels):
+        """ Select a subset of channels without reloading or copying the samples
+
+        Params:
+            usedChannels:   {list[int]} must be a subset of `self.usedChannels`
+        Returns:
+            view:   {RecognizeChannelView}
+        """
+        return RecognizeChannelView(self, usedChannels)
     
     @classmethod
     def _load_image(self, path, type, usedChannels, hist=True):
@@ -60,6 +92,25 @@ class RecognizeDataset(Dataset):
         Returns:
             image:  {tensor(C, H, W)}
         """
+        image = self._read_image(path, type, usedChannels, hist)
+        image = ToTensor()(image)
+        
+        # X = image[0].numpy()
+        # cv2.imshow("", X)
+        # cv2.waitKey(0)
+
+        return image
+
+    @classmethod
+    def _read_image(self, path, type, usedChannels, hist=True):
+        """
+        Params:
+            path:   {str} 
+            type:   {str} 'Multi', 'RGB'
+            usedChannels:   {list[int] / str}
+        Returns:
+            image:  {ndarray(H, W, C)} uint8
+        """
         clahe = cv2.createCLAHE(clipLimit=5.0, tileGridSize=(8,8))
 
         if type == 'Multi':
@@ -96,14 +147,29 @@ class RecognizeDataset(Dataset):
                 elif usedChannels == 'B':
                     image = b[:, :, np.newaxis]
 
-        
-        image = ToTensor()(image)
-        
-        # X = image[0].numpy()
-        # cv2.imshow("", X)
-        # cv2.waitKey(0)
-
         return image
+
+    @staticmethod
+    def _to_float(images):
+        """ the same scaling as `ToTensor()`
+        Params:
+            images: {tensor(..., C, H, W)} uint8
+        Returns:
+            images: {tensor(..., C, H, W)} float32, [0, 1]
+        """
+        return images.float().div_(255.)
+
+    def get_batch(self, index):
+        """
+        Params:
+            index:  {tensor(N)} int64, index of samples
+        Returns:
+            images: {tensor(N, C, H, W)}
+            labels: {tensor(N)}
+        """
+        images = self._to_float(self.images.index_select(0, index))
+        labels = self.targets.index_select(0, index)
+        return images, labels
     
     def __getitem__(self, index):
         """
@@ -114,7 +180,8 @@ class RecognizeDataset(Dataset):
             label:  {int}
         """
 
-        image, label = self.samplelist[index]
+        image = self._to_float(self.images[index])
+        label = int(self.targets[index])
         return image, label
 
     def __len__(self):
@@ -123,7 +190,130 @@ class RecognizeDataset(Dataset):
             length: {int} number of samples
         """
         
-        return len(self.samplelist)
+        return self.targets.shape[0]
+
+
+class RecognizeChannelView(Dataset):
+    """ Channel subset of a preloaded `RecognizeDataset`
+
+    The samples are shared with the parent dataset. Evenly spaced channels,
+    e.g. `ALL_CHANNELS[::k]` or a single channel, are a strided view of
+    `images`; other subsets are gathered per batch by `get_batch`.
+
+    Example:
+        ```
+        fullset = RecognizeDataset(datapath, 'Multi', splitmode, 'train', ALL_CHANNELS)
+        for usedChannels in usedChannelsList:
+            trainset = fullset.channel_view(usedChannels)
+            trainloader = BatchLoader(trainset, batch_size, shuffle=True)
+        ```
+    """
+    def __init__(self, dataset, usedChannels):
+        assert dataset.type == 'Multi', 'channel view is only for multispectral data! '
+        index = [dataset.usedChannels.index(ch) for ch in usedChannels]
+        self.dataset = dataset
+        self.usedChannels = list(usedChannels)
+        self.targets = dataset.targets
+
+        step = index[1] - index[0] if len(index) > 1 else 1
+        if step > 0 and index == list(range(index[0], index[-1] + 1, step)):
+            self.images = dataset.images[:, index[0]: index[-1] + 1: step]
+            self.channels = None
+        else:
+            self.images = dataset.images
+            self.channels = torch.tensor(index, dtype=torch.int64)
+
+    def get_batch(self, index):
+        """
+        Params:
+            index:  {tensor(N)} int64, index of samples
+        Returns:
+            images: {tensor(N, C, H, W)}
+            labels: {tensor(N)}
+        """
+        images = self.images.index_select(0, index)
+        if self.channels is not None:
+            images = images.index_select(1, self.channels)
+        images = RecognizeDataset._to_float(images)
+        labels = self.targets.index_select(0, index)
+        return images, labels
+
+    def __getitem__(self, index):
+        images, labels = self.get_batch(torch.tensor([index]))
+        return images[0], int(labels[0])
+
+    def __len__(self):
+        return self.targets.shape[0]
+
+
+_fullsets = dict()
+
+def get_cubefile(configer, mode):
+    """ the decoded split with all channels of `ALL_CHANNELS`, next to the split file """
+    dataname = os.path.basename(configer.datapath.rstrip('/'))
+    return './split/{}/{}_{}_cube.npy'.format(configer.splitmode, mode, dataname)
+
+def get_dataset(configer, mode):
+    """ Get the dataset of `configer`, decoding each split only once
+
+    For multispectral data the split is loaded with all channels in `ALL_CHANNELS`,
+    decoded once into `get_cubefile(configer, mode)` and memory-mapped by every
+    process, e.g. by the jobs of `run_sweep`; the experiments on subsets of channels
+    get a `RecognizeChannelView` of it. In a process, the splits of the latest
+    `splitmode` are kept.
+
+    Params:
+        configer:   {EasyDict}
+        mode:       {str} 'train', 'valid', 'test'
+    Returns:
+        dataset:    {RecognizeDataset or RecognizeChannelView}
+    """
+    n_workers = configer.get('n_workers', 0)
+    if configer.datatype != 'Multi' or \
+            not set(configer.usedChannels).issubset(ALL_CHANNELS):
+        return RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 
+                                    mode, configer.usedChannels, n_workers=n_workers)
+
+    key = (configer.datapath, configer.splitmode, mode)
+    if key not in _fullsets:
+        for k in list(_fullsets.keys()):
+            if k[:2] != key[:2]: _fullsets.pop(k)
+        _fullsets[key] = RecognizeDataset(configer.datapath, 'Multi', configer.splitmode, 
+                                    mode, ALL_CHANNELS, n_workers=n_workers, 
+                                    cachefile=get_cubefile(configer, mode))
+    return _fullsets[key].channel_view(configer.usedChannels)
+
+
+class BatchLoader(object):
+    """ Iterate over a preloaded `RecognizeDataset` in batches
+
+    A batch is assembled by a single index-select on `dataset.images`
+    instead of collating a list of samples as `DataLoader` does.
+
+    Example:
+        ```
+        trainloader = BatchLoader(trainset, batch_size, shuffle=True)
+        for i, (X, y) in enumerate(trainloader):
+            X = X.cuda(); y = y.cuda()
+        ```
+    """
+    def __init__(self, dataset, batch_size, shuffle=False, drop_last=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        n = len(self.dataset)
+        index = torch.randperm(n) if self.shuffle else torch.arange(n)
+        for i in range(len(self)):
+            yield self.dataset.get_batch(index[i*self.batch_size: (i+1)*self.batch_size])
+
+    def __len__(self):
+        n = len(self.dataset)
+        if self.drop_last:
+            return n // self.batch_size
+        return (n + self.batch_size - 1) // self.batch_size
 
 
 if __name__ == "__main__":
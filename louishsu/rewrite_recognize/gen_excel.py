@@ -76,6 +76,8 @@ def gen_out_excel(configer):
         for j in range(len(line)):
             sheet.write(i+1, j, line[j])
         
-    xls.save(os.path.join(log_modelname_dir, 'test.xls'))
+    tmpfile = os.path.join(log_modelname_dir, 'test.xls.{}.tmp'.format(os.getpid()))
+    xls.save(tmpfile)
+    os.replace(tmpfile, os.path.join(log_modelname_dir, 'test.xls'))
 
     
\ No newline at end of file
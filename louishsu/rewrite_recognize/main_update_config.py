@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import numpy as np
 from easydict import EasyDict
@@ -12,21 +13,57 @@ from torch.autograd import Variable
 from torch.utils.data import Dataset, DataLoader
 from tensorboardX import SummaryWriter
 
-from datasets import RecognizeDataset
+from datasets import RecognizeDataset, BatchLoader, get_dataset, ALL_CHANNELS
 from models import modeldict
-from utiles import accuracy, getTime, getLabel
+from utiles import accuracy, getTime, getLabel, Accumulator
 
 from train import train
 from test  import test
-
-def main_split():
+from gen_excel import gen_out_excel
+from supernet import supernet_configer, test_subset
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../cyr/utils'))
+from job_scheduler import JobScheduler
+
+def test_outputs(configer):
+    """ files written by `train` and `test`, a finished job is run again if one of them is removed """
+    return [os.path.join(configer.mdlspath, configer.modelname) + '.pkl',
+            os.path.join(configer.logspath, configer.modelname, 'test_log.txt')]
+
+def excel_outputs(configer):
+    return test_outputs(configer) + [os.path.join(configer.logspath, configer.modelname, 'test.xls')]
+
+def train_and_test(configer):
+    train(configer)
+    test(configer)
+
+def train_test_and_excel(configer):
+    train(configer)
+    test(configer)
+    gen_out_excel(configer)
+
+def run_sweep(name, configers, fn, outputs, n_jobs=1, n_threads=None, devices=None):
+    """
+    Params:
+        name:       {str} the queue state is saved in `./sweeps/<name>.json`, the logs of the jobs in `./sweeps/<name>.json.logs/`
+        configers:  {list[EasyDict]}
+        fn:         {callable} fn(configer), module-level
+        outputs:    {callable} outputs(configer) -> {list[str]}
+        n_jobs:     {int} number of jobs at a time, each in its own process
+        n_threads:  {int} CPU threads of each job
+        devices:    {list[str]} CUDA_VISIBLE_DEVICES of each job slot
+    Notes:
+        - see `cyr/utils/job_scheduler.py`, a killed sweep is resumed by running it again
+    """
+    scheduler = JobScheduler('./sweeps/{}.json'.format(name), outputs, n_jobs, n_threads, devices)
+    return scheduler.run(configers, fn)
+
+def main_split(n_jobs=1, n_threads=None, devices=None):
 
     ## 选出适当的划分比例
 
+    configers = []
     for splitidx in range(6, 36):
         for datatype in ['Multi', 'RGB']:
-             
-            print(getTime(), splitidx, datatype, '...')
 
             configer = EasyDict()
 
@@ -67,18 +104,19 @@ def main_split():
             configer.mdlspath = '/home/louishsu/Work/Workspace/HUAWEI/pytorch/modelfiles/{}_{}_{}subjects_models'.\
                                             format(configer.modelbase, configer.splitmode, configer.n_class)
 
-            train(configer)
-            test(configer)
-            gen_out_excel(configer)
+            configers.append(configer)
+
+    run_sweep('main_split', configers, train_test_and_excel, excel_outputs, n_jobs, n_threads, devices)
 
 # =================================================================================================================================
 
-def main_best_channels():
+def main_best_channels(n_jobs=1, n_threads=None, devices=None):
 
     # 波段选择依据
     # 以最佳的划分方式: 
     # 依次选择每个波段进行实验
 
+    configers = []
     for splitidx in range(46, 51):
         for datatype in ['Multi', 'RGB']:
 
@@ -90,8 +128,6 @@ def main_best_channels():
                 usedChannelsList = ['RGB',]
 
             for usedChannels in usedChannelsList:
-                
-                print(getTime(), splitidx, datatype, usedChannels, '...')
 
                 configer = EasyDict()
 
@@ -132,12 +168,13 @@ def main_best_channels():
                 configer.mdlspath = '/home/louishsu/Work/Workspace/HUAWEI/pytorch/modelfiles/{}_{}_{}subjects_models'.\
                                                 format(configer.modelbase, configer.splitmode, configer.n_class)
 
-                train(configer)
-                test(configer)
+                configers.append(configer)
+
+    run_sweep('main_best_channels', configers, train_and_test, test_outputs, n_jobs, n_threads, devices)
         
 # =================================================================================================================================
 
-def main_several_channels():
+def main_several_channels(n_jobs=1, n_threads=None, devices=None):
 
     # 波段选择依据
     # 最优的波段排序: 
@@ -145,12 +182,11 @@ def main_several_channels():
     # 依次选择多个波段组合进行实, 组合的意思是[[850], [850, 870], [850, 870, 930], ..., [850, ..., 550]]
     CHANNEL_SORT = [850, 870, 930, 730, 790, 910, 770, 750, 670, 950, 990, 830, 890, 810, 970, 690, 710, 650, 590, 570, 630, 610, 550]
     
+    configers = []
     for splitidx in range(46, 51):
         usedChannelsList = [CHANNEL_SORT[:i+1] for i in range(23)]
 
         for usedChannels in usedChannelsList:
-            
-            print(getTime(), splitidx, len(usedChannels), '...')
 
             configer = EasyDict()
 
@@ -191,8 +227,71 @@ def main_several_channels():
             configer.mdlspath = '/home/louishsu/Work/Workspace/HUAWEI/pytorch/modelfiles/{}_{}_{}subjects_models'.\
                                             format(configer.modelbase, configer.splitmode, configer.n_class)
 
-            train(configer)
-            test(configer)
+            configers.append(configer)
+
+    run_sweep('main_several_channels', configers, train_and_test, test_outputs, n_jobs, n_threads, devices)
+
+def supernet_outputs(configer):
+    return [os.path.join(configer.mdlspath, configer.modelname) + '.pkl']
+
+def main_several_channels_supernet(n_finetune=0, n_jobs=1, n_threads=None, devices=None):
+
+    # 同`main_several_channels`, 每种划分只训练一个全波段的超网络(随机遮挡波段),
+    # 各波段组合遮挡测试集输入后测试, 可选微调`n_finetune`轮, 见`supernet.py`
+    CHANNEL_SORT = [850, 870, 930, 730, 790, 910, 770, 750, 670, 950, 990, 830, 890, 810, 970, 690, 710, 650, 590, 570, 630, 610, 550]
+
+    configers = []
+    for splitidx in range(46, 51):
+        usedChannelsList = [CHANNEL_SORT[:i+1] for i in range(23)]
+
+        for usedChannels in usedChannelsList:
+
+            configer = EasyDict()
+
+            configer.dsize = (64, 64)
+            configer.datatype = 'Multi'
+            configer.n_epoch   = 300
+            configer.lrbase = 0.001
+            configer.n_finetune = n_finetune
+
+            configer.n_channel = 23
+            configer.n_class = 63
+            configer.batchsize = 32
+            configer.stepsize = 250
+            configer.gamma = 0.2
+            configer.cuda = True
+
+
+            configer.splitmode = 'split_{}x{}_{}'.format(configer.dsize[0], configer.dsize[1], splitidx)
+            configer.modelbase = 'recognize_vgg11_bn'
+
+
+            configer.usedChannels = usedChannels
+            configer.n_usedChannels = len(configer.usedChannels)
+            configer.modelname = '{}_{}_{}_supernet{}'.\
+                            format(configer.modelbase, configer.splitmode, 
+                                    '_'.join(list(map(str, configer.usedChannels))), 
+                                    '_finetune{}'.format(n_finetune) if n_finetune > 0 else '')
+
+
+            configer.datapath = '/datasets/ECUST2019_{}x{}'.\
+                                            format(configer.dsize[0], configer.dsize[1])
+            configer.logspath = '/home/louishsu/Work/Workspace/HUAWEI/pytorch/logs/{}_{}_{}subjects_logs'.\
+                                            format(configer.modelbase, configer.splitmode, configer.n_class)
+            configer.mdlspath = '/home/louishsu/Work/Workspace/HUAWEI/pytorch/modelfiles/{}_{}_{}subjects_models'.\
+                                            format(configer.modelbase, configer.splitmode, configer.n_class)
+
+            configers.append(configer)
+
+    ## 每种划分训练一次超网络
+    supernets = {configer.splitmode: supernet_configer(configer) for configer in configers}
+    run_sweep('main_several_channels_supernet', list(supernets.values()), train, supernet_outputs, n_jobs, n_threads, devices)
+
+    ## 测试各波段组合, 同一划分的数据集只载入一次
+    for configer in configers:
+        if all([os.path.exists(path) for path in test_outputs(configer)[1:]]): continue
+        print(getTime(), configer.modelname)
+        test_subset(configer)
 
 def main_several_channels_k_fold(k=5):
 
@@ -203,19 +302,16 @@ def main_several_channels_k_fold(k=5):
     # 每组波段下进行5折交叉验证
     # 读取`split_64x64_1`中的`train/valid/test.txt`,按顺序划分为k折
 
-    class KFoldDataset(Dataset):
+    class KFoldDataset(RecognizeDataset):
         def __init__(self, datapath, filelist, usedChannels):
             filelist = list(map(lambda x: os.path.join('/'.join(datapath.split('/')[:-1]), x.strip()), filelist))
-            self.samplelist = list(map(lambda x: [RecognizeDataset._load_image(x, 'Multi', usedChannels), getLabel(x)-1], filelist))
-        def __getitem__(self, index):
-            image, label = self.samplelist[index]
-            return image, label
-        def __len__(self):
-            return len(self.samplelist)        
+            self._preload(filelist, 'Multi', usedChannels)
 
 
     CHANNEL_SORT = [850, 870, 930, 730, 790, 910, 770, 750, 670, 950, 990, 830, 890, 810, 970, 690, 710, 650, 590, 570, 630, 610, 550]
     usedChannelsList = [CHANNEL_SORT[:i+1] for i in range(23)]
+    dsize = (64, 64)
+    datapath = '/home/louishsu/Work/Workspace/ECUST2019_{}x{}'.format(dsize[0], dsize[1])
 
     ## 读取所有文件
     filelist = []
@@ -236,13 +332,17 @@ def main_several_channels_k_fold(k=5):
         validlist = foldlist[i]
         trainlist = list(filter(lambda x: x not in validlist, filelist))
 
+        ## 载入全部波段, 各波段组合共用
+        trainset_full = KFoldDataset(datapath, trainlist, ALL_CHANNELS)
+        validset_full = KFoldDataset(datapath, validlist, ALL_CHANNELS)
+
         for i_usedChannels in range(len(usedChannelsList)):
             usedChannels = usedChannelsList[i_usedChannels]
             
             print(getTime(), '[', i, '/', k, ']', len(usedChannels), '...')
 
             configer = EasyDict()
-            configer.dsize = (64, 64)
+            configer.dsize = dsize
             configer.datatype = 'Multi'
             configer.n_epoch   = 300
             configer.lrbase = 0.001
@@ -259,18 +359,17 @@ def main_several_channels_k_fold(k=5):
             configer.modelname = '{}_{}_{}_[{}_{}]fold'.\
                             format(configer.modelbase, configer.splitmode, 
                                     '_'.join(list(map(str, configer.usedChannels))), i+1, k)
-            configer.datapath = '/home/louishsu/Work/Workspace/ECUST2019_{}x{}'.\
-                                            format(configer.dsize[0], configer.dsize[1])
+            configer.datapath = datapath
             configer.logspath = '/home/louishsu/Work/Workspace/HUAWEI/pytorch/logs/{}_{}_{}subjects_logs'.\
                                             format(configer.modelbase, configer.splitmode, configer.n_class)
             configer.mdlspath = '/home/louishsu/Work/Workspace/HUAWEI/pytorch/modelfiles/{}_{}_{}subjects_models'.\
                                             format(configer.modelbase, configer.splitmode, configer.n_class)
 
             ## datasets
-            trainset = KFoldDataset(configer.datapath, trainlist, usedChannels)
-            validset = KFoldDataset(configer.datapath, validlist,  usedChannels)
-            trainloader = DataLoader(trainset, configer.batchsize, shuffle=True)
-            validloader = DataLoader(validset, configer.batchsize, shuffle=False)
+            trainset = trainset_full.channel_view(usedChannels)
+            validset = validset_full.channel_view(usedChannels)
+            trainloader = BatchLoader(trainset, configer.batchsize, shuffle=True)
+            validloader = BatchLoader(validset, configer.batchsize, shuffle=False)
 
             ## model
             modelpath = os.path.join(configer.mdlspath, configer.modelname) + '.pkl'
@@ -335,7 +434,7 @@ def main_several_channels_k_fold(k=5):
             model.eval()
             loss_test = []
             acc_test  = []
-            output = None
+            output = Accumulator(len(validloader.dataset))
             for i_batch, (X, y) in enumerate(validloader):
                 # get batch
                 X = Variable(X.float()); y = Variable(y)
@@ -350,10 +449,7 @@ def main_several_channels_k_fold(k=5):
                 acc_test  += [acc_i.cpu().numpy()]
 
                 # save output
-                if output is None:
-                    output = y_pred_prob.detach().cpu().numpy()
-                else:
-                    output = np.concatenate([output, y_pred_prob.detach().cpu().numpy()], axis=0)
+                output.append(y_pred_prob.detach().cpu().numpy())
 
             # print('------------------------------------------------------------------------------------------------------------------')
 
@@ -364,7 +460,7 @@ def main_several_channels_k_fold(k=5):
             print(print_log)
             with open(os.path.join(logpath, 'test_log.txt'), 'w') as  f:
                 f.write(print_log + '\n')
-            np.save(os.path.join(logpath, 'test_out.npy'), output)
+            np.save(os.path.join(logpath, 'test_out.npy'), output.get())
 
 def main_finetune_channels():
 
@@ -418,10 +514,10 @@ def main_finetune_channels():
 
 
             ## datasets
-            trainset = RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 'train', configer.usedChannels)
-            validset = RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 'valid', configer.usedChannels)
-            trainloader = DataLoader(trainset, configer.batchsize, shuffle=True)
-            validloader = DataLoader(validset, configer.batchsize, shuffle=False)
+            trainset = get_dataset(configer, 'train')
+            validset = get_dataset(configer, 'valid')
+            trainloader = BatchLoader(trainset, configer.batchsize, shuffle=True)
+            validloader = BatchLoader(validset, configer.batchsize, shuffle=False)
 
 
             ## ============================================================================================
@@ -574,8 +670,8 @@ def main_pca():
 
         trainset = RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 'train', configer.usedChannels)
         validset = RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 'valid', configer.usedChannels)
-        trainloader = DataLoader(trainset, configer.batchsize, shuffle=True)
-        validloader = DataLoader(validset, configer.batchsize, shuffle=False)
+        trainloader = BatchLoader(trainset, configer.batchsize, shuffle=True)
+        validloader = BatchLoader(validset, configer.batchsize, shuffle=False)
 
         for chs in range(10, 24):
 
@@ -583,7 +679,7 @@ def main_pca():
             
             ## fit pca
             decomposer = NDarrayPCA(n_components=[chs, 64, 64])
-            traindata = np.concatenate([trainset.samplelist[i][0].numpy()[np.newaxis] for i in range(len(trainset.samplelist))], axis=0)
+            traindata = RecognizeDataset._to_float(trainset.images).numpy()
             decomposer.fit(traindata)
             del traindata
 
@@ -679,10 +775,10 @@ def main_pca():
             ## start testing
             model.eval()
             testset = RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 'test', configer.usedChannels)
-            testloader = DataLoader(testset, configer.batchsize, shuffle=False)
+            testloader = BatchLoader(testset, configer.batchsize, shuffle=False)
             loss_test = []
             acc_test  = []
-            output = None
+            output = Accumulator(len(testset))
             for i_batch, (X, y) in enumerate(testloader):
 
                 X = torch.from_numpy(decomposer.transform(X.numpy()))
@@ -700,10 +796,7 @@ def main_pca():
                 acc_test  += [acc_i.cpu().numpy()]
 
                 # save output
-                if output is None:
-                    output = y_pred_prob.detach().cpu().numpy()
-                else:
-                    output = np.concatenate([output, y_pred_prob.detach().cpu().numpy()], axis=0)
+                output.append(y_pred_prob.detach().cpu().numpy())
 
             # print('------------------------------------------------------------------------------------------------------------------')
 
@@ -714,23 +807,22 @@ def main_pca():
             print(print_log)
             with open(os.path.join(logpath, 'test_log.txt'), 'w') as  f:
                 f.write(print_log + '\n')
-            np.save(os.path.join(logpath, 'test_out.npy'), output)
+            np.save(os.path.join(logpath, 'test_out.npy'), output.get())
 
 # =================================================================================================================================
 
-def main_spectral_resolution():
+def main_spectral_resolution(n_jobs=1, n_threads=None, devices=None):
 
     # 光谱分辨率验证
     # 依次以1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, ..., 23 为间隔选取
     # 划分比例为 0.6: 0.2: 0.2
     CHANNEL_SORT = [550 + 20*i for i in range(23)]
     
+    configers = []
     for splitidx in range(1, 6):
         usedChannelsList = [CHANNEL_SORT[::i+1] for i in range(22)]
 
         for usedChannels in usedChannelsList:
-            
-            print(getTime(), splitidx, len(usedChannels), '...')
 
             configer = EasyDict()
 
@@ -771,8 +863,9 @@ def main_spectral_resolution():
             configer.mdlspath = '/home/louishsu/Work/Workspace/HUAWEI/pytorch/modelfiles/{}_{}_{}subjects_models'.\
                                             format(configer.modelbase, configer.splitmode, configer.n_class)
 
-            train(configer)
-            test(configer)
+            configers.append(configer)
+
+    run_sweep('main_spectral_resolution', configers, train_and_test, test_outputs, n_jobs, n_threads, devices)
 
 if __name__ == "__main__":
 
@@ -784,5 +877,7 @@ if __name__ == "__main__":
     # main_best_channels()        
     # main_several_channels()
     # main_several_channels_k_fold()
+    # main_several_channels(n_jobs=4, n_threads=4)
+    # main_several_channels_supernet(n_finetune=5)
 
     main_spectral_resolution()
\ No newline at end of file
@@ -0,0 +1,225 @@
+"""
+Weight-sharing supernet for the band selection experiments
+
+Instead of training a model from scratch for every `usedChannels`, one model of
+`modeldict` is trained on all bands of `ALL_CHANNELS` with a random subset of the
+bands of each sample kept (`configer.supernet = True` in `train`); the other bands
+are set to zero and the kept ones scaled by `n_channel / n_kept`, as dropout does.
+A subset is then evaluated by masking the inputs of the test set the same way,
+after re-estimating the statistics of the batch norm layers on the masked training
+set, or after a short fine-tune with the subset (`configer.n_finetune` epochs).
+
+Example:
+    ```
+    configer.supernet = True
+    train(supernet_configer(configer))              # once per split
+    for usedChannels in usedChannelsList:           # each subset, in seconds
+        configer.usedChannels = usedChannels
+        test_subset(configer)
+    ```
+"""
+import os
+import copy
+import numpy as np
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.cuda import is_available
+from torch.autograd import Variable
+
+from datasets import BatchLoader, get_dataset, ALL_CHANNELS
+from utiles import accuracy, getTime, Accumulator
+
+def supernet_configer(configer):
+    """ The configer of the supernet shared by the subsets of `configer.splitmode`
+
+    Params:
+        configer:   {EasyDict} configer of a subset
+    Returns:
+        configer:   {EasyDict} a copy, with all channels of `ALL_CHANNELS`
+    """
+    configer = copy.deepcopy(configer)
+    configer.supernet = True
+    configer.usedChannels = ALL_CHANNELS
+    configer.n_usedChannels = len(ALL_CHANNELS)
+    configer.modelname = '{}_{}_supernet'.format(configer.modelbase, configer.splitmode)
+    return configer
+
+def band_mask(usedChannels, channels=ALL_CHANNELS):
+    """
+    Params:
+        usedChannels:   {list[int]} subset of `channels`
+        channels:       {list[int]} channels of the input
+    Returns:
+        mask:           {tensor(C)} float, 1 for the used channels
+    """
+    return torch.tensor([float(ch in usedChannels) for ch in channels])
+
+def random_band_masks(n, n_channel, min_bands=1, p_full=0.25, generator=None):
+    """ The number of kept bands is uniform in [`min_bands`, `n_channel`], and is
+    `n_channel` with the extra probability `p_full`, so the full input is seen often
+
+    Params:
+        n:          {int} number of samples
+        n_channel:  {int}
+    Returns:
+        masks:      {tensor(n, C)} float
+    """
+    k = torch.randint(min_bands, n_channel + 1, (n, 1), generator=generator)
+    k[torch.rand(n, 1, generator=generator) < p_full] = n_channel
+    rank = torch.rand(n, n_channel, generator=generator).argsort(1).argsort(1)
+    return (rank < k).float()
+
+def mask_bands(X, mask):
+    """
+    Params:
+        X:      {tensor(N, C, H, W)}
+        mask:   {tensor(C)} or {tensor(N, C)}
+    Returns:
+        X:      {tensor(N, C, H, W)} the masked bands are zero, the others scaled by C / n_kept
+    """
+    scale = mask * (mask.shape[-1] / mask.sum(-1, keepdim=True).clamp(min=1))
+    return X * scale.to(X.device)[..., None, None]
+
+def recalibrate_bn(model, loader, mask, n_batches=50, cuda=True):
+    """ Re-estimate the running statistics of the batch norm layers with the masked inputs
+
+    Params:
+        model:      {nn.Module}
+        loader:     {BatchLoader} of the training set
+        mask:       {tensor(C)}
+        n_batches:  {int}
+    """
+    bns = [m for m in model.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm)]
+    if len(bns) == 0: return
+    momentum = [bn.momentum for bn in bns]
+    for bn in bns:
+        bn.reset_running_stats()
+        bn.momentum = None                  # cumulative average
+
+    model.train()
+    with torch.no_grad():
+        for i_batch, (X, y) in enumerate(loader):
+            if i_batch == n_batches: break
+            X = mask_bands(X.float(), mask)
+            if cuda and is_available(): X = X.cuda()
+            model(X)
+
+    for bn, m in zip(bns, momentum):
+        bn.momentum = m
+
+def finetune(model, configer, mask):
+    """ Fine-tune the supernet with a fixed subset for `configer.n_finetune` epochs,
+    the state of the least validation loss is kept
+
+    Params:
+        model:      {nn.Module}
+        configer:   {EasyDict}
+        mask:       {tensor(C)}
+    Returns:
+        model:      {nn.Module}
+    """
+    trainloader = BatchLoader(get_dataset(supernet_configer(configer), 'train'), configer.batchsize, shuffle=True)
+    validloader = BatchLoader(get_dataset(supernet_configer(configer), 'valid'), configer.batchsize, shuffle=False)
+
+    loss = nn.CrossEntropyLoss()
+    optimizer = optim.Adam(model.parameters(), configer.get('lr_finetune', configer.lrbase * 0.1), weight_decay=1e-3)
+
+    loss_valid_last = float('inf'); best_state = copy.deepcopy(model.state_dict())
+    for i_epoch in range(configer.n_finetune):
+
+        model.train()
+        for i_batch, (X, y) in enumerate(trainloader):
+            X = mask_bands(X.float(), mask)
+            if configer.cuda and is_available():
+                X = X.cuda(); y = y.cuda()
+            loss_i = loss(model(X), y)
+            optimizer.zero_grad()
+            loss_i.backward()
+            optimizer.step()
+
+        model.eval()
+        loss_valid = []
+        with torch.no_grad():
+            for i_batch, (X, y) in enumerate(validloader):
+                X = mask_bands(X.float(), mask)
+                if configer.cuda and is_available():
+                    X = X.cuda(); y = y.cuda()
+                loss_valid += [loss(model(X), y).cpu().numpy()]
+        loss_valid = np.mean(np.array(loss_valid))
+
+        if loss_valid_last > loss_valid:
+            loss_valid_last = loss_valid
+            best_state = copy.deepcopy(model.state_dict())
+
+    model.load_state_dict(best_state)
+    return model
+
+def test_subset(configer):
+    """ Test the subset `configer.usedChannels` on the supernet of `configer.splitmode`,
+    the outputs are the same as those of `test`, in `<logspath>/<modelname>/`
+
+    Params:
+        configer:   {EasyDict}
+            - n_finetune:   {int} epochs of fine-tuning, 0 to only re-estimate the batch norm statistics
+            - n_recalibrate:{int} number of training batches to re-estimate the batch norm statistics
+    """
+    super_configer = supernet_configer(configer)
+    mask = band_mask(configer.usedChannels)
+
+    ## datasets
+    trainloader = BatchLoader(get_dataset(super_configer, 'train'), configer.batchsize, shuffle=True)
+    testset = get_dataset(super_configer, 'test')
+    testloader = BatchLoader(testset, configer.batchsize, shuffle=False)
+
+    ## model
+    modelpath = os.path.join(super_configer.mdlspath, super_configer.modelname) + '.pkl'
+    assert os.path.exists(modelpath), 'please train the supernet first! '
+    model = torch.load(modelpath, map_location='cpu')
+    if configer.cuda and is_available(): model.cuda()
+
+    if configer.get('n_finetune', 0) > 0:
+        model = finetune(model, configer, mask)
+        torch.save(model, os.path.join(configer.mdlspath, configer.modelname) + '.pkl')
+    else:
+        recalibrate_bn(model, trainloader, mask, configer.get('n_recalibrate', 50), configer.cuda)
+
+    ## loss
+    loss = nn.CrossEntropyLoss()
+
+    ## log
+    logpath = os.path.join(configer.logspath, configer.modelname)
+    if not os.path.exists(logpath): os.makedirs(logpath)
+
+    ## initialize
+    acc_test = []; loss_test = []
+    output = Accumulator(len(testset))
+
+    ## start testing
+    model.eval()
+    with torch.no_grad():
+        for i_batch, (X, y) in enumerate(testloader):
+
+            # get batch
+            X = mask_bands(X.float(), mask)
+            if configer.cuda and is_available():
+                X = X.cuda(); y = y.cuda()
+
+            # forward
+            y_pred_prob = model(X)
+            loss_test += [loss(y_pred_prob, y).cpu().numpy()]
+            acc_test  += [accuracy(y_pred_prob, y).cpu().numpy()]
+
+            # save output
+            output.append(y_pred_prob.cpu().numpy())
+
+    loss_test = np.mean(np.array(loss_test))
+    acc_test  = np.mean(np.array(acc_test))
+    print_log = "{} || test | acc: {:2.2%}, loss: {:4.4f}".\
+            format(getTime(), acc_test, loss_test)
+    print(print_log)
+    np.save(os.path.join(logpath, 'test_out.npy'), output.get())
+    # the log is written last, `main_several_channels_supernet` skips the subsets which have it
+    with open(os.path.join(logpath, 'test_log.txt'), 'w') as ftest:
+        ftest.write(print_log + '\n')
@@ -7,14 +7,14 @@ from torch.cuda import is_available
 from torch.autograd import Variable
 from torch.utils.data import DataLoader
 
-from datasets import RecognizeDataset
-from utiles import accuracy, getTime
+from datasets import RecognizeDataset, BatchLoader, get_dataset
+from utiles import accuracy, getTime, Accumulator
 
 def test(configer):
 
     ## datasets
-    testset = RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 'test', configer.usedChannels)
-    testloader = DataLoader(testset, configer.batchsize, shuffle=False)
+    testset = get_dataset(configer, 'test')
+    testloader = BatchLoader(testset, configer.batchsize, shuffle=False)
 
     ## model
     modelpath = os.path.join(configer.mdlspath, configer.modelname) + '.pkl'
@@ -27,11 +27,10 @@ def test(configer):
 
     ## log
     logpath = os.path.join(configer.logspath, configer.modelname)
-    ftest = open(os.path.join(logpath, 'test_log.txt'), 'w')
 
     ## initialize
     acc_test = []; loss_test = []
-    output = None
+    output = Accumulator(len(testset))
 
     ## start testing
     model.eval()
@@ -56,10 +55,7 @@ def test(configer):
         acc_test  += [acc_i.cpu().numpy()]
 
         # save output
-        if output is None:
-            output = y_pred_prob.detach().cpu().numpy()
-        else:
-            output = np.concatenate([output, y_pred_prob.detach().cpu().numpy()], axis=0)
+        output.append(y_pred_prob.detach().cpu().numpy())
 
     # print('------------------------------------------------------------------------------------------------------------------')
 
@@ -67,11 +63,15 @@ def test(configer):
     acc_test  = np.mean(np.array(acc_test))
     print_log = "{} || test | acc: {:2.2%}, loss: {:4.4f}".\
             format(getTime(), acc_test, loss_test)
-    print(print_log); ftest.write(print_log + '\n')
-    np.save(os.path.join(logpath, 'test_out.npy'), output)
+    print(print_log)
+    np.save(os.path.join(logpath, 'test_out.npy'), output.get())
 
     # print('==================================================================================================================')
-    ftest.close()
+    # the log is written last and atomically, the sweeps take a job with `test_log.txt` as done
+    tmpfile = os.path.join(logpath, 'test_log.txt.{}.tmp'.format(os.getpid()))
+    with open(tmpfile, 'w') as ftest:
+        ftest.write(print_log + '\n')
+    os.replace(tmpfile, os.path.join(logpath, 'test_log.txt'))
 
 
 def test_samples():
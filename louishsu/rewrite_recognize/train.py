@@ -11,21 +11,28 @@ from torch.autograd import Variable
 from torch.utils.data import DataLoader
 from tensorboardX import SummaryWriter
 
-from datasets import RecognizeDataset
+from datasets import RecognizeDataset, BatchLoader, get_dataset
 from models import modeldict
-from utiles import accuracy, getTime
+from utiles import accuracy, getTime, StepProfiler, PrefetchLoader
+from supernet import random_band_masks, mask_bands
 
 def train(configer):
     """
     Update:
         2019.04.24: 固定权值
+        `configer.supernet`: train on random subsets of the bands, see `supernet.py`
     """
 
     ## datasets
-    trainset = RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 'train', configer.usedChannels)
-    validset = RecognizeDataset(configer.datapath, configer.datatype, configer.splitmode, 'valid', configer.usedChannels)
-    trainloader = DataLoader(trainset, configer.batchsize, shuffle=True)
-    validloader = DataLoader(validset, configer.batchsize, shuffle=False)
+    trainset = get_dataset(configer, 'train')
+    validset = get_dataset(configer, 'valid')
+    trainloader = BatchLoader(trainset, configer.batchsize, shuffle=True)
+    validloader = BatchLoader(validset, configer.batchsize, shuffle=False)
+    if configer.get('prefetch', 2) > 0:
+        # assemble and copy the next batches in a background thread
+        device = 'cuda' if configer.cuda and is_available() else None
+        trainloader = PrefetchLoader(trainloader, configer.get('prefetch', 2), device)
+        validloader = PrefetchLoader(validloader, configer.get('prefetch', 2), device)
 
     ## model: pre-initialized
     modelpath = os.path.join(configer.mdlspath, configer.modelname) + '.pkl'
@@ -71,6 +78,8 @@ def train(configer):
     loss_train = float('inf')
     loss_valid = float('inf')
     loss_valid_last = float('inf')
+    profiler = StepProfiler(sync=configer.get('profile_sync', 0) if configer.cuda else 0)
+    supernet = configer.get('supernet', False)
 
 
     ## start training
@@ -84,22 +93,30 @@ def train(configer):
 
         model.train()
         start_time = time.time()
+        profiler.start()
         for i_batch, (X, y) in enumerate(trainloader):
             
             # get batch
             X = Variable(X.float()); y = Variable(y)
+            if supernet:
+                X = mask_bands(X, random_band_masks(X.shape[0], X.shape[1], configer.get('min_bands', 1)))
+            profiler.mark('data')
             if configer.cuda and is_available():
                 X = X.cuda(); y = y.cuda()
+            profiler.mark('h2d')
 
             # forward
             y_pred_prob = model(X)
             loss_i = loss(y_pred_prob, y)
             acc_i  = accuracy(y_pred_prob, y)
+            profiler.mark('forward')
 
             # backward
             optimizer.zero_grad()
             loss_i.backward() 
+            profiler.mark('backward')
             optimizer.step()
+            profiler.mark('optim')
 
             # time
             duration_time = time.time() - start_time
@@ -116,15 +133,19 @@ def train(configer):
 
             loss_train += [loss_i.detach().cpu().numpy()]
             acc_train  += [acc_i.cpu().numpy()]
+            profiler.step(X.shape[0])
         
         # print('------------------------------------------------------------------------------------------------------------------')
 
 
         model.eval()
+        generator = torch.Generator().manual_seed(0)     # the same subsets every epoch
         for i_batch, (X, y) in enumerate(validloader):
             
             # get batch
             X = Variable(X.float()); y = Variable(y)
+            if supernet:
+                X = mask_bands(X, random_band_masks(X.shape[0], X.shape[1], configer.get('min_bands', 1), generator=generator))
             if configer.cuda and is_available():
                 X = X.cuda(); y = y.cuda()
 
@@ -155,6 +176,9 @@ def train(configer):
         logger.add_scalars('accuracy', {'train': acc_train,  'valid': acc_valid},  i_epoch)
         logger.add_scalars('logloss',  {'train': loss_train, 'valid': loss_valid}, i_epoch)
         logger.add_scalar('lr', scheduler.get_lr()[-1], i_epoch)
+        profiler.log(logger, i_epoch)
+        if profiler.loader_bound():
+            print("{} || Epoch: [{:3d}]/[{:3d}] || {}".format(getTime(), i_epoch, configer.n_epoch, profiler.format()))
 
         # print('------------------------------------------------------------------------------------------------------------------')
 
@@ -1,20 +1,24 @@
 import os
+import sys
 import time
 import torch
 import numpy as np
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../datasets/HyperECUST'))
+from detect_index import getDicts as getDetectIndex
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../cyr/utils'))
+from accumulator import Accumulator
+from step_profiler import StepProfiler
+from prefetch_loader import PrefetchLoader
+from preload import preload_images, preload_images_cached
+
 getTime     = lambda: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 getVol      = lambda subidx: (subidx - 1) // 10 + 1
 getWavelen  = lambda path: int(path.split('.')[0].split('_')[-1])
 getLabel    = lambda path: int(path[path.find('DATA') + len('DATAx/'):].split('/')[0])
 
 def getDicts(datapath):
-    dicts = dict()
-    for vol in ["DATA%d" % _ for _ in range(1, 8)]:
-        txtfile = os.path.join(datapath, vol, "detect.txt")
-        with open(txtfile, 'r') as f:
-            dicts[vol] = eval(f.read())
-    return dicts
+    return getDetectIndex(datapath, range(1, 8))
 
 accuracy = lambda x1, x2: np.mean(x1==x2)
 
@@ -28,4 +32,5 @@ def accuracy(y_pred_prob, y_true):
     """
     y_pred = torch.argmax(y_pred_prob, 1)
     acc = torch.mean((y_pred==y_true).float())
-    return acc
\ No newline at end of file
+    return acc
+
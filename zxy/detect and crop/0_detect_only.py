@@ -31,6 +31,7 @@ import os
 import tensorflow as tf
 import numpy as np
 from toolkit import detect_face
+from toolkit import detect_files
 import cv2
 import glob
 
@@ -177,7 +178,26 @@ def detect_Multi(indoors=True):
     print('Total number of images: %d' % nrof_images_total)
     print('Number of successfully aligned images: %d' % nrof_successfully_aligned)
 
+def detect_RGB_farm(indoors=True, n_workers=4, n_threads=1):
+    """ `detect_RGB` with `n_workers` processes, resumed from `rgbdetect_only.txt` after a crash """
+
+    failedface_filename = rootdir + '/failedrgb.txt'
+    path_save = os.path.join(rootdir, "rgbdetect_only.txt")
+    dict_save, paths = detect_files.detect_rgb_farm(rootdir, indoors, path_save, n_workers, n_threads)
+    detect_files.write_failed(dict_save, paths, failedface_filename)
+
+def detect_Multi_farm(indoors=True, n_workers=4, n_threads=1):
+    """ `detect_Multi` with `n_workers` processes, resumed from `multidetect_only.txt` after a crash,
+    only the failed directories are listed """
+
+    failedface_filrdir = rootdir + '/failemultdir.txt'
+    path_save = os.path.join(rootdir, "multidetect_only.txt")
+    dict_save, paths = detect_files.detect_multi_farm(rootdir, indoors, path_save, n_workers, n_threads)
+    detect_files.write_failed(dict_save, paths, failedface_filrdir)
+
 if __name__ == '__main__':
     rootdir = 'E:/Desktop/Outdoor20190810'
     detect_RGB(indoors=False)
-    detect_Multi(indoors=False)
\ No newline at end of file
+    detect_Multi(indoors=False)
+    # detect_RGB_farm(indoors=False, n_workers=4, n_threads=2)
+    # detect_Multi_farm(indoors=False, n_workers=4, n_threads=2)
\ No newline at end of file
@@ -31,6 +31,8 @@ import os
 import tensorflow as tf
 import numpy as np
 from toolkit import detect_face
+from toolkit import detect_files
+from toolkit import bulk_detect
 import cv2
 import glob
 
@@ -282,7 +284,48 @@ def detect_Multi(indoors=True):
     print('Total number of images: %d' % nrof_images_total)
     print('Number of successfully aligned images: %d' % nrof_successfully_aligned)
 
+def detect_RGB_farm(indoors=True, n_workers=4, n_threads=1):
+    """ `detect_RGB` with `n_workers` processes, resumed from `rgbdetect.txt` after a crash """
+
+    failedface_filename = rootdir + '/failedrgb.txt'
+    path_save = os.path.join(rootdir, "rgbdetect.txt")
+    dict_save, paths = detect_files.detect_rgb_farm(rootdir, indoors, path_save, n_workers, n_threads)
+    detect_files.write_failed(dict_save, paths, failedface_filename)
+
+def detect_Multi_farm(indoors=True, n_workers=4, n_threads=1):
+    """ `detect_Multi` with `n_workers` processes, resumed from `multidetect.txt` after a crash,
+    only the failed directories are listed """
+
+    failedface_filrdir = rootdir + '/failemultdir.txt'
+    path_save = os.path.join(rootdir, "multidetect.txt")
+    dict_save, paths = detect_files.detect_multi_farm(rootdir, indoors, path_save, n_workers, n_threads)
+    detect_files.write_failed(dict_save, paths, failedface_filrdir)
+
+def detect_RGB_bulk(indoors=True, batch_size=16, read_ahead=2):
+    """ `detect_RGB` with `bulk_detect_face` on batches of images of the same size,
+    resumed from `rgbdetect.txt` after a crash """
+
+    failedface_filename = rootdir + '/failedrgb.txt'
+    path_save = os.path.join(rootdir, "rgbdetect.txt")
+    nets = detect_files.init_mtcnn()
+    dict_save, paths = bulk_detect.detect_rgb_bulk(nets, rootdir, indoors, path_save, batch_size, read_ahead)
+    detect_files.write_failed(dict_save, paths, failedface_filename)
+
+def detect_Multi_bulk(indoors=True, batch_size=64, read_ahead=2):
+    """ `detect_Multi` with `bulk_detect_face` on batches of directories of the same size,
+    resumed from `multidetect.txt` after a crash, only the failed directories are listed """
+
+    failedface_filrdir = rootdir + '/failemultdir.txt'
+    path_save = os.path.join(rootdir, "multidetect.txt")
+    nets = detect_files.init_mtcnn()
+    dict_save, paths = bulk_detect.detect_multi_bulk(nets, rootdir, indoors, path_save, batch_size, read_ahead)
+    detect_files.write_failed(dict_save, paths, failedface_filrdir)
+
 if __name__ == '__main__':
     rootdir = 'E:/Desktop/Outdoor20190810'
     detect_RGB(indoors=False)
-    detect_Multi(indoors=False)
\ No newline at end of file
+    detect_Multi(indoors=False)
+    # detect_RGB_farm(indoors=False, n_workers=4, n_threads=2)
+    # detect_Multi_farm(indoors=False, n_workers=4, n_threads=2)
+    # detect_RGB_bulk(indoors=False, batch_size=16)
+    # detect_Multi_bulk(indoors=False, batch_size=64)
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""Bulk detection with `detect_face.bulk_detect_face`, for `1_detect_and_savetxt.py`.
+
+The RGB and the multispectral cameras produce images of a few fixed sizes, so
+the files are grouped by size (read from the headers, without decoding) and fed
+to `bulk_detect_face` in batches of the same size, in which the images share
+their pyramid: P-Net runs once per scale for the whole batch, R-Net and O-Net
+once per batch. A reader thread decodes the next `read_ahead` batches while the
+current one is detected. Each result is appended to the journal `<outfile>.part`
+as soon as its batch is done, as `detect_farm.py` does, so an interrupted run is
+resumed from the journal.
+"""
+
+import os
+import sys
+import queue
+import threading
+from PIL import Image
+from toolkit import detect_face
+from toolkit import detect_files
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '../../../louishsu/detect_images/models/mtcnn'))
+from detect_farm import load_results, save_results
+
+def image_size(image_path):
+    """ (w, h) from the header of the image, None if it is not an image """
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except (IOError, ValueError):
+        return None
+
+def make_batches(tasks, batch_size=16):
+    """
+    Params:
+        tasks:      {list[tuple(key, list[image_path])]} images of one task are of the same size,
+                        e.g. one RGB image, or the bands of one multispectral directory
+        batch_size: {int} maximum number of images of a batch, a task is never split
+    Returns:
+        batches:    {list[list[tuple(key, list[image_path])]]} tasks of the same size
+    """
+    groups = dict()
+    for key, image_paths in tasks:
+        size = image_size(image_paths[0]) if len(image_paths) > 0 else None
+        groups.setdefault(size, []).append((key, image_paths))
+
+    batches = []
+    for size, group in groups.items():
+        batch, n_images = [], 0
+        for key, image_paths in group:
+            if n_images > 0 and n_images + len(image_paths) > batch_size:
+                batches.append(batch)
+                batch, n_images = [], 0
+            batch.append((key, image_paths))
+            n_images += len(image_paths)
+        if len(batch) > 0:
+            batches.append(batch)
+    return batches
+
+class _End(object):
+    def __init__(self, error=None):
+        self.error = error
+
+def _read_batches(batches, out):
+    """ reader thread, puts (batch, images) into the bounded queue `out`, then an `_End`
+    holding the exception that stopped it, if any """
+    end = _End()
+    try:
+        for batch in batches:
+            images = []
+            for key, image_paths in batch:
+                task_images = []
+                for image_path in image_paths:
+                    try:
+                        img = detect_files.read_image(image_path)
+                    except (IOError, ValueError, IndexError) as e:
+                        print('{}: {}'.format(image_path, e))
+                        continue
+                    if img is not None:
+                        task_images.append(img)
+                images.append(task_images)
+            out.put((batch, images))
+    except Exception as e:
+        end = _End(e)
+    out.put(end)
+
+def bulk_detect(nets, tasks, outfile, batch_size=16, read_ahead=2, resume=True, verbose=True):
+    """
+    Params:
+        nets:       {tuple} (pnet, rnet, onet) from `detect_files.init_mtcnn`
+        tasks:      {list[tuple(key, list[image_path])]} see `make_batches`
+        outfile:    {str} output file in the format of `rgbdetect.txt`
+        batch_size: {int} maximum number of images of a batch
+        read_ahead: {int} number of decoded batches waiting for detection
+        resume:     {bool} skip the keys in the journal or in `outfile`, detect all the `tasks` again if False
+    Returns:
+        results:    {dict} {key: (score, bbox, landmark)} in the order of `tasks`, the result
+                        of a task is that of its last image with a face, as `detect_multi_dir`;
+                        tasks without any readable image are left undone
+    Notes:
+        an exception of the reader thread is raised here, after the finished results are saved
+    """
+    pnet, rnet, onet = nets
+    keys = [key for key, _ in tasks]
+    journal = outfile + '.part'
+    if not resume and os.path.exists(journal):
+        os.remove(journal)
+    done = load_results(outfile)
+    if not resume:
+        retry = set(keys)
+        done = {key: value for key, value in done.items() if key not in retry}
+    todo = [(key, image_paths) for key, image_paths in tasks if key not in done]
+    batches = make_batches(todo, batch_size)
+    if verbose:
+        print('{}: {} done, {} to detect in {} batches'.format(
+                    outfile, len(tasks) - len(todo), len(todo), len(batches)))
+
+    loaded = queue.Queue(maxsize=read_ahead)
+    reader = threading.Thread(target=_read_batches, args=(batches, loaded), daemon=True)
+    reader.start()
+
+    n_finished = 0; error = None
+    with open(journal, 'a') as f:
+        while True:
+            item = loaded.get()
+            if isinstance(item, _End):
+                error = item.error
+                break
+            batch, images = item
+            flat = [img for task_images in images for img in task_images]
+            if len(flat) > 0:
+                # all the images of the batch are of the same size, so is `minsize` of `detect_face`
+                ratio = (detect_files.minsize + 0.5) / min(flat[0].shape[0], flat[0].shape[1])
+                rets = detect_face.bulk_detect_face(flat, ratio, pnet, rnet, onet,
+                                            detect_files.threshold, detect_files.factor)
+            i = 0
+            for (key, image_paths), task_images in zip(batch, images):
+                if len(task_images) == 0:
+                    print('Unable to align "%s"' % key)
+                    continue
+                result = None, None, None
+                for img in task_images:
+                    if rets[i] is not None:
+                        result = detect_files.select_face(rets[i][0], rets[i][1], img.shape)
+                    i += 1
+                done[key] = result
+                f.write(repr((key, result)) + '\n')
+            f.flush()
+            n_finished += len(batch)
+            if verbose:
+                print('{}/{}'.format(n_finished, len(todo)))
+    reader.join()
+
+    save_results(outfile, done, keys)
+    results = {key: done[key] for key, _ in tasks if key in done}
+    if error is not None:
+        raise error
+    return results
+
+def detect_rgb_bulk(nets, rootdir, indoors, outfile, batch_size=16, read_ahead=2, resume=True):
+    """
+    Returns:
+        results:    {dict} {key: (score, bbox, landmark)}, key as in `rgbdetect.txt`
+        paths:      {dict} {key: image_path}
+    """
+    paths = {path[len(rootdir):].split('.')[0]: path for path in detect_files.list_rgb_files(rootdir, indoors)}
+    tasks = [(key, [path]) for key, path in paths.items()]
+    results = bulk_detect(nets, tasks, outfile, batch_size, read_ahead, resume)
+    return results, paths
+
+def detect_multi_bulk(nets, rootdir, indoors, outfile, batch_size=64, read_ahead=2, resume=True):
+    """
+    Returns:
+        results:    {dict} {key: (score, bbox, landmark)}, key as in `multidetect.txt`
+        paths:      {dict} {key: imgdir}
+    """
+    paths = {path[len(rootdir):].split('.')[0]: path for path in detect_files.list_multi_dirs(rootdir, indoors)}
+    tasks = [(key, [os.path.join(imgdir, imgpath).replace('\\','/') for imgpath in os.listdir(imgdir)]) \
+                                                                    for key, imgdir in paths.items()]
+    results = bulk_detect(nets, tasks, outfile, batch_size, read_ahead, resume)
+    return results, paths
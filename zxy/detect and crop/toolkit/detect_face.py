@@ -33,6 +33,12 @@ import tensorflow as tf
 #from math import floor
 import cv2
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '../../../louishsu/detect_images/models/mtcnn'))
+from box_utils import crop_resize_area
+from nms import nms as greedy_nms
+from profiler import NULL_PROFILER
 
 def layer(op):
     """Decorator for composable network layers."""
@@ -314,14 +320,23 @@ def create_mtcnn(sess, model_path):
     return pnet_fun, rnet_fun, onet_fun
 
 # 检测人脸，返回人脸框和五个关键点的坐标
-def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
+def detect_face(img, minsize, pnet, rnet, onet, threshold, factor, profiler=None):
     """Detects faces in an image, and returns bounding boxes and points for them.
     img: input image
     minsize: minimum faces' size
     pnet, rnet, onet: caffemodel
     threshold: threshold=[th1, th2, th3], th1-3 are three steps's threshold
     factor: the factor used to create a scaling pyramid of face sizes to detect in the image.
+    profiler: StageProfiler of louishsu/detect_images/models/mtcnn/profiler.py, records the
+        time and the number of candidates of each stage
     """
+    prof = NULL_PROFILER if profiler is None else profiler
+    prof.begin(shape=img.shape[:2])
+    total_boxes, points = _detect_face(img, minsize, pnet, rnet, onet, threshold, factor, prof)
+    prof.end(n_faces=total_boxes.shape[0])
+    return total_boxes, points
+
+def _detect_face(img, minsize, pnet, rnet, onet, threshold, factor, prof):
     factor_count=0
     total_boxes=np.empty((0,9))
     points=np.empty(0)
@@ -347,9 +362,10 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
         hs=int(np.ceil(h*scale))
         ws=int(np.ceil(w*scale))
         #使用opencv的方法对图片进行缩放
-        im_data = imresample(img, (hs, ws))
-        #对图片数据进行归一化处理
-        im_data = (im_data-127.5)*0.0078125
+        with prof.timer('resize', scale=scale):
+            im_data = imresample(img, (hs, ws))
+            #对图片数据进行归一化处理
+            im_data = (im_data-127.5)*0.0078125
         #增加一个维度，即batch size，因为我们这里每次只处理一张图片，其实batch size就是1
         img_x = np.expand_dims(im_data, 0)
         img_y = np.transpose(img_x, (0,2,1,3))
@@ -360,7 +376,8 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
         # 70是这么来的，(150-3+1)/1=148，经过池化层后为148/2=74，
         # 再经过一个卷积层(74-3+1)/1=72，再经过一个卷积层(72-3+1)/1=70
         # prob1层的输出形状为(1, 70, 70, 2)
-        out = pnet(img_y)
+        with prof.timer('pnet', scale=scale, size=(hs, ws)) as event:
+            out = pnet(img_y)
         # 又变回来
         # out0的形状是(1, 70, 70, 4)
         # 返回的是可能是人脸的框的坐标
@@ -374,9 +391,12 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
         #scales:图片缩减比例
         #threshold:阈值，这里取0.6
         boxes, _ = generateBoundingBox(out1[0,:,:,1].copy(), out0[0,:,:,:].copy(), scale, threshold[0])
+        event['n_boxes'] = boxes.shape[0]
         
         # inter-scale nms
-        pick = nms(boxes.copy(), 0.5, 'Union')
+        with prof.timer('nms', n_boxes=boxes.shape[0]):
+            pick = nms(boxes.copy(), 0.5, 'Union')
+        prof.count('pnet_nms_scale', pick.size if boxes.size>0 else 0)
         if boxes.size>0 and pick.size>0:
             boxes = boxes[pick,:]
             total_boxes = np.append(total_boxes, boxes, axis=0)
@@ -384,8 +404,10 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
     numbox = total_boxes.shape[0]
     if numbox>0:
         # 再经过nms筛选掉一些可靠度更低的人脸框
-        pick = nms(total_boxes.copy(), 0.7, 'Union')
+        with prof.timer('nms', n_boxes=numbox):
+            pick = nms(total_boxes.copy(), 0.7, 'Union')
         total_boxes = total_boxes[pick,:]
+        prof.count('pnet_nms', pick.size)
         #使用框回归校准bb  框回归：框左上角的横坐标的相对偏移，框左上角的纵坐标的相对偏移、框的宽度的误差、框的高度的误差。
         #获取每个人脸框的宽高
         regw = total_boxes[:,2]-total_boxes[:,0]
@@ -406,27 +428,24 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
     numbox = total_boxes.shape[0]
     if numbox>0:
         # second stage
-        tempimg = np.zeros((24,24,3,numbox))
-        for k in range(0,numbox):
-            tmp = np.zeros((int(tmph[k]),int(tmpw[k]),3))
-            tmp[dy[k]-1:edy[k],dx[k]-1:edx[k],:] = img[y[k]-1:ey[k],x[k]-1:ex[k],:]
-            if tmp.shape[0]>0 and tmp.shape[1]>0 or tmp.shape[0]==0 and tmp.shape[1]==0:
-                tempimg[:,:,:,k] = imresample(tmp, (24, 24))
-            else:
-                return np.empty()
-        tempimg = (tempimg-127.5)*0.0078125
+        with prof.timer('crop', size=24, n_boxes=numbox):
+            tempimg = crop_resize_area(img, y-dy, x-dx, tmph, tmpw, 24)
+            tempimg = (tempimg-127.5)*0.0078125
         #转置[n,24,24,3]
-        tempimg1 = np.transpose(tempimg, (3,1,0,2))
-        out = rnet(tempimg1)
+        tempimg1 = np.transpose(tempimg, (0,2,1,3))
+        with prof.timer('rnet', batch=numbox):
+            out = rnet(tempimg1)
         out0 = np.transpose(out[0])
         out1 = np.transpose(out[1])
         score = out1[1,:]
         ipass = np.where(score>threshold[1])
+        prof.count('rnet_pass', ipass[0].size)
         total_boxes = np.hstack([total_boxes[ipass[0],0:4].copy(), np.expand_dims(score[ipass].copy(),1)])
         mv = out0[:,ipass[0]]
         if total_boxes.shape[0]>0:
             pick = nms(total_boxes, 0.7, 'Union')
             total_boxes = total_boxes[pick,:]
+            prof.count('rnet_nms', pick.size)
             total_boxes = bbreg(total_boxes.copy(), np.transpose(mv[:,pick]))
             total_boxes = rerec(total_boxes.copy())
 
@@ -437,17 +456,12 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
         # third stage
         total_boxes = np.fix(total_boxes).astype(np.int32)
         dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph = pad(total_boxes.copy(), w, h)
-        tempimg = np.zeros((48,48,3,numbox))
-        for k in range(0,numbox):
-            tmp = np.zeros((int(tmph[k]),int(tmpw[k]),3))
-            tmp[dy[k]-1:edy[k],dx[k]-1:edx[k],:] = img[y[k]-1:ey[k],x[k]-1:ex[k],:]
-            if tmp.shape[0]>0 and tmp.shape[1]>0 or tmp.shape[0]==0 and tmp.shape[1]==0:
-                tempimg[:,:,:,k] = imresample(tmp, (48, 48))
-            else:
-                return np.empty()
-        tempimg = (tempimg-127.5)*0.0078125
-        tempimg1 = np.transpose(tempimg, (3,1,0,2))
-        out = onet(tempimg1)
+        with prof.timer('crop', size=48, n_boxes=numbox):
+            tempimg = crop_resize_area(img, y-dy, x-dx, tmph, tmpw, 48)
+            tempimg = (tempimg-127.5)*0.0078125
+        tempimg1 = np.transpose(tempimg, (0,2,1,3))
+        with prof.timer('onet', batch=numbox):
+            out = onet(tempimg1)
         #关键点
         out0 = np.transpose(out[0])
         #框回归
@@ -457,6 +471,7 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
         score = out2[1,:]
         points = out1
         ipass = np.where(score>threshold[2])
+        prof.count('onet_pass', ipass[0].size)
         points = points[:,ipass[0]]
         #[n,5]
         total_boxes = np.hstack([total_boxes[ipass[0],0:4].copy(), np.expand_dims(score[ipass].copy(),1)])
@@ -472,6 +487,7 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
             pick = nms(total_boxes.copy(), 0.7, 'Min')
             total_boxes = total_boxes[pick,:]
             points = points[:,pick]
+            prof.count('onet_nms', pick.size)
 
     #返回bb：[n,5] x1,y1,x2,y2,score  和关键点[n,10]         
     return total_boxes, points
@@ -572,19 +588,11 @@ def bulk_detect_face(images, detection_window_size_ratio, pnet, rnet, onet, thre
             dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph = pad(image_obj['total_boxes'].copy(), w, h)
 
             numbox = image_obj['total_boxes'].shape[0]
-            tempimg = np.zeros((24, 24, 3, numbox))
 
             if numbox > 0:
-                for k in range(0, numbox):
-                    tmp = np.zeros((int(tmph[k]), int(tmpw[k]), 3))
-                    tmp[dy[k] - 1:edy[k], dx[k] - 1:edx[k], :] = images[index][y[k] - 1:ey[k], x[k] - 1:ex[k], :]
-                    if tmp.shape[0] > 0 and tmp.shape[1] > 0 or tmp.shape[0] == 0 and tmp.shape[1] == 0:
-                        tempimg[:, :, :, k] = imresample(tmp, (24, 24))
-                    else:
-                        return np.empty()
-
+                tempimg = crop_resize_area(images[index], y - dy, x - dx, tmph, tmpw, 24)
                 tempimg = (tempimg - 127.5) * 0.0078125
-                image_obj['rnet_input'] = np.transpose(tempimg, (3, 1, 0, 2))
+                image_obj['rnet_input'] = np.transpose(tempimg, (0, 2, 1, 3))
 
     # # # # # # # # # # # # #
     # second stage - refinement of face candidates with rnet
@@ -595,6 +603,8 @@ def bulk_detect_face(images, detection_window_size_ratio, pnet, rnet, onet, thre
         if 'rnet_input' in image_obj:
             bulk_rnet_input = np.append(bulk_rnet_input, image_obj['rnet_input'], axis=0)
 
+    if bulk_rnet_input.shape[0] == 0:
+        return [None] * len(images)
     out = rnet(bulk_rnet_input)
     out0 = np.transpose(out[0])
     out1 = np.transpose(out[1])
@@ -626,19 +636,12 @@ def bulk_detect_face(images, detection_window_size_ratio, pnet, rnet, onet, thre
             numbox = image_obj['total_boxes'].shape[0]
 
             if numbox > 0:
-                tempimg = np.zeros((48, 48, 3, numbox))
                 image_obj['total_boxes'] = np.fix(image_obj['total_boxes']).astype(np.int32)
                 dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph = pad(image_obj['total_boxes'].copy(), w, h)
 
-                for k in range(0, numbox):
-                    tmp = np.zeros((int(tmph[k]), int(tmpw[k]), 3))
-                    tmp[dy[k] - 1:edy[k], dx[k] - 1:edx[k], :] = images[index][y[k] - 1:ey[k], x[k] - 1:ex[k], :]
-                    if tmp.shape[0] > 0 and tmp.shape[1] > 0 or tmp.shape[0] == 0 and tmp.shape[1] == 0:
-                        tempimg[:, :, :, k] = imresample(tmp, (48, 48))
-                    else:
-                        return np.empty()
+                tempimg = crop_resize_area(images[index], y - dy, x - dx, tmph, tmpw, 48)
                 tempimg = (tempimg - 127.5) * 0.0078125
-                image_obj['onet_input'] = np.transpose(tempimg, (3, 1, 0, 2))
+                image_obj['onet_input'] = np.transpose(tempimg, (0, 2, 1, 3))
 
         i += rnet_input_count
 
@@ -651,6 +654,8 @@ def bulk_detect_face(images, detection_window_size_ratio, pnet, rnet, onet, thre
         if 'onet_input' in image_obj:
             bulk_onet_input = np.append(bulk_onet_input, image_obj['onet_input'], axis=0)
 
+    if bulk_onet_input.shape[0] == 0:
+        return [None] * len(images)
     out = onet(bulk_onet_input)
 
     out0 = np.transpose(out[0])
@@ -755,37 +760,10 @@ def generateBoundingBox(imap, reg, scale, t):
 # 得到boxes后，再传入nms函数，nms函数的作用是非极大值抑制，只挑出最有可能是人脸框的框
 # function pick = nms(boxes,threshold,type)
 def nms(boxes, threshold, method):
+    """ greedy NMS, `method` is 'Union' or 'Min', see louishsu/detect_images/models/mtcnn/nms.py """
     if boxes.size==0:
         return np.empty((0,3))
-    x1 = boxes[:,0]
-    y1 = boxes[:,1]
-    x2 = boxes[:,2]
-    y2 = boxes[:,3]
-    s = boxes[:,4]
-    area = (x2-x1+1) * (y2-y1+1)
-    #排序，从小到大，返回的是坐标
-    I = np.argsort(s)
-    pick = np.zeros_like(s, dtype=np.int16)
-    counter = 0
-    while I.size>0:
-        i = I[-1]
-        pick[counter] = i
-        counter += 1
-        idx = I[0:-1]
-        xx1 = np.maximum(x1[i], x1[idx])
-        yy1 = np.maximum(y1[i], y1[idx])
-        xx2 = np.minimum(x2[i], x2[idx])
-        yy2 = np.minimum(y2[i], y2[idx])
-        w = np.maximum(0.0, xx2-xx1+1)
-        h = np.maximum(0.0, yy2-yy1+1)
-        inter = w * h
-        if method is 'Min':
-            o = inter / np.minimum(area[i], area[idx])
-        else:
-            o = inter / (area[i] + area[idx] - inter)
-        I = I[np.where(o<=threshold)]
-    pick = pick[0:counter]
-    return pick
+    return greedy_nms(boxes, threshold, method)
 
 # function [dy edy dx edx y ey x ex tmpw tmph] = pad(total_boxes,w,h)
 def pad(total_boxes, w, h):
@@ -0,0 +1,190 @@
+"""Detection of one RGB image or one multispectral directory, shared by
+`0_detect_only.py` and `1_detect_and_savetxt.py` for the multi-process runner
+`louishsu/detect_images/models/mtcnn/detect_farm.py`."""
+
+import os
+import sys
+import glob
+from functools import partial
+import numpy as np
+import tensorflow as tf
+from scipy import misc
+from toolkit import detect_face
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '../../../louishsu/detect_images/models/mtcnn'))
+from detect_farm import run_farm
+
+minsize = 20 # minimum size of face
+threshold = [ 0.6, 0.7, 0.7 ]  # three steps's threshold
+factor = 0.709 # scale factor
+
+def list_rgb_files(rootdir, indoors=True):
+    # 如果数据图片的目录格式发生了改变，此处读取数据的程序需要做相应改变
+    if indoors == True:
+        # indoors
+        rgb_paths_1_6 = glob.glob(os.path.join(rootdir, '*/rgb/*/*[1,6]/*'), recursive=True)
+        rgb_paths_5 = glob.glob(os.path.join(rootdir, '*/rgb/*/*jpg'), recursive=True)
+        rgbfiles = rgb_paths_1_6 + rgb_paths_5
+    else:
+        # outdoor
+        rgb_paths_1= glob.glob(os.path.join(rootdir, '*/rgb/*1/*'), recursive=True)
+        rgb_paths_6 = glob.glob(os.path.join(rootdir, '*/rgb/*jpg'), recursive=True)
+        rgbfiles = rgb_paths_1 + rgb_paths_6
+    # to transform the \\ in windows to / in unix
+    return [path.replace('\\','/') for path in rgbfiles]
+
+def list_multi_dirs(rootdir, indoors=True):
+    # 如果数据图片的目录格式发生了改变，此处读取数据的程序需要做相应改变
+    if indoors == True:
+        # indoors
+        multi_paths_1_6 = glob.glob(os.path.join(rootdir, '*/multi/*/*[1,6]/*'), recursive=True)
+        multi_paths_5 = glob.glob(os.path.join(rootdir, '*/multi/*/*5'), recursive=True)
+        multidirs = multi_paths_1_6 + multi_paths_5
+    else:
+        # outdoor
+        multi_paths_1 = glob.glob(os.path.join(rootdir, '*/multi/*1/*'), recursive=True)
+        multi_paths_6 = glob.glob(os.path.join(rootdir, '*/multi/*6'), recursive=True)
+        multidirs = multi_paths_1 + multi_paths_6
+    # to transform the \\ in windows to / in unix
+    return [path.replace('\\','/') for path in multidirs]
+
+def init_mtcnn(n_threads=None, backend='tf'):
+    """ one session per process, `n_threads` pins its intra-op threads,
+    `backend='torch'` runs the same weights with `torch_mtcnn.py` without a session """
+    if backend == 'torch':
+        from torch_mtcnn import create_mtcnn
+        return create_mtcnn(n_threads=n_threads)
+    with tf.Graph().as_default():
+        gpu_options = tf.GPUOptions(per_process_gpu_memory_fraction=1.0)
+        if n_threads is None:
+            config = tf.ConfigProto(gpu_options=gpu_options, log_device_placement=False)
+        else:
+            config = tf.ConfigProto(gpu_options=gpu_options, log_device_placement=False,
+                        intra_op_parallelism_threads=n_threads, inter_op_parallelism_threads=1)
+        sess = tf.Session(config=config)
+        with sess.as_default():
+            pnet, rnet, onet = detect_face.create_mtcnn(sess, None)
+    return pnet, rnet, onet
+
+def to_rgb(img):
+    w, h = img.shape
+    ret = np.empty((w, h, 3), dtype=np.uint8)
+    ret[:, :, 0] = ret[:, :, 1] = ret[:, :, 2] = img
+    return ret
+
+def read_image(image_path):
+    """ returns None if it is not an image """
+    img = misc.imread(image_path)
+    if img.ndim<2: # 数据的维度<2 ，说明都不是一张图片
+        return None
+    if img.ndim == 2: # 数据维度 = 2 ，灰度图，复制3次转化成rgb 3通道图片
+        img = to_rgb(img)
+    return img[:,:,0:3]
+
+def select_face(bounding_boxes, landmark, img_shape):
+    """ (score, bbox, landmark) of the face in the format of `rgbdetect.txt`, see `1_detect_and_savetxt.py` """
+    nrof_faces = bounding_boxes.shape[0]
+    det = bounding_boxes[:,0:4]
+    img_size = np.asarray(img_shape)[0:2]
+    if nrof_faces>1:
+        # 人脸框越大越好，偏移量越小越好
+        bounding_box_size = (det[:,2]-det[:,0])*(det[:,3]-det[:,1]) # (x2-x1)*(y2-y1) 人脸框大小
+        img_center = img_size / 2 # 原图片中心
+        offsets = np.vstack([ (det[:,0]+det[:,2])/2-img_center[1], (det[:,1]+det[:,3])/2-img_center[0] ])
+        offset_dist_squared = np.sum(np.power(offsets,2.0),0)
+        index = np.argmax(bounding_box_size-offset_dist_squared*2.0) # some extra weight on the centering
+        bounding_boxes = bounding_boxes[index,:]
+        landmark = landmark[:,index]
+        bbox = bounding_boxes.tolist()
+        score = bbox[4]
+        bbox = bbox[0:4]
+        new_landmark_modify = np.zeros(landmark.shape)
+        new_landmark_modify[0:10:2] = landmark[0:5]
+        new_landmark_modify[1:11:2] = landmark[5:10]
+        landmark = new_landmark_modify.tolist()
+    else:
+        # 把bbox，landmark的数据格式整理成统一的格式
+        bbox = bounding_boxes.tolist()
+        bbox = [y for x in bbox for y in x]
+        score = bbox[4]
+        bbox = bbox[0:4]
+        # 其中landmark的顺序和我们需要的不一样
+        new_landmark_modify = np.zeros(landmark.shape)
+        new_landmark_modify[0:10:2] = landmark[0:5]
+        new_landmark_modify[1:11:2] = landmark[5:10]
+        landmark = new_landmark_modify.tolist()
+        landmark = [y for x in landmark for y in x]
+    return score, bbox, landmark
+
+def detect_rgb_file(nets, image_path):
+    """ (score, bbox, landmark), or (None, None, None) if no face is detected """
+    pnet, rnet, onet = nets
+    img = read_image(image_path)
+    if img is None:
+        raise ValueError('Unable to align "%s"' % image_path)
+    bounding_boxes, landmark = detect_face.detect_face(img, minsize, pnet, rnet, onet, threshold, factor)
+    if bounding_boxes.shape[0] == 0:
+        return None, None, None
+    return select_face(bounding_boxes, landmark, img.shape)
+
+def detect_multi_dir(nets, imgdir):
+    """ result of the last detected band, as `detect_Multi` of `1_detect_and_savetxt.py` """
+    pnet, rnet, onet = nets
+    result = None, None, None
+    for imgpath in os.listdir(imgdir):
+        image_path = os.path.join(imgdir, imgpath).replace('\\','/')
+        try:
+            img = read_image(image_path)
+        except (IOError, ValueError, IndexError) as e:
+            print('{}: {}'.format(image_path, e))
+            continue
+        if img is None:
+            continue
+        bounding_boxes, landmark = detect_face.detect_face(img, minsize, pnet, rnet, onet, threshold, factor)
+        if bounding_boxes.shape[0] > 0:
+            result = select_face(bounding_boxes, landmark, img.shape)
+    return result
+
+def write_failed(dict_save, paths, filename):
+    """ list the images (or directories) without a detected face in `filename`, followed by the counts
+
+    Params:
+        dict_save:  {dict} {key: (score, bbox, landmark)}
+        paths:      {dict} {key: image_path or imgdir}
+        filename:   {str} e.g. `failedrgb.txt`
+    """
+    nrof_images_total = len(paths)
+    nrof_successfully_aligned = 0
+    with open(filename, "w") as text_file:
+        for key, (score, bbox, landmark) in dict_save.items():
+            if score is None:
+                text_file.write('%s\n' % (paths[key]))
+            else:
+                nrof_successfully_aligned += 1
+        text_file.write('Total number of images: %d \n' % nrof_images_total)
+        text_file.write('Number of successfully aligned images: %d' % nrof_successfully_aligned)
+
+    print('Total number of images: %d' % nrof_images_total)
+    print('Number of successfully aligned images: %d' % nrof_successfully_aligned)
+
+def detect_rgb_farm(rootdir, indoors, outfile, n_workers=4, n_threads=1, resume=True, backend='tf'):
+    """
+    Returns:
+        results:    {dict} {key: (score, bbox, landmark)}, key as in `rgbdetect.txt`
+        paths:      {dict} {key: image_path}
+    """
+    paths = {path[len(rootdir):].split('.')[0]: path for path in list_rgb_files(rootdir, indoors)}
+    results = run_farm(list(paths.items()), partial(init_mtcnn, backend=backend), detect_rgb_file, outfile,
+                        n_workers=n_workers, n_threads=n_threads, resume=resume)
+    return results, paths
+
+def detect_multi_farm(rootdir, indoors, outfile, n_workers=4, n_threads=1, resume=True, backend='tf'):
+    """
+    Returns:
+        results:    {dict} {key: (score, bbox, landmark)}, key as in `multidetect.txt`
+        paths:      {dict} {key: imgdir}
+    """
+    paths = {path[len(rootdir):].split('.')[0]: path for path in list_multi_dirs(rootdir, indoors)}
+    results = run_farm(list(paths.items()), partial(init_mtcnn, backend=backend), detect_multi_dir, outfile,
+                        n_workers=n_workers, n_threads=n_threads, resume=resume)
+    return results, paths